@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+analyze_params.py
+
+モードのパラメータを格子状に振って、実機に送る前にリミット(ABS/REL/SPE)に
+どれだけ掛かるかをオフラインで調べるスクリプト。
+各組み合わせで make_frame と filter_vals と同じリミット処理(limits.py)を
+sender と同じ u(t) で回し、ピーク速度・隣接サーボ間の超過量・リミットが
+掛かったフレームの割合を出す。組み合わせはプロセスプールで並列に評価し、
+結果はパラメータのハッシュごとにキャッシュする。
+
+使い方例:
+    python analyze_params.py 432 --param AMP_FREQ=0.1:1.0:10
+    python analyze_params.py 432 --param AMP_FREQ=0.1:1.0:10 --param ALPHA=0.1,0.2,0.5 --csv sweep.csv
+    python analyze_params.py 432 --param AMP_FREQ=0.1:1.0:10 --param LIMIT_SPEED=2000:8000:7 \\
+        --heatmap sweep.png --metric limited_any
+
+--param KEY=start:stop:num は np.linspace、KEY=a,b,c は値の列挙。
+KEY がトップレベルのパラメータ(ALPHA, LIMIT_*, RATE_fps など)ならそれを、
+それ以外はモードのパラメータ(MODES[mode_id][KEY])を上書きする。
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from osc_params import (
+    ensure_params_loaded,
+    get_params_full,
+    get_params_hash,
+    get_params_mode,
+    use_mode_params,
+)
+from timebase import UTimebase
+from layout import get_layout
+from limits import apply_limits
+import osc_modes
+
+METRICS = (
+    "peak_speed",
+    "peak_relational_excess",
+    "limited_absolute",
+    "limited_relational",
+    "limited_speed",
+    "limited_any",
+)
+# results also depend on the code evaluating them
+CODE_FILES = (
+    "analyze_params.py",
+    "osc_modes.py",
+    "limits.py",
+    "timebase.py",
+    "wavetable.py",
+    "stateful.py",
+    "layout.py",
+)
+
+
+def parse_param(spec):
+    key, _, values = spec.partition("=")
+    if not key or not values:
+        raise argparse.ArgumentTypeError(f"expected KEY=start:stop:num or KEY=a,b,c, got '{spec}'")
+    if ":" in values:
+        start, stop, num = values.split(":")
+        return key, [float(v) for v in np.linspace(float(start), float(stop), int(num))]
+    return key, [float(v) for v in values.split(",")]
+
+
+def with_overrides(params, mode_id, overrides):
+    params = dict(params)
+    params["MODES"] = dict(params.get("MODES", {}))
+    params_mode = dict(params["MODES"].get(mode_id, {}))
+    for key, value in overrides.items():
+        target = params if key in params and key != "MODES" else params_mode
+        current = target.get(key)
+        if isinstance(current, int) and not isinstance(current, bool):
+            value = int(round(value))
+        target[key] = value
+    params["MODES"][mode_id] = params_mode
+    return params
+
+
+def code_hash():
+    h = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        try:
+            with open(os.path.join(base, name), "rb") as f:
+                h.update(f.read())
+        except OSError:
+            pass
+    return h.hexdigest()
+
+
+def analyze(mode_id, params, seconds):
+    """Run mode_id with params for `seconds` like the sender; the metrics."""
+    t0 = time.perf_counter()
+    # wavetables render in the background after WAVETABLE_SETTLE seconds of
+    # wall time, which would make the results depend on the machine
+    params = dict(params, WAVETABLE_SAMPLES=0)
+    with use_mode_params(mode_id, params):
+        params_full = get_params_full()
+        num_servos = int(params_full.get("NUM_SERVOS", 31))
+        rate = float(params_full.get("RATE_fps", 24))
+        alpha = float(params_full.get("ALPHA", 0.2))
+        limit_absolute = params_full.get("LIMIT_ABSOLUTE")
+        limit_relational = params_full.get("LIMIT_RELATIONAL")
+        limit_speed = params_full.get("LIMIT_SPEED") / rate
+        layout = get_layout(params_full)
+
+        # the sender advances t_mode by dt before evaluating a frame
+        num_frames = max(int(round(seconds * rate)), 1)
+        times = np.arange(1, num_frames + 1) / rate
+        us = UTimebase.for_mode(mode_id, params_full, get_params_mode()).u_at(times)
+
+        prev = None
+        peak_speed = peak_excess = 0.0
+        counts = np.zeros(4, dtype=np.int64)  # abs, rel, speed, any
+        for u in us:
+            raw_vals = osc_modes.make_frame(float(u), num_servos)
+            if prev is None:
+                prev = raw_vals
+            vals, flags, (speed, excess) = apply_limits(
+                raw_vals, prev, alpha, limit_absolute, limit_relational, limit_speed, layout
+            )
+            prev = vals
+            peak_speed = max(peak_speed, speed)
+            peak_excess = max(peak_excess, excess)
+            counts += (*flags, any(flags))
+    fractions = counts / num_frames
+    return {
+        "frames": num_frames,
+        "peak_speed": peak_speed * rate,  # steps/s, before the speed limit
+        "peak_relational_excess": peak_excess,  # steps over LIMIT_RELATIONAL's bound
+        "limited_absolute": float(fractions[0]),
+        "limited_relational": float(fractions[1]),
+        "limited_speed": float(fractions[2]),
+        "limited_any": float(fractions[3]),
+        "elapsed": time.perf_counter() - t0,
+    }
+
+
+def read_cache(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, key + ".json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(cache_dir, key, result):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + ".json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    os.replace(path + ".tmp", path)
+
+
+def print_table(keys, rows):
+    header = [*keys, "peak spe/s", "peak rel", "ABS%", "REL%", "SPE%", "any%"]
+    print("  ".join(f"{h:>12s}" for h in header))
+    for combo, result in rows:
+        cells = [f"{v:12.4g}" for v in combo]
+        if "error" in result:
+            cells.append(f"  error: {result['error']}")
+        else:
+            cells += [
+                f"{result['peak_speed']:12.1f}",
+                f"{result['peak_relational_excess']:12.1f}",
+                *(f"{100 * result[m]:12.1f}" for m in METRICS[2:]),
+            ]
+        print("  ".join(cells))
+
+
+def write_csv(path, keys, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([*keys, *METRICS, "error"])
+        for combo, result in rows:
+            writer.writerow([*combo, *(result.get(m) for m in METRICS), result.get("error", "")])
+
+
+def write_heatmap(path, keys, grid, rows, metric):
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, no heatmap.")
+        return
+    values = {combo: result.get(metric, np.nan) for combo, result in rows}
+    image = np.array([[values[(x, y)] for x in grid[0]] for y in grid[1]], dtype=np.float64)
+    fig, ax = plt.subplots()
+    mesh = ax.pcolormesh(grid[0], grid[1], image, shading="nearest")
+    fig.colorbar(mesh, ax=ax, label=metric)
+    ax.set_xlabel(keys[0])
+    ax.set_ylabel(keys[1])
+    fig.savefig(path, dpi=120)
+    print(f"Heatmap written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep mode params and check the output limits offline")
+    parser.add_argument("mode", help="mode id in params.json")
+    parser.add_argument(
+        "--param", action="append", type=parse_param, default=[],
+        help="KEY=start:stop:num or KEY=a,b,c (repeatable)",
+    )
+    parser.add_argument("--seconds", type=float, default=60.0, help="mode time per combination")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--cache", default="analysis_cache", help="result cache directory ('' = off)")
+    parser.add_argument("--csv", help="write the results to this CSV file")
+    parser.add_argument("--heatmap", help="PNG heatmap of --metric (two params only)")
+    parser.add_argument("--metric", choices=METRICS, default="limited_any")
+    args = parser.parse_args()
+
+    ensure_params_loaded()
+    base = get_params_full()
+    mode_id = str(args.mode)
+    if mode_id not in base.get("MODES", {}):
+        parser.error(f"unknown mode {mode_id}")
+
+    keys = [key for key, _ in args.param]
+    grid = [values for _, values in args.param]
+    code = code_hash()
+    rows = {}
+    jobs = {}
+    for combo in itertools.product(*grid):
+        params = with_overrides(base, mode_id, dict(zip(keys, combo)))
+        key = get_params_hash(
+            {"params": dict(params, MODE=mode_id), "seconds": args.seconds, "code": code}
+        )
+        cached = read_cache(args.cache, key) if args.cache else None
+        if cached is not None:
+            rows[combo] = cached
+        else:
+            jobs[combo] = (key, params)
+
+    print(
+        f"Mode {mode_id}: {len(rows) + len(jobs)} combinations "
+        f"({len(rows)} cached), {args.seconds:g}s each"
+    )
+    t0 = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {
+                pool.submit(analyze, mode_id, params, args.seconds): combo
+                for combo, (_, params) in jobs.items()
+            }
+            for future in as_completed(futures):
+                combo = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    rows[combo] = {"error": str(e)}
+                    continue
+                rows[combo] = result
+                if args.cache:
+                    write_cache(args.cache, jobs[combo][0], result)
+        print(f"Evaluated {len(jobs)} combinations in {time.perf_counter() - t0:.1f}s")
+
+    print(
+        f"LIMIT_ABSOLUTE {base.get('LIMIT_ABSOLUTE')}  LIMIT_RELATIONAL {base.get('LIMIT_RELATIONAL')}  "
+        f"LIMIT_SPEED {base.get('LIMIT_SPEED')}/s (before overrides)"
+    )
+    ordered = [(combo, rows[combo]) for combo in itertools.product(*grid)]
+    print_table(keys, ordered)
+    if args.csv:
+        write_csv(args.csv, keys, ordered)
+        print(f"CSV written to {args.csv}")
+    if args.heatmap:
+        if len(keys) != 2:
+            print("--heatmap needs exactly two --param.")
+        else:
+            write_heatmap(args.heatmap, keys, grid, ordered, args.metric)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import threading
+import time
+from logger_config import logger
+
+# Low rate liveness probing of the STEP800 boards.
+#
+# Every HEALTH_INTERVAL seconds each board gets one /getPosition for its
+# first motor. The matching /position reply (or any other /position from
+# that board) marks it alive; the time to the reply is the latency.
+# A probe without reply within the timeout counts as lost.
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+DEAD = "dead"
+UNKNOWN = "unknown"
+
+LOSS_EWMA_ALPHA = 0.2
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class BoardHealth:
+    def __init__(self, board_idx):
+        self.board_idx = board_idx
+        self.state = UNKNOWN
+        self.probe_sent = None
+        self.latency_ms = None
+        self.loss = 0.0
+        self.misses = 0
+        self.probes = 0
+        self.replies = 0
+        self.last_reply = None
+
+    def as_dict(self):
+        return {
+            "board": self.board_idx,
+            "state": self.state,
+            "latency_ms": None if self.latency_ms is None else round(self.latency_ms, 2),
+            "loss": round(self.loss, 3),
+            "consecutive_misses": self.misses,
+            "probes": self.probes,
+            "replies": self.replies,
+            "last_reply": self.last_reply,
+        }
+
+
+class HealthMonitor:
+    def __init__(
+        self,
+        num_boards,
+        send_probe,
+        on_change=None,
+        interval=1.0,
+        timeout=0.5,
+        degraded_latency_ms=100.0,
+        degraded_loss=0.2,
+        dead_misses=3,
+    ):
+        self.boards = [BoardHealth(i) for i in range(num_boards)]
+        self.send_probe = send_probe
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = timeout
+        self.degraded_latency_ms = degraded_latency_ms
+        self.degraded_loss = degraded_loss
+        self.dead_misses = dead_misses
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """Forget probe history, e.g. after the boards were re-initialized."""
+        with self.lock:
+            self.boards = [BoardHealth(b.board_idx) for b in self.boards]
+
+    def on_reply(self, board_idx, t=None):
+        if board_idx < 0 or board_idx >= len(self.boards):
+            return
+        t = time.time() if t is None else t
+        with self.lock:
+            b = self.boards[board_idx]
+            b.last_reply = t
+            if b.probe_sent is None:
+                return
+            latency_ms = (t - b.probe_sent) * 1000
+            b.probe_sent = None
+            b.replies += 1
+            b.misses = 0
+            b.loss = (1 - LOSS_EWMA_ALPHA) * b.loss
+            b.latency_ms = (
+                latency_ms
+                if b.latency_ms is None
+                else (1 - LATENCY_EWMA_ALPHA) * b.latency_ms
+                + LATENCY_EWMA_ALPHA * latency_ms
+            )
+        self._update_state(board_idx)
+
+    def _classify(self, b):
+        if b.misses >= self.dead_misses:
+            return DEAD
+        if b.replies == 0:
+            return UNKNOWN if b.misses == 0 else DEGRADED
+        if (
+            b.misses > 0
+            or b.loss >= self.degraded_loss
+            or (b.latency_ms is not None and b.latency_ms >= self.degraded_latency_ms)
+        ):
+            return DEGRADED
+        return HEALTHY
+
+    def _update_state(self, board_idx):
+        with self.lock:
+            b = self.boards[board_idx]
+            old = b.state
+            b.state = self._classify(b)
+            new = b.state
+            info = b.as_dict()
+        if old != new and self.on_change is not None:
+            try:
+                self.on_change(board_idx, old, new, info)
+            except Exception as e:
+                logger.error("Board health callback error: %s", e)
+
+    def check_timeouts(self, now=None):
+        now = time.time() if now is None else now
+        expired = []
+        with self.lock:
+            for b in self.boards:
+                if b.probe_sent is not None and now - b.probe_sent > self.timeout:
+                    b.probe_sent = None
+                    b.misses += 1
+                    b.loss = (1 - LOSS_EWMA_ALPHA) * b.loss + LOSS_EWMA_ALPHA
+                    expired.append(b.board_idx)
+        for board_idx in expired:
+            self._update_state(board_idx)
+
+    def probe_all(self):
+        now = time.time()
+        for b in self.boards:
+            with self.lock:
+                if b.probe_sent is not None:
+                    continue  # still waiting, check_timeouts decides
+                b.probe_sent = now
+                b.probes += 1
+            try:
+                self.send_probe(b.board_idx)
+            except Exception as e:
+                logger.debug("Health probe to board %d failed: %s", b.board_idx, e)
+
+    def run(self, stop_event, enabled=lambda: True):
+        while not stop_event.is_set():
+            if enabled():
+                self.check_timeouts()
+                self.probe_all()
+                stop_event.wait(self.timeout)
+                self.check_timeouts()
+                stop_event.wait(max(self.interval - self.timeout, 0.0))
+            else:
+                stop_event.wait(self.interval)
+
+    def snapshot(self):
+        with self.lock:
+            return [b.as_dict() for b in self.boards]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+bootstrap.py
+
+ritsudo_server の起動手順。モジュールはimport時にI/Oをしない(ログファイル、
+params.json、ソケットはここで順に開く)ので、各段階の所要時間と
+`-X importtime` 相当のimport内訳をその場で出せる。
+
+使い方例:
+    python bootstrap.py                    # サーバ起動(起動時間の要約をログに出す)
+    python bootstrap.py --import-report 20 # 自己時間の長いimport上位20件も出す
+    python bootstrap.py --dry-run          # 起動せず、時間だけ測って終了
+"""
+
+import argparse
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+_t_start = time.perf_counter()
+_prepared = False
+
+
+def _absolute_name(name, globals, level):
+    if level == 0 or not globals:
+        return name
+    base = (globals.get("__package__") or "").rsplit(".", level - 1)[0]
+    return f"{base}.{name}" if name else base
+
+
+class ImportTimer:
+    """Time every first-time import made inside the block.
+
+    Each record is (module, depth, cumulative ms, self ms), in completion
+    order like `python -X importtime`.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._orig_import = None
+
+    def __enter__(self):
+        orig_import = builtins.__import__
+        stack = []  # time spent in nested imports, per open level
+        records = self.records
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            full_name = _absolute_name(name, globals, level)
+            if full_name in sys.modules:
+                return orig_import(name, globals, locals, fromlist, level)
+            stack.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                return orig_import(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = time.perf_counter() - t0
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                records.append((full_name, len(stack), elapsed * 1000, (elapsed - nested) * 1000))
+
+        self._orig_import = orig_import
+        builtins.__import__ = timed_import
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self._orig_import
+        return False
+
+    def top_level_ms(self):
+        return sum(r[2] for r in self.records if r[1] == 0)
+
+    def report(self, limit=20):
+        lines = ["  self[ms]  cumul[ms]  module"]
+        for name, depth, cumul, self_ms in sorted(
+            self.records, key=lambda r: r[3], reverse=True
+        )[:limit]:
+            lines.append(f"  {self_ms:8.1f}  {cumul:9.1f}  {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+_steps = []  # (name, ms)
+
+
+@contextmanager
+def _step(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _steps.append((name, (time.perf_counter() - t0) * 1000))
+
+
+def prepare_runtime(log_file=None):
+    """Logger, params and board sockets, in that order. Safe to call twice."""
+    global _prepared
+    if _prepared:
+        return
+    from logger_config import setup_logger, LOG_FILE
+
+    with _step("logger"):
+        setup_logger(LOG_FILE if log_file is None else log_file)
+    with _step("params"):
+        from osc_params import ensure_params_loaded
+
+        ensure_params_loaded()
+    with _step("board sockets"):
+        from osc_sender import open_clients
+
+        open_clients()
+    _prepared = True
+
+
+def startup_report(timer=None, limit=0):
+    lines = [f"Startup {(time.perf_counter() - _t_start) * 1000:.1f} ms"]
+    if timer is not None:
+        lines.append(f"  {'imports':14s}{timer.top_level_ms():8.1f} ms")
+    for name, ms in _steps:
+        lines.append(f"  {name:14s}{ms:8.1f} ms")
+    if timer is not None and limit > 0:
+        lines.append(f"Slowest imports (top {limit} by self time):")
+        lines.append(timer.report(limit))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start ritsudo_server")
+    parser.add_argument(
+        "--import-report",
+        type=int,
+        default=0,
+        metavar="N",
+        help="also list the N imports with the longest self time",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="measure the startup and exit"
+    )
+    args = parser.parse_args()
+
+    with ImportTimer() as timer:
+        import ritsudo_server
+    prepare_runtime()
+
+    from logger_config import logger
+
+    logger.info(startup_report(timer, args.import_report))
+    if args.dry_run:
+        return
+    ritsudo_server.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import numpy as np
+from osc_params import use_mode_params
+from stateful import stateful_context, stateful_modes
+
+# Transitions between modes.
+#
+# The outgoing mode keeps running (along its own u(t) schedule, with the
+# params of its last frame) while the incoming one starts at u=0; every frame both are evaluated once as
+# arrays and blended per servo:
+#
+#   x_i = clip((elapsed - delay_i) / duration, 0, 1)
+#   out = offset + (outgoing - offset) * w_out(x) + (incoming - offset) * w_in(x)
+#
+# Blending is done around STROKE_OFFSET so equal_power does not lift the
+# whole sculpture. delay_i spreads the start over the servos; a wipe of W
+# seconds starts servo 0 first and the last servo W seconds later (W < 0
+# runs the other way along the helix).
+
+
+def _linear(x):
+    return 1.0 - x, x
+
+
+def _smoothstep(x):
+    w = x * x * (3.0 - 2.0 * x)
+    return 1.0 - w, w
+
+
+def _equal_power(x):
+    return np.cos(x * (np.pi / 2)), np.sin(x * (np.pi / 2))
+
+
+CURVES = {
+    "linear": _linear,
+    "smoothstep": _smoothstep,
+    "equal_power": _equal_power,
+}
+
+
+def wipe_delays(num_servos, wipe):
+    ramp = np.linspace(0.0, 1.0, num_servos) if num_servos > 1 else np.zeros(num_servos)
+    if wipe < 0:
+        ramp = ramp[::-1]
+    return ramp * abs(wipe)
+
+
+class OutgoingMode:
+    """A mode that keeps running during a transition."""
+
+    def __init__(self, module, mode_id, timebase, t, num_servos, params_full):
+        self.module = module
+        self.mode_id = mode_id
+        self.timebase = timebase
+        self.t = t
+        self.num_servos = num_servos
+        self.params_full = params_full
+        # stateful modes go on from where the sender left them; the
+        # incoming mode starts new runners
+        self.token = object()
+        stateful_modes.detach(self.token)
+
+    def frame(self, dt):
+        self.t += dt
+        with use_mode_params(self.mode_id, self.params_full), stateful_context(self.token):
+            return self.module.make_frame(self.timebase.u_at(self.t), self.num_servos)
+
+
+class Transition:
+    def __init__(self, num_servos, duration, curve="linear", wipe=0.0, offset=0.0,
+                 outgoing=None, frozen=None):
+        """Either `outgoing` (an OutgoingMode) or `frozen` (a fixed frame) fades out."""
+        if curve not in CURVES:
+            raise ValueError(f"unknown crossfade curve '{curve}'")
+        self.curve = CURVES[curve]
+        self.duration = max(float(duration), 1e-6)
+        self.delays = wipe_delays(num_servos, float(wipe))
+        self.total = self.duration + abs(float(wipe))
+        self.offset = float(offset)
+        self.outgoing = outgoing
+        self.frozen = None if frozen is None else np.asarray(frozen, dtype=np.float64)
+        self.elapsed = 0.0
+
+    @property
+    def done(self):
+        return self.elapsed >= self.total
+
+    def step(self, incoming, dt):
+        """Blend this frame of the incoming mode with the outgoing one."""
+        if self.outgoing is not None:
+            try:
+                out = np.asarray(self.outgoing.frame(dt), dtype=np.float64)
+            except Exception:
+                # e.g. the outgoing mode was removed: hold what it last did
+                self.frozen = getattr(self, "_last_out", None)
+                self.outgoing = None
+                out = self.frozen if self.frozen is not None else incoming
+            self._last_out = out
+        else:
+            out = self.frozen if self.frozen is not None else incoming
+        x = np.clip((self.elapsed - self.delays) / self.duration, 0.0, 1.0)
+        w_out, w_in = self.curve(x)
+        self.elapsed += dt
+        incoming = np.asarray(incoming, dtype=np.float64)
+        return self.offset + (out - self.offset) * w_out + (incoming - self.offset) * w_in
@@ -0,0 +1,242 @@
+import os
+import struct
+import threading
+import time
+import numpy as np
+from logger_config import logger
+from crossfade import Transition
+
+# Append-only recording of the sender output.
+#
+#   header (HEADER_SIZE bytes):
+#     8s magic, uint16 version, uint16 header size, uint32 NUM_SERVOS,
+#     float32 RATE_fps, float64 creation time, 32s sha256 of params
+#   frames (FRAME_DTYPE, back to back until EOF):
+#     float64 t, uint32 limit flags, int32[NUM_SERVOS] filtered values
+#
+# The values are the filtered frame in spiral order (before
+# MOTOR_POSITION_MAPPING), exactly what went into
+# send_all_setTargetPositionList. A recording can be opened with
+# np.memmap without reading it into RAM, see open_recording().
+
+MAGIC = b"KFYFRM01"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIfd32s")
+HEADER_SIZE = 64
+
+LIMIT_ABSOLUTE_FLAG = 1
+LIMIT_RELATIONAL_FLAG = 2
+LIMIT_SPEED_FLAG = 4
+
+RECORDINGS_DIR = "recordings"
+
+
+def frame_dtype(num_servos):
+    return np.dtype(
+        [("t", "<f8"), ("flags", "<u4"), ("vals", "<i4", (int(num_servos),))]
+    )
+
+
+def limit_flags(limited_absolute, limited_relational, limited_speed):
+    return (
+        (LIMIT_ABSOLUTE_FLAG if limited_absolute else 0)
+        | (LIMIT_RELATIONAL_FLAG if limited_relational else 0)
+        | (LIMIT_SPEED_FLAG if limited_speed else 0)
+    )
+
+
+class FrameRecorder:
+    def __init__(self, path, num_servos, rate_fps, params_hash, flush_every=100):
+        self.path = path
+        self.num_servos = int(num_servos)
+        self.dtype = frame_dtype(self.num_servos)
+        self.flush_every = flush_every
+        self.frames = 0
+        self._row = np.zeros(1, dtype=self.dtype)
+
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            HEADER_SIZE,
+            self.num_servos,
+            float(rate_fps),
+            time.time(),
+            bytes.fromhex(params_hash),
+        )
+        self.f = open(path, "wb")
+        self.f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, vals, flags=0, t=None):
+        row = self._row
+        row["t"] = time.time() if t is None else t
+        row["flags"] = flags
+        row["vals"][0] = np.rint(vals)
+        self.f.write(row.tobytes())
+        self.frames += 1
+        if self.frames % self.flush_every == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.flush()
+        self.f.close()
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER.size:
+        raise ValueError(f"{path}: file too short for a recording header")
+    magic, version, header_size, num_servos, rate_fps, created, params_hash = (
+        HEADER.unpack_from(raw, 0)
+    )
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a frame recording")
+    return {
+        "version": version,
+        "header_size": header_size,
+        "num_servos": num_servos,
+        "rate_fps": rate_fps,
+        "created": created,
+        "params_hash": params_hash.hex(),
+    }
+
+
+def open_recording(path):
+    """Return (header, frames) with frames as a read-only np.memmap."""
+    header = read_header(path)
+    dtype = frame_dtype(header["num_servos"])
+    # a trailing partial frame (e.g. crash while recording) is ignored
+    count = (os.path.getsize(path) - header["header_size"]) // dtype.itemsize
+    if count <= 0:
+        return header, np.zeros(0, dtype=dtype)
+    frames = np.memmap(
+        path, dtype=dtype, mode="r", offset=header["header_size"], shape=(count,)
+    )
+    return header, frames
+
+
+# --- Active recording of the running sender ---
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def recording_path(name):
+    """Path of a client-supplied file name, always inside RECORDINGS_DIR."""
+    name = str(name)
+    if not name or name in (".", "..") or os.path.basename(name) != name or "\\" in name:
+        raise ValueError(f"expected a file name without directories, got '{name}'")
+    return os.path.join(RECORDINGS_DIR, name)
+
+
+def start_recording(num_servos, rate_fps, params_hash, name=None):
+    global _recorder
+    if name is None:
+        name = time.strftime("%Y%m%d-%H%M%S") + ".kfyrec"
+    path = recording_path(name)
+    os.makedirs(RECORDINGS_DIR, exist_ok=True)
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.close()
+        _recorder = FrameRecorder(path, num_servos, rate_fps, params_hash)
+    logger.info("Recording frames to %s", path)
+    return path
+
+
+def stop_recording():
+    global _recorder
+    with _recorder_lock:
+        recorder = _recorder
+        _recorder = None
+        if recorder is None:
+            return None
+        recorder.close()
+    logger.info("Recorded %d frames to %s", recorder.frames, recorder.path)
+    return {"path": recorder.path, "frames": recorder.frames}
+
+
+def is_recording():
+    return _recorder is not None
+
+
+def record_frame(vals, flags=0):
+    if _recorder is None:
+        return
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.append(vals, flags)
+
+
+# --- Replay ---
+def peak_step(frames, chunk=4096):
+    """Largest per-frame change of any servo in a recording (steps).
+
+    Reads a memmapped recording chunk by chunk, not into RAM as a whole.
+    """
+    peak = 0
+    last = None  # last row of the previous chunk
+    for start in range(0, len(frames), chunk):
+        vals = frames["vals"][start : start + chunk].astype(np.int64)
+        if last is not None:
+            peak = max(peak, int(np.max(np.abs(vals[0] - last))))
+        if len(vals) > 1:
+            peak = max(peak, int(np.max(np.abs(np.diff(vals, axis=0)))))
+        last = vals[-1]
+    return float(peak)
+
+
+def replay_recording(path, stop_event, send_func, speed=1.0, loop=False,
+                     start_vals=None, easing=1.0, max_speed=None):
+    """Stream a recording through send_func(vals, dt) with the recorded
+    timing / speed; dt is the time since the previous frame.
+
+    No mode is evaluated; speed=2.0 plays twice as fast. Playback eases in
+    from start_vals (the current position) to the first frame, and from the
+    last frame back to the first one when looping, over `easing` seconds or
+    longer if needed to stay within max_speed (steps/s).
+    """
+    if speed <= 0:
+        raise ValueError(f"replay speed must be > 0, got {speed}")
+    header, frames = open_recording(path)
+    if len(frames) == 0:
+        logger.warning("Recording %s has no frames", path)
+        return 0
+    logger.info(
+        "Replaying %s: %d frames at x%.2f (recorded at %.1f fps)",
+        path,
+        len(frames),
+        speed,
+        header["rate_fps"],
+    )
+    dt = 1.0 / (max(float(header["rate_fps"]), 1e-3) * speed)
+    first = frames[0]["vals"].astype(np.float64)
+    sent = 0
+    while not stop_event.is_set():
+        if start_vals is not None:
+            duration = easing
+            if max_speed:
+                distance = float(np.max(np.abs(first - np.asarray(start_vals, dtype=np.float64))))
+                duration = max(duration, distance / max_speed)
+            transition = Transition(len(first), duration, frozen=start_vals)
+            while not transition.done and not stop_event.wait(dt):
+                send_func(np.rint(transition.step(first, dt)).astype(int).tolist(), dt)
+                sent += 1
+        t_rec0 = float(frames[0]["t"])
+        t_play0 = time.time()
+        t_prev = float(frames[0]["t"]) - dt * speed
+        for frame in frames:
+            if stop_event.is_set():
+                break
+            due = t_play0 + (float(frame["t"]) - t_rec0) / speed
+            sleep_time = due - time.time()
+            if sleep_time > 0:
+                stop_event.wait(sleep_time)
+                if stop_event.is_set():
+                    break
+            send_func(frame["vals"].tolist(), (float(frame["t"]) - t_prev) / speed)
+            t_prev = float(frame["t"])
+            sent += 1
+        if not loop:
+            break
+        start_vals = frames[-1]["vals"]
+    logger.info("Replay of %s finished after %d frames", path, sent)
+    return sent
@@ -0,0 +1,172 @@
+import bisect
+import threading
+from collections import deque
+import numpy as np
+from logger_config import logger
+
+# Frames streamed in from outside (Grasshopper, TouchDesigner, ...).
+#
+#   /frame seq timestamp v0 v1 ... v(N-1)
+#
+# seq counts up by one per frame, timestamp is the sender's time of the
+# frame in seconds (keep it small, e.g. since the stream started: OSC floats
+# are 32 bit), values are absolute positions like the output of make_frame.
+# With INPUT_SOURCE "stream" the sender takes its frames from here instead of
+# from the modes; they still go through filter_vals.
+#
+# Playout: a frame is due at timestamp + offset + FRAME_STREAM_DELAY, where
+# offset is the smallest (arrival - timestamp) over the last OFFSET_WINDOW
+# frames, i.e. the clock offset plus the fastest transit. Output frames are
+# interpolated between the two buffered frames around the due time, which
+# also bridges lost frames. A frame arriving after its time has been played
+# is late and dropped; seq numbers skipped by the playout count as lost
+# (late frames included). When the buffer runs dry the last output is held.
+# Frames behind the playout horizon are dropped on arrival as well, so the
+# buffer stays small while the sender is not playing the stream.
+
+OFFSET_WINDOW = 200
+SEEN_WINDOW = 1024  # seq numbers remembered for duplicate detection
+# the source restarted: seq jumps back by more than RESTART_GAP, the timestamp
+# falls RESTART_LAG seconds behind the stream, or seq goes back while the
+# timestamp goes past the newest one
+RESTART_GAP = 1000
+RESTART_LAG = 2.0
+MAX_BUFFERED = 1024
+
+
+class JitterBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "invalid": 0,
+            "duplicates": 0,
+            "late": 0,
+            "lost": 0,
+            "reordered": 0,
+            "underruns": 0,
+            "restarts": 0,
+        }
+        self._reset()
+
+    def _reset(self):
+        self.ts = []  # sorted timestamps of the buffered frames
+        self.seqs = []
+        self.vals = []
+        self.seen = set()
+        self.seen_order = deque()
+        self.offsets = deque(maxlen=OFFSET_WINDOW)
+        self.offset = None
+        self.max_seq = None
+        self.max_ts = None
+        self.played_ts = None  # stream time played up to
+        self.played_seq = None  # highest seq the playout has passed
+        self.last_arrival = None
+        self.delay = 0.1  # of the last frame() call
+
+    def push(self, seq, timestamp, vals, now, num_servos=None):
+        vals = np.asarray(vals, dtype=np.float64)
+        with self.lock:
+            self.stats["received"] += 1
+            if (num_servos is not None and len(vals) != num_servos) or not np.all(np.isfinite(vals)):
+                self.stats["invalid"] += 1
+                return
+            if self._restarted(seq, timestamp):
+                logger.info(
+                    "Frame stream restarted (seq %d, t %.3f after seq %d, t %.3f).",
+                    seq, timestamp, self.max_seq, self.max_ts,
+                )
+                self.stats["restarts"] += 1
+                self._reset()
+            if seq in self.seen:
+                self.stats["duplicates"] += 1
+                return
+            self.seen.add(seq)
+            self.seen_order.append(seq)
+            if len(self.seen_order) > SEEN_WINDOW:
+                self.seen.discard(self.seen_order.popleft())
+            self.last_arrival = now
+            self.offsets.append(now - timestamp)
+            self.offset = min(self.offsets)
+
+            if self.played_ts is not None and timestamp <= self.played_ts:
+                self.stats["late"] += 1
+                return
+            if self.max_seq is not None and seq < self.max_seq:
+                self.stats["reordered"] += 1
+            self.max_seq = seq if self.max_seq is None else max(self.max_seq, seq)
+            self.max_ts = timestamp if self.max_ts is None else max(self.max_ts, timestamp)
+            i = bisect.bisect_right(self.ts, timestamp)
+            self.ts.insert(i, timestamp)
+            self.seqs.insert(i, seq)
+            self.vals.insert(i, vals)
+            # keep the last frame before the horizon for interpolation
+            i = bisect.bisect_right(self.ts, now - self.offset - self.delay)
+            self._trim(max(i - 1, len(self.ts) - MAX_BUFFERED, 0))
+
+    def _restarted(self, seq, timestamp):
+        if self.max_seq is None:
+            return False
+        if seq < self.max_seq - RESTART_GAP:
+            return True
+        newest = self.max_ts if self.played_ts is None else max(self.max_ts, self.played_ts)
+        return timestamp < newest - RESTART_LAG or (seq < self.max_seq and timestamp > self.max_ts)
+
+    def reject(self):
+        # a /frame message that could not be parsed
+        with self.lock:
+            self.stats["received"] += 1
+            self.stats["invalid"] += 1
+
+    def _trim(self, i):
+        # the frames before index i are passed by the playout
+        for seq in self.seqs[:i]:
+            self._played(seq)
+        del self.ts[:i], self.seqs[:i], self.vals[:i]
+
+    def _played(self, seq):
+        if self.played_seq is not None:
+            self.stats["lost"] += max(seq - self.played_seq - 1, 0)
+            seq = max(seq, self.played_seq)
+        self.played_seq = seq
+
+    def frame(self, now, delay=0.1):
+        """Values due at wall time `now`, or None before the first frame."""
+        with self.lock:
+            if not self.ts:
+                return None
+            self.delay = delay
+            t = now - self.offset - delay
+            if self.played_ts is not None:
+                t = max(t, self.played_ts)
+            i = bisect.bisect_right(self.ts, t)
+            if i == 0:
+                return None  # still filling up
+            self.played_ts = t
+            # frames before i - 1 are no longer needed for interpolation
+            self._trim(i - 1)
+            if len(self.ts) == 1:
+                self.stats["underruns"] += 1
+                self._played(self.seqs[0])
+                return self.vals[0].copy()
+            t0, t1 = self.ts[0], self.ts[1]
+            f = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+            a = self.vals[0]
+            return a + (self.vals[1] - a) * f
+
+    def clear(self):
+        with self.lock:
+            self._reset()
+
+    def get_stats(self, now=None):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["buffered"] = len(self.ts)
+            stats["offset_ms"] = None if self.offset is None else self.offset * 1000
+            stats["last_seq"] = self.max_seq
+            if now is not None and self.last_arrival is not None:
+                stats["last_arrival_age"] = now - self.last_arrival
+        return stats
+
+
+frame_stream = JitterBuffer()
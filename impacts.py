@@ -0,0 +1,170 @@
+import math
+import threading
+import numpy as np
+from logger_config import logger
+from osc_params import get_params_full
+from layout import get_layout
+
+# Superposed impulse sources for the damped locational AMP_MODEs.
+#
+# A source starts at mode time `start` (u, as passed to make_frame) at an
+# origin (x, y, z) in layout coordinates and reaches servo i after
+# distance_i / (2 pi freq) * convey seconds; from then on it contributes
+#   gain * exp(-damping * tau) * sin(2 pi freq * tau)
+# (times the servo direction . origin direction for the displace mode).
+# All sources are evaluated together as (K, num_servos) arrays and summed
+# over K, together with the single source of the mode params.
+#
+# Sources are spawned at runtime (/Impact) and removed once their envelope
+# fell below IMPACT_CULL at the farthest servo, or after IMPACT_MAX_AGE
+# for an undamped one. Like the start and all expiries, IMPACT_MAX_AGE is in
+# u (seconds at a mode speed of 1), not wall-clock seconds. At most IMPACT_MAX_SOURCES are kept; the
+# oldest is dropped for a new one. Culling runs on the sender's mode clock
+# (cull(u) every frame) since make_frame is also evaluated at other times
+# (validation, keyframes ahead). Sources live on the timeline of the running
+# mode, so a mode switch clears them.
+
+FIELDS = ("start", "freq", "damping", "convey", "gain", "expiry")
+
+
+def superpose(t, start, freq, damping, convey, gain, distances, dots=None):
+    """Sum of K sources at time t; (K,) parameters, (K, N) distances/dots."""
+    with np.errstate(all="ignore"):
+        t_i = (t - start)[:, None] - distances / (2 * math.pi * freq)[:, None] * convey[:, None]
+        reached = t_i >= 0
+        t_i = np.where(reached, t_i, 0.0)
+        vals = (
+            gain[:, None]
+            * np.exp(-damping[:, None] * t_i)
+            * np.sin(2 * math.pi * freq[:, None] * t_i)
+        )
+        if dots is not None:
+            vals = vals * dots
+    return np.sum(np.where(reached, vals, 0.0), axis=0)
+
+
+def _empty():
+    sources = {key: np.zeros(0) for key in FIELDS}
+    sources["origin"] = np.zeros((0, 3))
+    return sources
+
+
+class ImpactBank:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = _empty()  # replaced as a whole, read without the lock
+        self.next_expiry = math.inf
+        self.generation = 0  # changes with every spawn/clear (keyframe key)
+        self._fields = (None, None, None, None)  # (key, distances, dots, sources)
+        self.stats = {"spawned": 0, "culled": 0, "dropped": 0, "max_active": 0}
+
+    def spawn(self, t, origin, freq, damping, convey, gain=1.0):
+        params_full = get_params_full()
+        origin = np.asarray(origin, dtype=np.float64).reshape(3)
+        freq, damping, convey, gain = float(freq), float(damping), float(convey), float(gain)
+        if not (freq > 0 and math.isfinite(freq)):
+            raise ValueError(f"impact frequency must be > 0, got {freq}")
+        if not all(math.isfinite(v) for v in (damping, convey, gain, *origin)):
+            raise ValueError("impact parameters must be finite")
+
+        layout = get_layout(params_full)
+        farthest = float(np.max(np.linalg.norm(layout.positions - origin, axis=1), initial=0.0))
+        delay = max(farthest / (2 * math.pi * freq) * convey, 0.0)
+        lifetime = float(params_full.get("IMPACT_MAX_AGE", 60.0))
+        if damping > 0:
+            cull = float(params_full.get("IMPACT_CULL", 1e-3))
+            lifetime = min(math.log(1.0 / max(cull, 1e-12)) / damping, lifetime)
+        row = {
+            "start": t,
+            "freq": freq,
+            "damping": damping,
+            "convey": convey,
+            "gain": gain,
+            "expiry": t + delay + lifetime,
+        }
+        max_sources = max(int(params_full.get("IMPACT_MAX_SOURCES", 64)), 1)
+        with self.lock:
+            self._cull(t)
+            sources = {key: np.append(self.sources[key], row[key]) for key in FIELDS}
+            sources["origin"] = np.vstack([self.sources["origin"], origin])
+            excess = len(sources["start"]) - max_sources
+            if excess > 0:
+                sources = {key: v[excess:] for key, v in sources.items()}
+                self.stats["dropped"] += excess
+            self._set(sources)
+            self.generation += 1
+            self.stats["spawned"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], len(sources["start"]))
+            active = len(sources["start"])
+        logger.debug("Impact at %s (t=%.2f), %d active", origin, t, active)
+        return active
+
+    def _set(self, sources):
+        self.sources = sources
+        self.next_expiry = float(np.min(sources["expiry"], initial=math.inf))
+
+    def _cull(self, t):
+        if t < self.next_expiry:
+            return
+        keep = self.sources["expiry"] > t
+        self.stats["culled"] += int(np.count_nonzero(~keep))
+        self._set({key: v[keep] for key, v in self.sources.items()})
+
+    def cull(self, t):
+        """Remove the sources that have died out by mode time t."""
+        if t < self.next_expiry:
+            return
+        with self.lock:
+            self._cull(t)
+
+    def clear(self):
+        with self.lock:
+            if len(self.sources["start"]):
+                self._set(_empty())
+            self.generation += 1
+
+    def _source_fields(self, sources, num_servos):
+        # distances/dots of the sources to the servos, per sources/layout
+        layout = get_layout()
+        key = (id(sources), id(layout), num_servos)
+        cached = self._fields
+        if cached[0] == key:
+            return cached[1], cached[2]
+        positions = layout.positions[:num_servos]
+        origins = sources["origin"]
+        distances = np.linalg.norm(positions[None, :, :] - origins[:, None, :], axis=-1)
+        norms = np.maximum(np.linalg.norm(origins, axis=1), 1e-12)
+        dots = (origins / norms[:, None]) @ layout.directions[:num_servos].T
+        # keeps `sources` alive so its id is not reused while cached
+        self._fields = (key, distances, dots, sources)
+        return distances, dots
+
+    def evaluate(self, t, num_servos, own=None, displace=False):
+        """Sum of all sources at t, plus `own` = (freq, damping, convey,
+        distances, dots) of the mode params starting at 0."""
+        sources = self.sources
+        columns = [sources[key] for key in FIELDS[:5]]
+        if len(sources["start"]):
+            distances, dots = self._source_fields(sources, num_servos)
+        else:
+            distances, dots = np.zeros((0, num_servos)), np.zeros((0, num_servos))
+        if own is not None:
+            freq, damping, convey, own_distances, own_dots = own
+            own_columns = (0.0, freq, damping, convey, 1.0)
+            columns = [np.concatenate(([x], v)) for x, v in zip(own_columns, columns)]
+            distances = np.vstack([own_distances, distances])
+            if displace:
+                dots = np.vstack([own_dots, dots])
+        return superpose(t, *columns, distances, dots if displace else None)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            sources = self.sources
+            stats["active"] = len(sources["start"])
+            stats["generation"] = self.generation
+            stats["next_expiry"] = None if math.isinf(self.next_expiry) else self.next_expiry
+        return stats
+
+
+impacts = ImpactBank()
@@ -0,0 +1,157 @@
+import math
+import threading
+import numpy as np
+from logger_config import logger
+
+# Multi-rate frame generation.
+#
+# make_frame is evaluated only on a grid of keyframes u = k * interval
+# (KEYFRAME_RATE per second of u) and the output frames in between are
+# Catmull-Rom (cubic Hermite) interpolated over all servos at once.
+#
+# Error bound: every new keyframe is also predicted from the three before
+# it (quadratic extrapolation). That costs no extra evaluation and,
+# divided by EXTRAPOLATION_RATIO, estimates the interpolation error. An
+# estimate above max_error means the mode has structure finer than the
+# keyframe grid (soliton pulses, random steps, ...) and the generator falls
+# back to evaluating every frame until the mode, params or osc_modes change.
+# Jumps, which that ratio underestimates (e.g. a window wrapping around),
+# show up as a spike of the extrapolation error: the intervals around such
+# a keyframe get one exactly evaluated frame to compare with, as does one
+# frame in every `verify_every`-th interval. A jump that is small compared
+# to the motion itself can still overshoot for a few frames; set
+# KEYFRAME_RATE to 0 for modes where that matters.
+
+# extrapolation error / actual interpolation error was 24..80 on the
+# smooth modes; 16 errs on the safe side
+EXTRAPOLATION_RATIO = 16.0
+SPIKE_RATIO = 4.0  # vs. the running mean of the extrapolation error
+
+
+class KeyframeGenerator:
+    def __init__(self, interval=0.1, max_error=100.0, settle=0.25, verify_every=4):
+        self.interval = interval
+        self.max_error = max_error
+        self.settle = settle  # direct evaluation after a source change
+        self.verify_every = verify_every
+        self.last_verified = None  # keyframe index
+        self.suspects = set()  # keyframe indices with an error spike
+        self.mean_error = None
+        self.keys = {}  # keyframe index: values
+        self.source = None
+        self.source_time = None
+        self.fallback = False
+        self.lock = threading.Lock()
+        self.stats = {
+            "frames": 0,
+            "evaluations": 0,
+            "fallbacks": 0,
+            "last_error": None,
+            "max_error_seen": 0.0,
+            "verified": 0,
+            "max_verify_error": 0.0,
+        }
+
+    def configure(self, interval, max_error, settle=None):
+        if interval != self.interval:
+            self.keys.clear()
+        self.interval = interval
+        self.max_error = max_error
+        if settle is not None:
+            self.settle = settle
+
+    def _evaluate(self, evaluate, u):
+        self.stats["evaluations"] += 1
+        return np.asarray(evaluate(u), dtype=np.float64)
+
+    def _fall_back(self, err):
+        self.fallback = True
+        self.stats["fallbacks"] += 1
+        logger.info(
+            "Keyframe error %.1f > %.1f, evaluating every frame for this mode.",
+            err,
+            self.max_error,
+        )
+
+    def _check(self, k, vals):
+        p0 = self.keys.get(k - 3)
+        p1 = self.keys.get(k - 2)
+        p2 = self.keys.get(k - 1)
+        if p0 is None or p1 is None or p2 is None:
+            return
+        err = float(np.max(np.abs(vals - (3 * p2 - 3 * p1 + p0)))) / EXTRAPOLATION_RATIO
+        self.stats["last_error"] = err
+        self.stats["max_error_seen"] = max(self.stats["max_error_seen"], err)
+        if err > self.max_error:
+            self._fall_back(err)
+        elif self.mean_error is not None and err > max(
+            SPIKE_RATIO * self.mean_error, self.max_error / SPIKE_RATIO / EXTRAPOLATION_RATIO
+        ):
+            self.suspects.add(k)
+        self.mean_error = err if self.mean_error is None else 0.9 * self.mean_error + 0.1 * err
+
+    def _key(self, k, evaluate):
+        vals = self.keys.get(k)
+        if vals is None:
+            vals = self._evaluate(evaluate, k * self.interval)
+            self._check(k, vals)
+            self.keys[k] = vals
+        return vals
+
+    def frame(self, u, source, evaluate, now):
+        """Values at u; `source` identifies mode/params/module, `now` is wall time."""
+        with self.lock:
+            self.stats["frames"] += 1
+            if source != self.source:
+                self.source = source
+                self.source_time = now
+                self.keys.clear()
+                self.fallback = False
+                self.last_verified = None
+                self.suspects.clear()
+                self.mean_error = None
+            if self.fallback or now - self.source_time < self.settle:
+                return self._evaluate(evaluate, u)
+
+            x = u / self.interval
+            k = int(math.floor(x))
+            p0 = self._key(k - 1, evaluate)
+            p1 = self._key(k, evaluate)
+            p2 = self._key(k + 1, evaluate)
+            p3 = self._key(k + 2, evaluate)
+            for old in [j for j in self.keys if j < k - 1]:
+                del self.keys[old]
+            self.suspects = {j for j in self.suspects if j >= k - 1}
+            if self.fallback:
+                return self._evaluate(evaluate, u)
+
+            s = x - k
+            vals = p1 + 0.5 * s * (
+                (p2 - p0)
+                + s * ((2 * p0 - 5 * p1 + 4 * p2 - p3) + s * (3 * (p1 - p2) + p3 - p0))
+            )
+            suspect = any(k - 1 <= j <= k + 2 for j in self.suspects)
+            periodic = s >= 0.4 and (
+                self.last_verified is None
+                or abs(k - self.last_verified) >= self.verify_every
+            )
+            if k != self.last_verified and (suspect or periodic):
+                self.last_verified = k
+                exact = self._evaluate(evaluate, u)
+                err = float(np.max(np.abs(exact - vals)))
+                self.stats["verified"] += 1
+                self.stats["max_verify_error"] = max(self.stats["max_verify_error"], err)
+                if err > self.max_error:
+                    self._fall_back(err)
+                return exact
+            return vals
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["fallback"] = self.fallback
+            stats["interval"] = self.interval
+        stats["evaluations_per_frame"] = (
+            stats["evaluations"] / stats["frames"] if stats["frames"] else None
+        )
+        return stats
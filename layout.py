@@ -0,0 +1,138 @@
+import csv
+import json
+import math
+import threading
+import numpy as np
+from logger_config import logger
+from osc_params import get_params_full
+
+# Servo positions and the spatial fields derived from them.
+#
+# Positions are in the order of the frame values (spiral order, before
+# MOTOR_POSITION_MAPPING), one (x, y, z) per servo; z is the vertical axis
+# and azimuths are measured around the z axis through the origin. Without
+# LAYOUT_FILE the layout is the helix of the original sculpture (three
+# servos per turn) with chain neighbours i-1, i+1 for all but the two ends,
+# which is exactly what the modes and the relational limit assumed before.
+#
+# LAYOUT_FILE may be
+#   .csv   x,y,z per line (a header line is skipped)
+#   .json  [[x, y, z], ...] or {"positions": [...], "neighbours": [[j, ...], ...]}
+#   .npy   an (N, 3) array
+# Without explicit neighbours every servo gets its LAYOUT_NEIGHBOURS
+# (default 2) nearest servos.
+
+
+class Layout:
+    def __init__(self, positions, neighbours=None, k=2):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        n = len(self.positions)
+        diff = self.positions[:, None, :] - self.positions[None, :, :]
+        self.distances = np.sqrt(np.sum(diff * diff, axis=-1))
+        if neighbours is None:
+            neighbours = nearest_neighbours(self.distances, k)
+        self.neighbours = [sorted({int(j) for j in nb if 0 <= int(j) < n and int(j) != i})
+                           for i, nb in enumerate(neighbours)]
+        # padded (N, K) form for vectorized use; padding is masked out
+        width = max((len(nb) for nb in self.neighbours), default=0)
+        self.neighbour_index = np.tile(np.arange(n)[:, None], (1, width))
+        self.neighbour_mask = np.zeros((n, width), dtype=bool)
+        for i, nb in enumerate(self.neighbours):
+            self.neighbour_index[i, : len(nb)] = nb
+            self.neighbour_mask[i, : len(nb)] = True
+
+        norms = np.linalg.norm(self.positions, axis=1)
+        self.directions = self.positions / np.maximum(norms, 1e-12)[:, None]
+        azimuth = np.arctan2(self.positions[:, 1], self.positions[:, 0]) % (2 * math.pi)
+        # -0.0 rounding off (e.g. a full turn of the helix) is 0, not 2pi
+        self.azimuth = np.where(azimuth > 2 * math.pi - 1e-9, 0.0, azimuth)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def nearest_neighbours(distances, k):
+    n = len(distances)
+    k = max(0, min(int(k), n - 1))
+    masked = distances + np.diag(np.full(n, np.inf))
+    return [list(np.argsort(row, kind="stable")[:k]) for row in masked]
+
+
+def helix_layout(num_servos):
+    """The original sculpture: radius 1, pitch 1, three servos per turn."""
+    idx = np.arange(num_servos)
+    num_turns = num_servos / 3.0
+    theta = (idx / num_servos) * num_turns * 2 * math.pi
+    positions = np.stack(
+        [np.cos(theta), np.sin(theta), (idx / num_servos) * num_turns], axis=1
+    )
+    chain = [[] if i in (0, num_servos - 1) else [i - 1, i + 1] for i in range(num_servos)]
+    return Layout(positions, chain)
+
+
+def read_layout_file(path, k=2):
+    neighbours = None
+    if path.endswith(".npy"):
+        positions = np.load(path)
+    elif path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            positions = data["positions"]
+            neighbours = data.get("neighbours")
+        else:
+            positions = data
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.reader(f) if row and row[0].strip()]
+        try:
+            float(rows[0][0])
+        except ValueError:
+            rows = rows[1:]  # header
+        positions = [[float(v) for v in row[:3]] for row in rows]
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim != 2 or positions.shape[1] != 3:
+        raise ValueError(f"expected (N, 3) positions, got shape {positions.shape}")
+    if not np.all(np.isfinite(positions)):
+        raise ValueError("positions contain NaN/inf")
+    return Layout(positions, neighbours, k)
+
+
+_lock = threading.Lock()
+_cache = (None, None)  # (key, Layout)
+
+
+def get_layout(params_full=None):
+    """Layout for LAYOUT_FILE and NUM_SERVOS, built once per setting."""
+    global _cache
+    if params_full is None:
+        params_full = get_params_full()
+    num_servos = int(params_full.get("NUM_SERVOS", 31))
+    key = (params_full.get("LAYOUT_FILE"), num_servos, params_full.get("LAYOUT_NEIGHBOURS", 2))
+    cache = _cache
+    if cache[0] == key:
+        return cache[1]
+    with _lock:
+        if _cache[0] == key:
+            return _cache[1]
+        path, _, k = key
+        layout = None
+        if path:
+            try:
+                layout = read_layout_file(path, k)
+                if len(layout) != num_servos:
+                    raise ValueError(f"{len(layout)} positions for {num_servos} servos")
+                logger.info("Layout %s loaded (%d servos).", path, num_servos)
+            except Exception as e:
+                logger.error("LAYOUT_FILE %s not usable, using the helix: %s", path, e)
+                layout = None
+        if layout is None:
+            layout = helix_layout(num_servos)
+        _cache = (key, layout)
+        return layout
+
+
+def clear_layout_cache():
+    # e.g. after the layout file was edited in place
+    global _cache
+    _cache = (None, None)
@@ -0,0 +1,73 @@
+import numpy as np
+
+# The output limits of filter_vals, without its side effects (globals,
+# logging), so they can be run offline as well (analyze_params.py).
+
+
+def relational_bound(vals, layout, limit_relational):
+    """Largest value each servo may take next to its layout neighbours
+    (inf for a servo without neighbours)."""
+    a = vals[layout.neighbour_index]
+    c = float(limit_relational)
+    b = 0.5 * (np.sqrt(np.maximum(4 * c * c - 3 * a * a, 0.0)) - a)
+    return np.where(layout.neighbour_mask, b, np.inf)
+
+
+def apply_limits(raw_vals, prev, alpha, limit_absolute, limit_relational, limit_speed, layout):
+    """Low-pass and limit one frame; limit_speed is per frame.
+
+    Returns (vals, (limited_absolute, limited_relational, limited_speed),
+    (peak speed demand, peak relational excess)); the peaks are measured
+    before the respective limit, in steps per frame and steps.
+    """
+    vals = raw_vals.copy()
+
+    if prev is None:
+        vals = raw_vals
+    else:
+        vals = [int(p + alpha * (c - p)) for p, c in zip(prev, raw_vals)]
+
+    # === Absolute limit ========================
+    limited_absolute = False
+    for i in range(len(vals)):
+        if vals[i] > limit_absolute:
+            vals[i] = limit_absolute
+            limited_absolute = True
+        elif vals[i] < 0:
+            vals[i] = 0
+            limited_absolute = True
+
+    # === Relational limit ======================
+    # against every neighbour of the layout (the helix: i-1 and i+1)
+    limited_relational = False
+    peak_excess = 0.0
+    if layout.neighbour_index.shape[1] > 0:
+        valsLPF = np.asarray(vals, dtype=np.float64)
+        b = relational_bound(valsLPF, layout, limit_relational)
+        excess = valsLPF[:, None] - b
+        peak_excess = max(float(np.max(excess)), 0.0)
+        over = np.any(excess > 0, axis=1)
+        if over.any():
+            limited = 0.5 * np.min(b + valsLPF[:, None], axis=1)
+            for i in np.flatnonzero(over):
+                vals[i] = float(limited[i])
+            limited_relational = True
+
+    # === Speed limit ===========================
+    limited_speed = False
+    peak_speed = 0.0
+    for i in range(len(vals)):
+        step = vals[i] - prev[i]
+        peak_speed = max(peak_speed, abs(step))
+        if step > limit_speed:
+            vals[i] = prev[i] + limit_speed
+            limited_speed = True
+        elif step < -limit_speed:
+            vals[i] = prev[i] - limit_speed
+            limited_speed = True
+
+    return (
+        vals,
+        (limited_absolute, limited_relational, limited_speed),
+        (float(peak_speed), peak_excess),
+    )
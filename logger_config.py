@@ -3,10 +3,15 @@ from logging.handlers import RotatingFileHandler
 import sys
 from datetime import datetime
 
+LOG_FILE = "ritsudo_server.log"
 
-def setup_logger():
+
+def setup_logger(log_file=LOG_FILE):
+    """Attach the console and rotating file handlers (once); called by bootstrap"""
     logger = logging.getLogger("ritsudo_server")
     logger.setLevel(logging.DEBUG)
+    if logger.handlers:
+        return logger
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
@@ -16,18 +21,19 @@ def setup_logger():
     )
     console_handler.setFormatter(console_formatter)
 
-    file_handler = RotatingFileHandler(
-        "ritsudo_server.log", maxBytes=10 * 1024 * 1024, backupCount=100
-    )
-    file_handler.setLevel(logging.DEBUG)
-    file_formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d - %(funcName)s()] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-    file_handler.setFormatter(file_formatter)
-
     logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+
+    if log_file:
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=10 * 1024 * 1024, backupCount=100
+        )
+        file_handler.setLevel(logging.DEBUG)
+        file_formatter = logging.Formatter(
+            "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d - %(funcName)s()] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+        file_handler.setFormatter(file_formatter)
+        logger.addHandler(file_handler)
 
     class StreamToLogger:
         def __init__(self, logger, level):
@@ -48,4 +54,5 @@ def setup_logger():
     return logger
 
 
-logger = setup_logger()
+# No handlers (and no log file) at import time, see setup_logger().
+logger = logging.getLogger("ritsudo_server")
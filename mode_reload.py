@@ -0,0 +1,105 @@
+import importlib.util
+import sys
+import time
+import numpy as np
+from logger_config import logger
+from osc_params import get_params_full, use_mode_params
+
+# Loading and validating a new osc_modes.py next to the running one.
+#
+# The candidate is executed as a fresh module object that is NOT put into
+# sys.modules, so a broken file never replaces the running version. Every
+# mode of params.json is then evaluated on a batch of test frames with
+# use_mode_params(), i.e. in the calling thread only; the sender keeps
+# running the current mode meanwhile.
+
+MODULE_NAME = "osc_modes"
+FUNC_KEYS = ("FUNC", "AMP_MODE")
+
+
+def load_modes_module(path=None):
+    """Compile and execute osc_modes.py as a new module; raises on errors."""
+    if path is None:
+        current = sys.modules.get(MODULE_NAME)
+        path = getattr(current, "__file__", None) or MODULE_NAME + ".py"
+    spec = importlib.util.spec_from_file_location(MODULE_NAME, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not callable(getattr(module, "make_frame", None)):
+        raise AttributeError(f"{path} defines no make_frame()")
+    return module
+
+
+def validate_mode(module, mode_id, params_full, times):
+    mode = params_full.get("MODES", {}).get(mode_id, {})
+    num_servos = int(params_full.get("NUM_SERVOS", 31))
+    errors = []
+    # make_frame silently falls back to sin/solid for unknown names, which
+    # would hide a renamed function
+    names = [(key, mode.get(key)) for key in FUNC_KEYS]
+    layers = mode.get("LAYERS")
+    for j, layer in enumerate(layers if isinstance(layers, list) else []):
+        if isinstance(layer, dict):
+            names += [(f"LAYERS[{j}].{key}", layer.get(key)) for key in FUNC_KEYS]
+    for key, name in names:
+        if name is None or str(name) in getattr(module, "STATEFUL_FUNCS", {}):
+            continue
+        if not callable(getattr(module, str(name), None)):
+            errors.append(f"{key} '{name}' is not defined")
+
+    # make_frame falls back to FUNC for malformed LAYERS, too
+    if mode.get("LAYERS") and hasattr(module, "LayerPlan"):
+        try:
+            module.LayerPlan(mode_id, dict(params_full, MODE=mode_id))
+        except (TypeError, ValueError) as e:
+            errors.append(f"LAYERS: {e}")
+
+    max_frame_ms = 0.0
+    if not errors:
+        with use_mode_params(mode_id, params_full), np.errstate(all="ignore"):
+            for t in times:
+                t0 = time.perf_counter()
+                try:
+                    vals = np.asarray(module.make_frame(float(t), num_servos), dtype=float)
+                except Exception as e:
+                    errors.append(f"t={t:.2f}: {type(e).__name__}: {e}")
+                    break
+                max_frame_ms = max(max_frame_ms, (time.perf_counter() - t0) * 1000)
+                if vals.shape != (num_servos,):
+                    errors.append(f"t={t:.2f}: frame shape {vals.shape}, expected ({num_servos},)")
+                    break
+                if not np.all(np.isfinite(vals)):
+                    errors.append(f"t={t:.2f}: frame has NaN/inf")
+                    break
+    return {
+        "func": mode.get("FUNC"),
+        "ok": not errors,
+        "errors": errors,
+        "max_frame_ms": round(max_frame_ms, 3),
+    }
+
+
+def validate_modes(module, params_full=None, seconds=60.0, frames=120, baseline=None):
+    """Evaluate every configured mode on `frames` test frames over `seconds`.
+
+    A mode that fails with the `baseline` module (the running one) as well is
+    reported as preexisting and does not block the reload.
+    """
+    params_full = get_params_full() if params_full is None else params_full
+    times = np.linspace(0.0, seconds, max(int(frames), 1))
+    report = {"ok": True, "modes": {}}
+    for mode_id in params_full.get("MODES", {}):
+        result = validate_mode(module, mode_id, params_full, times)
+        if not result["ok"] and baseline is not None:
+            result["preexisting"] = not validate_mode(
+                baseline, mode_id, params_full, times
+            )["ok"]
+        report["modes"][mode_id] = result
+        if result["ok"]:
+            continue
+        if result.get("preexisting"):
+            logger.warning("Mode %s fails with the running osc_modes too: %s", mode_id, result["errors"])
+        else:
+            report["ok"] = False
+            logger.warning("Mode %s failed validation: %s", mode_id, result["errors"])
+    return report
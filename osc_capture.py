@@ -0,0 +1,95 @@
+import os
+import struct
+import threading
+import time
+from logger_config import logger
+
+# Raw capture of the UDP packets the PLAYER sends to osc_listener.
+#
+#   header : 8s magic, uint32 version, float64 wall clock at start
+#   records: float64 monotonic time, uint32 length, <length> raw bytes
+#
+# The raw bytes are stored untouched, so a replay hits exactly the same
+# parsing and dispatching code as the show night did.
+
+MAGIC = b"KFYOSC01"
+VERSION = 1
+HEADER = struct.Struct("<8sId")
+RECORD = struct.Struct("<dI")
+
+CAPTURES_DIR = "captures"
+
+_capture_file = None
+_capture_path = None
+_capture_packets = 0
+_capture_lock = threading.Lock()
+
+
+def capture_path(name):
+    """Path of a client-supplied file name, always inside CAPTURES_DIR."""
+    name = str(name)
+    if not name or name in (".", "..") or os.path.basename(name) != name or "\\" in name:
+        raise ValueError(f"expected a file name without directories, got '{name}'")
+    return os.path.join(CAPTURES_DIR, name)
+
+
+def start_capture(name=None):
+    global _capture_file, _capture_path, _capture_packets
+    if name is None:
+        name = time.strftime("%Y%m%d-%H%M%S") + ".oscap"
+    path = capture_path(name)
+    os.makedirs(CAPTURES_DIR, exist_ok=True)
+    f = open(path, "wb")
+    f.write(HEADER.pack(MAGIC, VERSION, time.time()))
+    with _capture_lock:
+        if _capture_file is not None:
+            _capture_file.close()
+        _capture_file = f
+        _capture_path = path
+        _capture_packets = 0
+    logger.info("Capturing PLAYER OSC packets to %s", path)
+    return path
+
+
+def stop_capture():
+    global _capture_file
+    with _capture_lock:
+        f = _capture_file
+        _capture_file = None
+        if f is None:
+            return None
+        f.close()
+    logger.info("Captured %d packets to %s", _capture_packets, _capture_path)
+    return {"path": _capture_path, "packets": _capture_packets}
+
+
+def capture_packet(data, t=None):
+    global _capture_packets
+    if _capture_file is None:
+        return
+    t = time.monotonic() if t is None else t
+    with _capture_lock:
+        if _capture_file is not None:
+            _capture_file.write(RECORD.pack(t, len(data)))
+            _capture_file.write(data)
+            _capture_packets += 1
+
+
+def read_capture(path):
+    """Yield (monotonic time, raw bytes) for every packet of a capture."""
+    with open(path, "rb") as f:
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            raise ValueError(f"{path}: file too short for a capture header")
+        magic, _, _ = HEADER.unpack(raw)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an OSC capture")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            t, length = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return  # truncated last record
+            yield t, data
@@ -3,11 +3,26 @@ from pythonosc.osc_bundle import OscBundle
 from pythonosc.dispatcher import Dispatcher
 import socketserver
 import threading
+import time
+from collections import deque
 from logger_config import logger
+from osc_capture import capture_packet
 
 _message_callbacks = []
 _bundle_callbacks = []
 
+LATENCY_SAMPLES = 10000
+
+_stats_lock = threading.Lock()
+_stats = {
+    "packets": 0,
+    "messages": 0,
+    "bundles": 0,
+    "invalid": 0,
+    "callback_errors": 0,
+}
+_latencies_ms = deque(maxlen=LATENCY_SAMPLES)  # per packet, parse + callbacks
+
 
 def register_message_callback(cb):
     _message_callbacks.append(cb)
@@ -17,12 +32,50 @@ def register_bundle_callback(cb):
     _bundle_callbacks.append(cb)
 
 
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    idx = min(int(round(q / 100.0 * (len(sorted_vals) - 1))), len(sorted_vals) - 1)
+    return sorted_vals[idx]
+
+
+def get_listener_stats():
+    with _stats_lock:
+        stats = _stats.copy()
+        latencies = sorted(_latencies_ms)
+    stats["latency_ms"] = {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": _percentile(latencies, 50),
+        "p90": _percentile(latencies, 90),
+        "p99": _percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None,
+    }
+    return stats
+
+
+def reset_listener_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+        _latencies_ms.clear()
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
 class MyUDPHandler(socketserver.BaseRequestHandler):
     def handle(self):
         data, _ = self.request
+        t0 = time.perf_counter()
+        capture_packet(data)
+        _count("packets")
         try:
             pkt = OscPacket(data)
         except Exception as e:
+            _count("invalid")
             logger.error("Invalid OSC packet: %s", e)
             return
 
@@ -33,6 +86,7 @@ class MyUDPHandler(socketserver.BaseRequestHandler):
             pass
 
         if is_bundle:
+            _count("bundles")
             logger.info("Received a bundle with %d messages", len(pkt.messages))
             bundle_contents = []
             for timed in pkt.messages:
@@ -46,9 +100,11 @@ class MyUDPHandler(socketserver.BaseRequestHandler):
                 try:
                     cb(bundle_contents)
                 except Exception as e:
+                    _count("callback_errors")
                     logger.error("Bundle callback error: %s", e)
         else:
             for timed in pkt.messages:
+                _count("messages")
                 msg = timed.message
                 addr = msg.address
                 args = msg.params
@@ -57,8 +113,12 @@ class MyUDPHandler(socketserver.BaseRequestHandler):
                     try:
                         cb(addr, *args)
                     except Exception as e:
+                        _count("callback_errors")
                         logger.error("Callback error: %s", e)
 
+        with _stats_lock:
+            _latencies_ms.append((time.perf_counter() - t0) * 1000)
+
 
 def start_osc_listener(port):
     class Server(socketserver.ThreadingUDPServer):
@@ -1,10 +1,20 @@
+import json
 import math
+import threading
+from collections import OrderedDict
 import numpy as np
-from osc_params import get_params_full, get_params_mode
+from osc_params import get_params_full, get_params_mode, get_params_version, pinned_params
 from logger_config import logger
+from wavetable import wavetables, stack_lookup, stack_tables
+from layout import get_layout
+from impacts import impacts
+from stateful import StatefulMode, stateful_modes
 
 STROKE_LENGTH_LIMIT_HARDCODED = 50000
 
+# exactly periodic in t with cycle_from_params(); see wavetable.py
+PERIODIC_FUNCS = ("sin", "azimuth", "azimuth_variable", "soliton")
+
 
 # -------------------------
 # Amplitude modulation
@@ -124,47 +134,44 @@ def phase(i, num_servos):
     )
 
 
-def azimuth_phase(i):
-    return (i % 3) / 3 * math.pi * 2
+def phases(num_servos):
+    # phase(i, num_servos) for all servos
+    return (
+        np.arange(num_servos) / num_servos
+        * math.pi
+        * float(get_params_mode().get("PHASE_RATE", 0.0))
+        * -1.0
+    )
 
 
-def azimuth_phase_variable(i, f):
-    if f < 0:
-        f = 0
-    elif f > 1:
-        f = 1
-    return (i % 3) / 3 * f * math.pi * 2
+def azimuth_phases(num_servos, f=1.0):
+    # angle around the vertical axis from the layout; the helix gives
+    # (i % 3) / 3 * 2pi
+    f = min(max(f, 0.0), 1.0)
+    return get_layout().azimuth[:num_servos] * f
 
 
 # -------------------------
 # Location-based effects
 # -------------------------
-def location_distance(i, num_servos):
-    r = 1
-    p = 1
-    num_turns = num_servos / 3.0
-    coords = []
-    for idx in range(num_servos):
-        theta = (idx / num_servos) * num_turns * 2 * math.pi
-        z = (idx / num_servos) * num_turns * p
-        x = r * math.cos(theta)
-        y = r * math.sin(theta)
-        coords.append([x, y, z])
-    degree = get_params_mode().get("LOCATION_DEGREE", 0)
-    height = get_params_mode().get("LOCATION_HEIGHT", 0.7)
-    origin = np.array(
+def location_origin(degree, height):
+    return np.array(
         [
             math.cos(degree * math.pi * 2),
             math.sin(degree * math.pi * 2),
             height * 10,
         ]
     )
-    distances = [np.linalg.norm(np.array(coord) - origin) for coord in coords]
-    origin_vec = origin / np.linalg.norm(origin)
-    dot_products = [
-        np.dot(np.array(coord) / np.linalg.norm(coord), origin_vec) for coord in coords
-    ]
-    return np.array(distances, dtype=float), np.array(dot_products, dtype=float)
+
+
+def location_distance(i, num_servos):
+    layout = get_layout()
+    degree = get_params_mode().get("LOCATION_DEGREE", 0)
+    height = get_params_mode().get("LOCATION_HEIGHT", 0.7)
+    origin = location_origin(degree, height)
+    distances = np.linalg.norm(layout.positions[:num_servos] - origin, axis=1)
+    dot_products = layout.directions[:num_servos] @ (origin / np.linalg.norm(origin))
+    return distances, dot_products
 
 
 # -------------------------
@@ -190,29 +197,22 @@ def sin(t, num_servos):
 
 
 def azimuth(t, num_servos):
-    def azimuth_core(i, num_servos, t, rate):
-        return math.sin(
-            2 * math.pi * rate * t + azimuth_phase(i) + phase(i, num_servos)
-        )
-
     cycle = cycle_from_params()
     t_mod = t % cycle
     rate = base_freq()
-    vals = [azimuth_core(i, num_servos, t_mod, rate) for i in range(num_servos)]
-    return np.array(vals, dtype=float)
+    return np.sin(
+        2 * math.pi * rate * t_mod + azimuth_phases(num_servos) + phases(num_servos)
+    )
+
 
 def azimuth_variable(t, num_servos):
-    def azimuth_core(i, num_servos, t, rate):
-        f = float(get_params_mode().get("PARAM_B", 0.0))
-        return math.sin(
-            2 * math.pi * rate * t + azimuth_phase_variable(i, f) + phase(i, num_servos)
-        )
-        
+    f = float(get_params_mode().get("PARAM_B", 0.0))
     cycle = cycle_from_params()
     t_mod = t % cycle
     rate = base_freq()
-    vals = [azimuth_core(i, num_servos, t_mod, rate) for i in range(num_servos)]
-    return np.array(vals, dtype=float)
+    return np.sin(
+        2 * math.pi * rate * t_mod + azimuth_phases(num_servos, f) + phases(num_servos)
+    )
 
 def soliton(t, num_servos):
     period = cycle_from_params()
@@ -237,38 +237,54 @@ def damped_oscillation(t, num_servos):
     return np.array(vals, dtype=float)
 
 
+def damped_response(displace=False):
+    """(freq, damping, convey) of the damped locational modes."""
+    amp_freq = float(get_params_mode().get("AMP_FREQ", 0.1))
+    if displace:
+        damping = float(get_params_mode().get("PARAM_A", 0.1)) * 10
+        convey = float(get_params_mode().get("AMP_PARAM_A", 0.1)) * 10
+    else:
+        damping = max(float(get_params_mode().get("AMP_PARAM_A", 0.1)), 1e-6) * 10
+        convey = float(get_params_mode().get("AMP_PARAM_B", 0.1)) * 10
+    return amp_freq, damping, convey
+
+
+# the mode's own source at LOCATION_* plus the impacts spawned at runtime
 def damped_oscillation_locational(t, num_servos):
-    amp_freq = get_params_mode().get("AMP_FREQ", 0.1)
-    damping = max(float(get_params_mode().get("AMP_PARAM_A", 0.1)), 1e-6) * 10
-    convey = float(get_params_mode().get("AMP_PARAM_B", 0.1)) * 10
-    vals = [0] * num_servos
     distances, dot_products = location_distance(0, num_servos)
-    for i in range(num_servos):
-        t_i = t - distances[i] / (2 * math.pi * amp_freq) * convey
-        if t_i < 0:
-            vals[i] = 0
-            continue
-        vals[i] = math.exp(-damping * t_i) * math.sin(2 * math.pi * amp_freq * t_i)
-    return np.array(vals, dtype=float)
+    own = (*damped_response(), distances, dot_products)
+    return impacts.evaluate(t, num_servos, own)
 
 
 def damped_oscillation_displace(t, num_servos):
-    amp_freq = get_params_mode().get("AMP_FREQ", 0.1)
-    damping = float(get_params_mode().get("PARAM_A", 0.1)) * 10
-    convey = float(get_params_mode().get("AMP_PARAM_A", 0.1)) * 10
-    vals = [0] * num_servos
     distances, dot_products = location_distance(0, num_servos)
-    for i in range(num_servos):
-        t_i = t - distances[i] / (2 * math.pi * amp_freq) * convey
-        if t_i < 0:
-            vals[i] = 0
-            continue
-        vals[i] = (
-            math.exp(-damping * t_i)
-            * math.sin(2 * math.pi * amp_freq * t_i)
-            * dot_products[i]
+    own = (*damped_response(displace=True), distances, dot_products)
+    return impacts.evaluate(t, num_servos, own, displace=True)
+
+
+IMPACT_AMP_MODES = ("damped_oscillation_locational", "damped_oscillation_displace")
+
+
+def spawn_impact(t, degree=None, height=None, gain=1.0):
+    """New impact at mode time t; origin defaults to LOCATION_*, the
+    response follows the params of the current mode."""
+    params_mode = get_params_mode()
+    layers = params_mode.get("LAYERS")
+    amp_modes = {params_mode.get("AMP_MODE")}
+    if isinstance(layers, list):
+        amp_modes.update(layer.get("AMP_MODE") for layer in layers if isinstance(layer, dict))
+    if not amp_modes.intersection(IMPACT_AMP_MODES):
+        # the source would be invisible, but still count and reset keyframes
+        raise ValueError(
+            f"mode {get_params_full().get('MODE')} has no impact AMP_MODE ({', '.join(IMPACT_AMP_MODES)})"
         )
-    return np.array(vals, dtype=float)
+    if degree is None:
+        degree = params_mode.get("LOCATION_DEGREE", 0)
+    if height is None:
+        height = params_mode.get("LOCATION_HEIGHT", 0.7)
+    displace = params_mode.get("AMP_MODE") == "damped_oscillation_displace"
+    freq, damping, convey = damped_response(displace)
+    return impacts.spawn(t, location_origin(float(degree), float(height)), freq, damping, convey, gain)
 
 
 def random(t, num_servos):
@@ -300,16 +316,290 @@ def random_sin_freq(t, num_servos):
     return vals
 
 
+# -------------------------
+# Stateful modes (see stateful.py)
+# -------------------------
+class WaveEquation(StatefulMode):
+    """x'' = c^2 L x - damping x' on the servo graph, one servo driven.
+
+    L is the graph Laplacian of the spiral chain (WAVE_GRAPH "chain", a 1D
+    string with free ends) or of the layout neighbours ("layout"). The source
+    servo (WAVE_SOURCE, default the first one, the last one for DIRECTION < 0)
+    follows sin(2 pi BASE_FREQ t); WAVE_SPEED is in servos per second and
+    WAVE_DAMPING in 1/s.
+    """
+
+    def init(self, num_servos):
+        self.x = np.zeros(num_servos)
+        self.v = np.zeros(num_servos)
+        self.acc = np.zeros(num_servos)
+        self.graph = None
+
+    def _neighbours(self, num_servos):
+        kind = str(get_params_mode().get("WAVE_GRAPH", "chain"))
+        layout = get_layout() if kind == "layout" else None
+        key = (kind, id(layout))
+        if self.graph == key:
+            return
+        if layout is None:
+            pairs = {(i, i + 1) for i in range(num_servos - 1)}
+        else:
+            pairs = {tuple(sorted((i, j))) for i, nb in enumerate(layout.neighbours) for j in nb}
+        neighbours = [[] for _ in range(num_servos)]
+        for i, j in pairs:
+            if i < num_servos and j < num_servos:
+                neighbours[i].append(j)
+                neighbours[j].append(i)
+        # padded (N, width) gather; padding points at the servo itself
+        width = max((len(nb) for nb in neighbours), default=0)
+        self.index = np.tile(np.arange(num_servos)[:, None], (1, width))
+        for i, nb in enumerate(neighbours):
+            self.index[i, : len(nb)] = nb
+        self.diff = np.zeros((num_servos, width))
+        self.max_degree = max(width, 1)
+        self.graph = key
+
+    def _speed(self):
+        return max(float(get_params_mode().get("WAVE_SPEED", 10.0)), 0.0)
+
+    def max_step(self):
+        # semi-implicit Euler is stable for dt * c * sqrt(max eigenvalue of L) < 2
+        self._neighbours(len(self.x))
+        c = self._speed()
+        if c == 0.0:
+            return 0.01
+        return min(0.01, 1.0 / (c * math.sqrt(4 * self.max_degree)))
+
+    def step(self, dt):
+        num_servos = len(self.x)
+        self._neighbours(num_servos)
+        params_mode = get_params_mode()
+        c = self._speed()
+        damping = max(float(params_mode.get("WAVE_DAMPING", 0.5)), 0.0)
+
+        # no allocation below: everything goes through the state buffers
+        np.take(self.x, self.index, out=self.diff)
+        self.diff -= self.x[:, None]
+        np.sum(self.diff, axis=1, out=self.acc)
+        self.acc *= c * c * dt
+        self.v += self.acc
+        self.v *= 1.0 / (1.0 + damping * dt)
+        np.multiply(self.v, dt, out=self.acc)
+        self.x += self.acc
+
+        source = int(
+            params_mode.get(
+                "WAVE_SOURCE",
+                0 if float(params_mode.get("DIRECTION", 1.0)) >= 0 else num_servos - 1,
+            )
+        )
+        if 0 <= source < num_servos:
+            w = 2 * math.pi * base_freq()
+            t = self.t + dt
+            self.x[source] = math.sin(w * t)
+            self.v[source] = w * math.cos(w * t)
+        return self.x
+
+
+# FUNC name: StatefulMode class
+STATEFUL_FUNCS = {"wave_equation": WaveEquation}
+
+
+def is_stateful():
+    params_mode = get_params_mode()
+    if params_mode.get("LAYERS"):
+        return any(
+            isinstance(layer, dict) and layer.get("FUNC", params_mode.get("FUNC")) in STATEFUL_FUNCS
+            for layer in params_mode["LAYERS"]
+        )
+    return params_mode.get("FUNC") in STATEFUL_FUNCS
+
+
+# -------------------------
+# Layers
+# -------------------------
+# A mode with "LAYERS": [{"FUNC": "sin", "params": {...}, "gain": 1.0,
+# "blend": "add", "AMP_MODE": "amp_sin"}, ...] composes its FUNCs instead
+# of using its own FUNC. Each layer runs with the mode params updated by its
+# "params" (as mode "<MODE>/<index>"), times its AMP_MODE (none if omitted,
+# without STROKE_LENGTH) and gain. Layers are folded in order with their
+# blend (that of the first layer is ignored); the mode's own AMP_MODE and
+# STROKE_LENGTH then apply to the result as usual. Malformed LAYERS are
+# logged and the mode runs its own FUNC instead.
+#
+# Layers with the same FUNC params (or AMP params) are evaluated once, and
+# all layers that have a wavetable are interpolated in one array operation.
+BLENDS = ("add", "multiply", "max")
+_layer_plans = OrderedDict()  # (mode dict id, params version): (mode, LayerPlan)
+_layer_lock = threading.Lock()
+
+
+class LayerPlan:
+    def __init__(self, mode_id, params_full):
+        mode = params_full["MODES"][mode_id]
+        base = {k: v for k, v in mode.items() if k != "LAYERS"}
+        self.funcs = []  # (params snapshot, FUNC name) evaluated per frame
+        self.tables = {}  # index in funcs: (Wavetable, direction) once rendered
+        self.stack = (None, None, None, None)  # (table ids, tables, stacked, periods)
+        self.amps = []  # (params snapshot, AMP_MODE name)
+        func_keys, amp_keys = {}, {}
+        func_idx, amp_idx, gains, blends = [], [], [], []
+        if not isinstance(mode["LAYERS"], list):
+            raise ValueError("LAYERS must be a list")
+        for j, layer in enumerate(mode["LAYERS"]):
+            if not isinstance(layer, dict):
+                raise ValueError(f"layer {j}: expected an object")
+            blend = str(layer.get("blend", "add"))
+            if blend not in BLENDS:
+                raise ValueError(f"layer {j}: unknown blend '{blend}'")
+            params = layer.get("params", {})
+            if not isinstance(params, dict):
+                raise ValueError(f"layer {j}: params must be an object")
+            merged = dict(base, **params)
+            merged["FUNC"] = str(layer.get("FUNC", merged.get("FUNC", "sin")))
+            merged["AMP_MODE"] = layer.get("AMP_MODE")
+            layer_id = f"{mode_id}/{j}"
+            snapshot = dict(
+                params_full, MODE=layer_id, MODES=dict(params_full["MODES"], **{layer_id: merged})
+            )
+
+            key = json.dumps({k: v for k, v in merged.items() if k != "AMP_MODE"}, sort_keys=True)
+            if key not in func_keys:
+                func_keys[key] = len(self.funcs)
+                self.funcs.append((snapshot, merged["FUNC"]))
+            func_idx.append(func_keys[key])
+
+            amp_name = merged["AMP_MODE"]
+            if amp_name is None or amp_name == "solid":
+                amp_idx.append(-1)  # the row of ones
+            else:
+                key = json.dumps(
+                    {k: v for k, v in merged.items() if k not in ("FUNC", "DIRECTION")},
+                    sort_keys=True,
+                )
+                if key not in amp_keys:
+                    amp_keys[key] = len(self.amps)
+                    self.amps.append((snapshot, str(amp_name)))
+                amp_idx.append(amp_keys[key])
+            gains.append(float(layer.get("gain", 1.0)))
+            blends.append(blend)
+        if not gains:
+            raise ValueError("LAYERS is empty")
+        self.func_idx = np.array(func_idx)
+        self.amp_idx = np.array(amp_idx)
+        self.gains = np.array(gains)[:, None]
+        # runs of the same blend after the first layer: (blend, start, stop)
+        self.runs = []
+        for j in range(1, len(blends)):
+            if self.runs and self.runs[-1][0] == blends[j]:
+                self.runs[-1][2] = j + 1
+            else:
+                self.runs.append([blends[j], j, j + 1])
+
+
+def layer_plan():
+    """LayerPlan of the current mode, None if its LAYERS are malformed."""
+    params_full = get_params_full()
+    mode_id = str(params_full.get("MODE"))
+    mode = params_full["MODES"][mode_id]
+    # the version makes a snapshot follow the global params too
+    key = (id(mode), mode_id, get_params_version())
+    with _layer_lock:
+        cached = _layer_plans.get(key)
+        if cached is None:
+            try:
+                plan = LayerPlan(mode_id, params_full)
+            except (TypeError, ValueError) as e:
+                # cached as well, so this is logged once
+                logger.error("Mode %s: LAYERS not usable, using FUNC: %s", mode_id, e)
+                plan = None
+            # keeps id(mode) in the key unique
+            _layer_plans[key] = (mode, plan)
+            while len(_layer_plans) > 8:
+                _layer_plans.popitem(last=False)
+        else:
+            plan = cached[1]
+            _layer_plans.move_to_end(key)
+    return plan
+
+
+def compose_layers(t, num_servos):
+    plan = layer_plan()
+    if plan is None:
+        return None
+    funcs = np.empty((len(plan.funcs), num_servos))
+    tabled = []  # (row, Wavetable, t)
+    for k, (snapshot, func_name) in enumerate(plan.funcs):
+        cached = plan.tables.get(k)
+        if cached is not None and len(cached[0].table[0]) == num_servos:
+            tabled.append((k, cached[0], t * cached[1]))
+            continue
+        with pinned_params(snapshot):
+            if func_name in PERIODIC_FUNCS:
+                direction = float(get_params_mode().get("DIRECTION", 1.0))
+                table = wavetables.table(globals()[func_name], cycle_from_params(), num_servos)
+                if table is not None:
+                    # the snapshot does not change, neither does its table
+                    plan.tables[k] = (table, direction)
+                    tabled.append((k, table, t * direction))
+                    continue
+            funcs[k] = func_frame(t, num_servos, wavetable=False)
+    if tabled:
+        rows, tables, ts = zip(*tabled)
+        ids = tuple(id(w) for w in tables)
+        stack = plan.stack  # read once, another thread may replace it
+        if stack[0] != ids:
+            # keeps `tables` alive so the ids stay unique while cached
+            stack = (ids, tables, *stack_tables(tables))
+            plan.stack = stack
+        funcs[list(rows)] = stack_lookup(stack[2], stack[3], ts)
+
+    vals = funcs[plan.func_idx] * plan.gains
+    if plan.amps:
+        amps = np.ones((len(plan.amps) + 1, num_servos))  # last row: no AMP_MODE
+        for k, (snapshot, amp_name) in enumerate(plan.amps):
+            with pinned_params(snapshot):
+                amps[k] = globals().get(amp_name, solid)(t, num_servos)
+        vals *= amps[plan.amp_idx]
+
+    out = vals[0]
+    for blend, start, stop in plan.runs:
+        if blend == "add":
+            out = out + vals[start:stop].sum(axis=0)
+        elif blend == "multiply":
+            out = out * vals[start:stop].prod(axis=0)
+        else:
+            out = np.maximum(out, vals[start:stop].max(axis=0))
+    return out
+
+
 # -------------------------
 # Frame builder
 # -------------------------
-def make_frame(t, num_servos):
+def func_frame(t, num_servos, wavetable=True):
+    """FUNC of the current mode at t, before amplitude modulation."""
     params_mode = get_params_mode()
     func_name = params_mode.get("FUNC", "sin")
     func = globals().get(func_name, sin)
     direction = float(params_mode.get("DIRECTION", 1.0))
-    offset = float(get_params_full().get("STROKE_OFFSET", 0.0))
 
-    raw = func(t * direction, num_servos)
+    raw = None
+    if func_name in STATEFUL_FUNCS:
+        # runs forward only; DIRECTION is up to the mode
+        raw = stateful_modes.frame(STATEFUL_FUNCS[func_name], t, num_servos)
+    elif func_name in PERIODIC_FUNCS and wavetable:
+        raw = wavetables.lookup(func, cycle_from_params(), t * direction, num_servos)
+    if raw is None:
+        raw = func(t * direction, num_servos)
+    return raw
+
+
+def make_frame(t, num_servos):
+    offset = float(get_params_full().get("STROKE_OFFSET", 0.0))
+    raw = None
+    if get_params_mode().get("LAYERS"):
+        raw = compose_layers(t, num_servos)
+    if raw is None:
+        raw = func_frame(t, num_servos)
     amp = amplitude_modulation(t, num_servos)
     return raw * amp + offset
@@ -0,0 +1,146 @@
+import threading
+import time
+from logger_config import logger
+
+# Incoming param updates from the PLAYER are not applied immediately.
+# They are collected here per key (last write wins) and applied at once
+# on the next frame boundary of the sender (or by the fallback ticker
+# while the sender is not running). Bundles are queued as they are, each
+# applied as one indivisible batch after the coalesced single updates.
+
+_lock = threading.Lock()
+_pending = {}  # key: value
+_batches = []  # bundles, in arrival order
+_apply_callbacks = []
+_batch_callbacks = []
+
+_stats = {
+    "received": 0,
+    "coalesced": 0,
+    "rejected": 0,
+    "applied": 0,
+    "batches": 0,
+    "last_batch_size": 0,
+    "last_applied_frame": None,
+    "last_applied_time": None,
+}
+
+_last_frame_tick = 0.0
+
+ticker_thread = None
+ticker_stop = threading.Event()
+
+
+def register_apply_callback(cb):
+    _apply_callbacks.append(cb)
+
+
+def register_batch_callback(cb):
+    """cb(batch) applies one queued bundle, all or nothing."""
+    _batch_callbacks.append(cb)
+
+
+def enqueue_param(key, value):
+    with _lock:
+        _stats["received"] += 1
+        if key in _pending:
+            _stats["coalesced"] += 1
+        _pending[key] = value
+
+
+def enqueue_params(updates):
+    with _lock:
+        for key, value in updates.items():
+            _stats["received"] += 1
+            if key in _pending:
+                _stats["coalesced"] += 1
+            _pending[key] = value
+
+
+def enqueue_batch(updates):
+    with _lock:
+        _stats["received"] += len(updates)
+        _batches.append(dict(updates))
+
+
+def reject_params(count):
+    # updates that never made it into the queue (failed validation)
+    with _lock:
+        _stats["rejected"] += count
+
+
+def drain_params():
+    global _pending, _batches
+    with _lock:
+        updates, batches = _pending, _batches
+        _pending, _batches = {}, []
+    return updates, batches
+
+
+def apply_pending_params(frame=None):
+    """Apply all queued updates as one batch. Called at a frame boundary."""
+    global _last_frame_tick
+    if frame is not None:
+        _last_frame_tick = time.time()
+    updates, batches = drain_params()
+    if not updates and not batches:
+        return {}
+
+    if updates:
+        for cb in _apply_callbacks:
+            try:
+                cb(updates)
+            except Exception as e:
+                logger.error("Param apply callback error: %s", e)
+    for batch in batches:
+        for cb in _batch_callbacks:
+            try:
+                cb(batch)
+            except Exception as e:
+                logger.error("Param batch callback error: %s", e)
+
+    size = len(updates) + sum(len(batch) for batch in batches)
+    with _lock:
+        _stats["applied"] += size
+        _stats["batches"] += 1
+        _stats["last_batch_size"] = size
+        _stats["last_applied_frame"] = frame
+        _stats["last_applied_time"] = time.time()
+    for batch in batches:
+        updates = dict(updates, **batch)
+    return updates
+
+
+def get_param_queue_stats():
+    with _lock:
+        stats = _stats.copy()
+        stats["pending"] = len(_pending) + sum(len(batch) for batch in _batches)
+    return stats
+
+
+def _ticker(stop_event, interval):
+    while not stop_event.is_set():
+        # While the sender is running it drains the queue on its own frame
+        # boundaries, so the ticker only steps in when no frame came recently.
+        if time.time() - _last_frame_tick > interval * 2:
+            apply_pending_params()
+        stop_event.wait(interval)
+
+
+def start_param_ticker_thread(interval=0.05):
+    global ticker_thread
+    if ticker_thread is None or not ticker_thread.is_alive():
+        ticker_stop.clear()
+        ticker_thread = threading.Thread(
+            target=_ticker, args=(ticker_stop, interval), daemon=True
+        )
+        ticker_thread.start()
+        logger.info("Param ingest ticker started (%.0f ms).", interval * 1000)
+
+
+def stop_param_ticker_thread():
+    global ticker_thread
+    ticker_stop.set()
+    if ticker_thread is not None:
+        ticker_thread.join(timeout=1)
+        ticker_thread = None
@@ -1,4 +1,11 @@
+import atexit
+import contextlib
+import hashlib
 import json
+import os
+import tempfile
+import threading
+import time
 from logger_config import logger
 
 ### Default parameters hard-coded in this file are used  ###
@@ -9,6 +16,13 @@ LOCKED_KEYS = []
 
 PARAMS_FILE = "params.json"
 
+# params.json is written behind the callers' back: set_param_* only marks
+# the params dirty and the writer thread persists them once no change came
+# for SAVE_DEBOUNCE_SEC (but at latest SAVE_MAX_DELAY_SEC after the first
+# change).
+SAVE_DEBOUNCE_SEC = 0.5
+SAVE_MAX_DELAY_SEC = 3.0
+
 HOSTS = [f"10.0.0.10{i}" for i in range(0, 4)]
 OSC_RECV_PORTS = [i for i in range(50100, 50104)]
 
@@ -18,6 +32,7 @@ NUM_SERVOS = 31
 MOTOR_POSITION_MAPPING = [i for i in range(NUM_SERVOS)]
 
 DEFAULT_MODES = {}
+INPUT_SOURCES = ("modes", "stream")
 
 _params = {
     "MODE": "1",
@@ -35,12 +50,145 @@ _params = {
     "STROKE_OFFSET": 0,
     "SEND_CLIENTS": True,
     "SEND_CLIENT_GH": False,
+    "INPUT_SOURCE": "modes",  # or "stream": frames from /frame, see frame_stream.py
+}
+
+
+_params_lock = threading.RLock()
+_loaded = False  # params.json is read on first access, not at import
+
+_save_cond = threading.Condition()
+_write_lock = threading.Lock()
+_save_thread = None
+_dirty = False
+_dirty_since = None
+_last_change = None
+_written_version = None  # params version last written to PARAMS_FILE
+
+_persist_stats = {
+    "requests": 0,
+    "writes": 0,
+    "coalesced": 0,
+    "errors": 0,
+    "last_delay_ms": None,
+    "last_write_ms": None,
+    "max_write_ms": 0.0,
 }
 
 
+def _write_params_atomic(dirty_since=None):
+    global _written_version
+    t0 = time.time()
+    params_dir = os.path.dirname(os.path.abspath(PARAMS_FILE))
+    with _write_lock:
+        # the snapshot is taken under _write_lock, so a write never replaces
+        # newer data written by the other thread (writer / flush_params)
+        with _params_lock:
+            version = _params_version
+            if version == _written_version:
+                return
+            data = json.dumps(_params, ensure_ascii=False, indent=2)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".params.", suffix=".tmp", dir=params_dir
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, PARAMS_FILE)
+            _written_version = version
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    t1 = time.time()
+
+    write_ms = (t1 - t0) * 1000
+    with _save_cond:
+        _persist_stats["writes"] += 1
+        _persist_stats["last_write_ms"] = write_ms
+        _persist_stats["max_write_ms"] = max(_persist_stats["max_write_ms"], write_ms)
+        if dirty_since is not None:
+            _persist_stats["last_delay_ms"] = (t1 - dirty_since) * 1000
+
+
+def _params_writer():
+    global _dirty
+    while True:
+        with _save_cond:
+            while not _dirty:
+                _save_cond.wait()
+            while _dirty:
+                due = min(
+                    _last_change + SAVE_DEBOUNCE_SEC, _dirty_since + SAVE_MAX_DELAY_SEC
+                )
+                remaining = due - time.time()
+                if remaining <= 0:
+                    break
+                _save_cond.wait(remaining)
+            if not _dirty:
+                continue
+            _dirty = False
+            dirty_since = _dirty_since
+        try:
+            _write_params_atomic(dirty_since)
+        except Exception as e:
+            with _save_cond:
+                _persist_stats["errors"] += 1
+            logger.error("Failed to write %s: %s", PARAMS_FILE, e)
+
+
 def save_params():
-    with open(PARAMS_FILE, "w", encoding="utf-8") as f:
-        json.dump(_params, f, ensure_ascii=False, indent=2)
+    global _dirty, _dirty_since, _last_change, _save_thread
+    with _save_cond:
+        _persist_stats["requests"] += 1
+        now = time.time()
+        if _dirty:
+            _persist_stats["coalesced"] += 1
+        else:
+            _dirty = True
+            _dirty_since = now
+        _last_change = now
+        if _save_thread is None or not _save_thread.is_alive():
+            _save_thread = threading.Thread(target=_params_writer, daemon=True)
+            _save_thread.start()
+        _save_cond.notify()
+
+
+def flush_params():
+    """Write pending changes to params.json right now (e.g. on shutdown)."""
+    global _dirty
+    with _save_cond:
+        dirty = _dirty
+        _dirty = False
+        dirty_since = _dirty_since
+    if not dirty:
+        # the writer may have taken the last change and still be writing it
+        with _write_lock:
+            pass
+        return False
+    try:
+        _write_params_atomic(dirty_since)
+    except Exception as e:
+        with _save_cond:
+            _persist_stats["errors"] += 1
+        logger.error("Failed to write %s: %s", PARAMS_FILE, e)
+        return False
+    logger.debug("Flushed params to %s", PARAMS_FILE)
+    return True
+
+
+def get_persistence_stats() -> dict:
+    with _save_cond:
+        stats = _persist_stats.copy()
+        stats["dirty"] = _dirty
+    return stats
+
+
+atexit.register(flush_params)
 
 
 def load_params():
@@ -63,24 +211,123 @@ def load_params():
         pass
 
 
+def ensure_params_loaded():
+    global _loaded
+    if _loaded:
+        return
+    with _params_lock:
+        if not _loaded:
+            load_params()
+            _loaded = True
+
+
+# _params is never modified in place once loaded. Every update builds a new
+# dict and swaps it in (copy-on-write), so a reader holding a reference -
+# e.g. the sender pinning one snapshot per frame - always sees a consistent
+# set of params.
+_params_version = 0
+_local = threading.local()
+
+
+class ParamValidationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors  # key: message
+        super().__init__(
+            "; ".join(f"{key}: {msg}" for key, msg in errors.items())
+        )
+
+
+def _current_params():
+    if not _loaded:
+        ensure_params_loaded()
+    pinned = getattr(_local, "params", None)
+    return pinned if pinned is not None else _params
+
+
+@contextlib.contextmanager
+def pinned_params(params=None):
+    """Serve the same params snapshot (default: the current one) to this thread
+    for the duration of the block."""
+    ensure_params_loaded()
+    prev = getattr(_local, "params", None), getattr(_local, "version", None)
+    # read before _params, so it is never newer than the snapshot
+    _local.version = _params_version if params is None else None
+    _local.params = _params if params is None else params
+    try:
+        yield
+    finally:
+        _local.params, _local.version = prev
+
+
+@contextlib.contextmanager
+def use_mode_params(mode_id, params=None):
+    """Like pinned_params(), with MODE switched to mode_id for this thread only.
+
+    Lets a mode be evaluated off-line (e.g. to validate it) while the sender
+    keeps running the real MODE.
+    """
+    ensure_params_loaded()
+    prev = getattr(_local, "params", None), getattr(_local, "version", None)
+    _local.version = None
+    _local.params = dict(_params if params is None else params, MODE=str(mode_id))
+    try:
+        yield
+    finally:
+        _local.params, _local.version = prev
+
+
 def get_params_full() -> dict:
-    return _params.copy()
+    return _current_params().copy()
 
 
 def get_params_mode() -> dict:
-    return _params.get("MODES", {}).get(str(_params.get("MODE", "1")), {}).copy()
+    params = _current_params()
+    return params.get("MODES", {}).get(str(params.get("MODE", "1")), {}).copy()
+
+
+def get_params_version() -> int:
+    # that of the snapshot pinned_params() serves, if any
+    version = getattr(_local, "version", None)
+    if version is not None and getattr(_local, "params", None) is not None:
+        return version
+    return _params_version
+
+
+def get_params_hash(params=None) -> str:
+    if params is None:
+        params = _current_params()
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
 
 
 def key_locked(key):
     return key in LOCKED_KEYS
 
 
+def _copy_with_mode(params, mode_id):
+    new_params = params.copy()
+    new_params["MODES"] = dict(params.get("MODES", {}))
+    new_params["MODES"][mode_id] = dict(new_params["MODES"].get(mode_id, {}))
+    return new_params
+
+
+def _commit(new_params):
+    # caller holds _params_lock
+    global _params, _params_version
+    _params = new_params
+    _params_version += 1
+    return _params_version
+
+
 def set_param_full(key, value):
-    global _params
     if key_locked(key):
         logger.warning("Attempted to set locked param '%s'", key)
         return
-    _params[key] = value
+    ensure_params_loaded()
+    with _params_lock:
+        new_params = _params.copy()
+        new_params[key] = value
+        _commit(new_params)
     save_params()
 
 
@@ -88,41 +335,157 @@ def set_param_mode(key, value):
     if key_locked(key):
         logger.warning("Attempted to set locked mode param '%s'", key)
         return
-    global _params
-    mode_id = str(_params.get("MODE", "1"))
-    if "MODES" not in _params:
-        _params["MODES"] = {}
-    if mode_id not in _params["MODES"]:
-        _params["MODES"][mode_id] = {}
-    _params["MODES"][mode_id][key] = value
+    ensure_params_loaded()
+    with _params_lock:
+        mode_id = str(_params.get("MODE", "1"))
+        new_params = _copy_with_mode(_params, mode_id)
+        new_params["MODES"][mode_id][key] = value
+        _commit(new_params)
     save_params()
     return
 
 
 def set_params(**kwargs):
-    global _params
+    ensure_params_loaded()
+    with _params_lock:
+        new_params = _params.copy()
+        for key, value in kwargs.items():
+            if key in new_params and key == "MODE":
+                logger.debug("Setting param '%s' to: %s", key, value)
+                new_params[key] = value
 
-    for key, value in kwargs.items():
-        if key in _params and key == "MODE":
-            logger.debug("Setting param '%s' to: %s", key, value)
-            _params[key] = value
+        mode_id = str(new_params.get("MODE", "1"))
+        new_params = _copy_with_mode(new_params, mode_id)
+        for key, value in kwargs.items():
+            if key_locked(key):
+                logger.warning("Attempted to set locked one of params '%s'", key)
+                return
+            elif key in new_params and key != "MODE":
+                logger.debug("Setting param '%s' to: %s", key, value)
+                new_params[key] = value
+            elif key in new_params["MODES"][mode_id]:
+                new_params["MODES"][mode_id][key] = value
+        _commit(new_params)
+    save_params()
+    return
 
-    for key, value in kwargs.items():
+
+_TRUE_STRINGS = ("true", "1", "on", "yes")
+_FALSE_STRINGS = ("false", "0", "off", "no")
+
+
+def _cast_like(current, value):
+    if current is None:
+        return value
+    if isinstance(current, bool):
+        if isinstance(value, str):
+            if value.lower() in _TRUE_STRINGS:
+                return True
+            if value.lower() in _FALSE_STRINGS:
+                return False
+            raise ValueError(f"expected bool, got '{value}'")
+        if isinstance(value, (bool, int)):
+            return bool(value)
+        raise ValueError(f"expected bool, got {type(value).__name__}")
+    if isinstance(current, int):
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"expected int, got {value}")
+        return int(value)
+    if isinstance(current, float):
+        return float(value)
+    if isinstance(current, str):
+        return str(value)
+    if not isinstance(value, type(current)):
+        raise ValueError(
+            f"expected {type(current).__name__}, got {type(value).__name__}"
+        )
+    return value
+
+
+def validate_param_batch(updates) -> dict:
+    """Cast every value in the batch against the existing one.
+
+    Mode keys are resolved against the mode the batch switches to (if it
+    contains MODE). Raises ParamValidationError listing all bad keys.
+    """
+    ensure_params_loaded()
+    errors = {}
+    validated = {}
+    params = _params
+    modes = params.get("MODES", {})
+
+    mode_id = str(params.get("MODE", "1"))
+    if "MODE" in updates:
+        try:
+            mode_value = _cast_like(params.get("MODE"), updates["MODE"])
+            if str(mode_value) not in modes:
+                raise ValueError(f"unknown mode '{mode_value}'")
+            validated["MODE"] = mode_value
+            mode_id = str(mode_value)
+        except (TypeError, ValueError) as e:
+            errors["MODE"] = str(e)
+    params_mode = modes.get(mode_id, {})
+
+    for key, value in updates.items():
+        if key == "MODE":
+            continue
         if key_locked(key):
-            logger.warning("Attempted to set locked one of params '%s'", key)
-            return
-        elif key in _params and key != "MODE":
-            logger.debug("Setting param '%s' to: %s", key, value)
-            _params[key] = value
-        elif key in _params.get("MODES", {}).get(str(_params.get("MODE", "1")), {}):
-            mode_id = str(_params.get("MODE", "1"))
-            if "MODES" not in _params:
-                _params["MODES"] = {}
-            if mode_id not in _params["MODES"]:
-                _params["MODES"][mode_id] = {}
-            _params["MODES"][mode_id][key] = value
+            errors[key] = "locked"
+            continue
+        if key == "MODES":
+            errors[key] = "not settable"
+            continue
+        if key in params:
+            current = params[key]
+        elif key in params_mode:
+            current = params_mode[key]
+        else:
+            errors[key] = "unknown param"
+            continue
+        try:
+            validated[key] = _cast_like(current, value)
+            if key == "INPUT_SOURCE" and validated[key] not in INPUT_SOURCES:
+                raise ValueError(f"unknown input source '{validated[key]}'")
+        except (TypeError, ValueError) as e:
+            errors[key] = str(e)
+
+    if errors:
+        raise ParamValidationError(errors)
+    return validated
+
+
+def _commit_validated(validated):
+    # caller holds _params_lock
+    new_params = _params.copy()
+    if "MODE" in validated:
+        new_params["MODE"] = validated["MODE"]
+    mode_id = str(new_params.get("MODE", "1"))
+    new_params = _copy_with_mode(new_params, mode_id)
+    for key, value in validated.items():
+        if key == "MODE":
+            continue
+        if key in new_params:
+            new_params[key] = value
+        else:
+            new_params["MODES"][mode_id][key] = value
+    return _commit(new_params)
+
+
+def apply_param_batch(updates) -> int:
+    """Validate and apply all updates at once. Returns the new params version."""
+    with _params_lock:
+        validated = validate_param_batch(updates)
+        version = _commit_validated(validated)
     save_params()
-    return
+    logger.debug("Applied param batch v%d: %s", version, validated)
+    return version
 
 
-load_params()
+def commit_param_batch(validated) -> int:
+    """Apply a batch that already went through validate_param_batch()."""
+    ensure_params_loaded()
+    with _params_lock:
+        version = _commit_validated(validated)
+    save_params()
+    logger.debug("Applied param batch v%d: %s", version, validated)
+    return version
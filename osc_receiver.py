@@ -9,7 +9,11 @@ from osc_params import get_params_full
 osc_receiver_started = False
 osc_receiver_lock = threading.Lock()
 
-OSC_RECV_PORTS = get_params_full().get("OSC_RECV_PORTS", [50100, 50101, 50102, 50103])
+DEFAULT_OSC_RECV_PORTS = [50100, 50101, 50102, 50103]
+
+
+def get_osc_recv_ports():
+    return get_params_full().get("OSC_RECV_PORTS", DEFAULT_OSC_RECV_PORTS)
 
 _booted_callbacks = []
 _position_callbacks = []
@@ -62,7 +66,7 @@ def osc_receive_handler_factory(port):
                 cb(port, *args)
         elif address == "/position":
             if len(args) >= 2:
-                port_idx = OSC_RECV_PORTS.index(port)
+                port_idx = get_osc_recv_ports().index(port)
                 motor_id = int(args[0]) + port_idx * get_params_full().get(
                     "VALS_PER_HOST", 8
                 )
@@ -73,7 +77,7 @@ def osc_receive_handler_factory(port):
                     cb(port, motor_id, position)
         elif address == "/homingStatus":
             if len(args) >= 2:
-                port_idx = OSC_RECV_PORTS.index(port)
+                port_idx = get_osc_recv_ports().index(port)
                 motor_id = int(args[0]) + port_idx * get_params_full().get(
                     "VALS_PER_HOST", 8
                 )
@@ -107,7 +111,7 @@ def start_osc_receiver_thread():
             )
             return
         osc_receiver_started = True
-    for port in OSC_RECV_PORTS:
+    for port in get_osc_recv_ports():
         recv_thread = threading.Thread(
             target=start_osc_receiver, args=(port,), daemon=True
         )
@@ -1,16 +1,32 @@
 from pythonosc.udp_client import SimpleUDPClient
+from pythonosc.osc_message_builder import OscMessageBuilder
 from osc_params import (
     VALS_PER_HOST,
     MOTOR_POSITION_MAPPING,
     get_params_full,
     get_params_mode,
+    get_params_version,
+    pinned_params,
 )
-from osc_modes import make_frame
-import sys, time, math, random
+import osc_modes
+from osc_param_queue import apply_pending_params
+from telemetry import record_commanded
+from frame_recorder import limit_flags, record_frame
+from output_stage import OutputStage, output_stage_key
+from keyframes import KeyframeGenerator
+from crossfade import OutgoingMode, Transition
+from timebase import UTimebase, u_settings, RETENTION as TIMEBASE_RETENTION
+from layout import get_layout
+from limits import apply_limits
+from impacts import impacts
+from frame_stream import frame_stream
+import numpy as np
+import sys, time, socket, threading
 from logger_config import logger
 
 prev_vals = None
 current_speed = None
+last_limit_flags = 0
 
 
 def get_current_speed():
@@ -32,6 +48,20 @@ def set_prev_vals(vals):
     prev_vals = vals.copy() if vals is not None else None
 
 
+excluded_boards = set()  # board indices (order of HOSTS) that get no frames
+
+
+def set_board_excluded(board_idx, excluded=True):
+    if excluded:
+        excluded_boards.add(board_idx)
+    else:
+        excluded_boards.discard(board_idx)
+
+
+def get_excluded_boards():
+    return set(excluded_boards)
+
+
 def get_clients():
     return [
         SimpleUDPClient(host, int(get_params_full()["PORT"]))
@@ -39,48 +69,248 @@ def get_clients():
     ]
 
 
-clients = get_clients()
+_clients = None
+
+
+def get_board_clients():
+    """Long-lived clients of the boards; opened on first use (or by bootstrap)."""
+    global _clients
+    if _clients is None:
+        _clients = get_clients()
+    return _clients
+
+
+# --- Emergency halt ---
+# Frames go out under send_lock and only while halt_event is clear.
+# halt_all() sets the event before it takes the lock, so once it holds the
+# lock no frame (not even the rest of one in flight) can follow /hardHiZ.
+halt_event = threading.Event()
+send_lock = threading.Lock()
+
+_hard_hiz_builder = OscMessageBuilder(address="/hardHiZ")
+_hard_hiz_builder.add_arg(255)
+HARD_HIZ_PACKET = _hard_hiz_builder.build().dgram
+
+_halt_socket = None
+_halt_addresses = []
+last_halt = None
+
+
+def open_halt_socket():
+    global _halt_socket, _halt_addresses
+    if _halt_socket is not None:
+        return
+    _halt_addresses = [
+        (host, int(get_params_full()["PORT"])) for host in get_params_full()["HOSTS"]
+    ]
+    _halt_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+def open_clients():
+    """Open the board sockets up front so neither frames nor a halt wait for it."""
+    open_halt_socket()
+    return get_board_clients()
+
+
+def halt_all(repeat=3, interval=0.005):
+    """Preempt the sender and send /hardHiZ to every board `repeat` times.
+
+    Rounds are interleaved over the boards (all boards get the first copy
+    before any gets the second), `interval` seconds apart against burst loss.
+    """
+    global last_halt
+    t_request = time.perf_counter()
+    halt_event.set()
+    open_halt_socket()
+    with send_lock:
+        t_locked = time.perf_counter()
+        t_first = None
+        sent = 0
+        errors = 0
+        for r in range(max(int(repeat), 1)):
+            if r > 0 and interval > 0:
+                time.sleep(interval)
+            for addr in _halt_addresses:
+                try:
+                    _halt_socket.sendto(HARD_HIZ_PACKET, addr)
+                    sent += 1
+                except OSError as e:
+                    errors += 1
+                    logger.error(f"halt send error to {addr[0]}: {e}")
+            if t_first is None:
+                t_first = time.perf_counter()
+        t_last = time.perf_counter()
+    last_halt = {
+        "time": time.time(),
+        "boards": len(_halt_addresses),
+        "repeat": max(int(repeat), 1),
+        "sent": sent,
+        "errors": errors,
+        "preempt_ms": round((t_locked - t_request) * 1000, 3),
+        "first_round_ms": round((t_first - t_request) * 1000, 3),
+        "last_send_ms": round((t_last - t_request) * 1000, 3),
+    }
+    return dict(last_halt)
+
+
+def clear_halt():
+    halt_event.clear()
+
+
+def is_halted():
+    return halt_event.is_set()
+
+
+def get_last_halt():
+    return None if last_halt is None else dict(last_halt)
+
+
+# --- Hot-reload of osc_modes ---
+# The sender evaluates frames through modes_module. A validated new
+# module is handed over with swap_modes() and takes effect at the next
+# frame boundary (apply_pending_modes() at the top of the loop).
+modes_module = osc_modes
+_pending_modes = None
+_modes_lock = threading.Lock()
+
+
+def swap_modes(module):
+    global _pending_modes
+    with _modes_lock:
+        _pending_modes = module
+
+
+def get_modes_module():
+    return modes_module
+
+
+def apply_pending_modes():
+    global modes_module, _pending_modes
+    with _modes_lock:
+        module = _pending_modes
+        _pending_modes = None
+        if module is None:
+            return False
+        modes_module = module
+        sys.modules["osc_modes"] = module
+    logger.info("Swapped in reloaded osc_modes.")
+    return True
+
+
+_output_stage = None
+_output_stage_key = None
+_output_stage_version = None
+
+
+def get_output_stage():
+    """OutputStage for the current params, rebuilt only when they affect it."""
+    global _output_stage, _output_stage_key, _output_stage_version
+    version = get_params_version()
+    if version == _output_stage_version:
+        return _output_stage
+    params_full = get_params_full()
+    key = output_stage_key(params_full)
+    _output_stage_version = version
+    if key != _output_stage_key:
+        _output_stage = OutputStage(
+            params_full.get("NUM_SERVOS", 31),
+            len(params_full["HOSTS"]),
+            VALS_PER_HOST,
+            MOTOR_POSITION_MAPPING,
+            # boards expect exactly VALS_PER_HOST values, the unused tail of
+            # the last board is filled with the stroke offset
+            params_full.get("STROKE_OFFSET", 50000),
+            params_full.get("CALIBRATION"),
+            params_full.get("LIMIT_ABSOLUTE"),
+        )
+        _output_stage_key = key
+    return _output_stage
+
+
+# KEYFRAME_RATE > 0 (and below RATE_fps) evaluates the mode at that rate only
+# and interpolates the frames in between, see keyframes.py
+keyframes = KeyframeGenerator()
+# the global params make_frame reads
+KEYFRAME_GLOBALS = (
+    "STROKE_OFFSET",
+    "NUM_SERVOS",
+    "LAYOUT_FILE",
+    "LAYOUT_NEIGHBOURS",
+    "STROKE_LENGTH_LIMIT",
+    "WAVETABLE_SAMPLES",
+)
+
+
+def get_keyframe_stats():
+    return keyframes.get_stats()
+
+
+def generate_frame(u, num_servos, params_full):
+    keyframe_rate = float(params_full.get("KEYFRAME_RATE", 0))
+    if (
+        keyframe_rate <= 0
+        or keyframe_rate >= float(params_full["RATE_fps"])
+        or modes_module.is_stateful()  # steps forward only, and is cheap
+    ):
+        return modes_module.make_frame(u, num_servos)
+    keyframes.configure(
+        1.0 / keyframe_rate, float(params_full.get("KEYFRAME_MAX_ERROR", 100.0))
+    )
+    module = modes_module
+    mode_id = str(params_full.get("MODE"))
+    # the mode dict keeps its identity while unchanged (params are
+    # copy-on-write) and compares equal to an unchanged copy, so param
+    # writes that do not affect make_frame keep the keyframes
+    source = (
+        mode_id,
+        params_full.get("MODES", {}).get(mode_id),
+        *(params_full.get(key) for key in KEYFRAME_GLOBALS),
+        id(module),
+        impacts.generation,
+    )
+    return keyframes.frame(
+        u,
+        source,
+        lambda t: module.make_frame(t, num_servos),
+        time.time(),
+    )
+
 
 def get_client_gh():
     return SimpleUDPClient(get_params_full()["HOST"], int(get_params_full()["PORT"]))
 
 
 def send_all_setTargetPositionList(vals):
+    if halt_event.is_set():
+        return False, False
 
     set_prev_vals(vals)
 
-    mapped_vals = [0] * get_params_full().get("NUM_SERVOS", 31)
-    motor_position_mapping = MOTOR_POSITION_MAPPING
-    for i in range(get_params_full().get("NUM_SERVOS", 31)):
-        mapped_vals[i] = (
-            vals[i] if motor_position_mapping == {} else vals[motor_position_mapping[i]]
-        )
+    stage = get_output_stage()
+    mapped_vals = stage.map(vals)
+    record_commanded(mapped_vals)
 
     sent_boards = False
     sent_gh = False
     if get_params_full().get("SEND_CLIENTS", True):
-        for i, client in enumerate(clients):
-
-            vals_part = mapped_vals[i * VALS_PER_HOST : (i + 1) * VALS_PER_HOST]
-
-            try:
-                # Some boards expect a fixed number of arguments (VALS_PER_HOST).
-                # If the last board receives fewer values (because NUM_SERVOS
-                # is not a multiple of VALS_PER_HOST), pad the list with the
-                # stroke offset so the board receives the expected count and
-                # does not raise an OSC syntax error.
-                if len(vals_part) < VALS_PER_HOST:
-                    pad_val = int(get_params_full().get("STROKE_OFFSET", 50000))
-                    vals_part = vals_part + [pad_val] * (VALS_PER_HOST - len(vals_part))
-
-                client.send_message("/setTargetPositionList", vals_part)
-                sent_boards = True
-            except Exception as e:
-                logger.error(f"send error to {get_params_full()['HOSTS'][i]}: {e}")
+        with send_lock:
+            for i, client in enumerate(get_board_clients()):
+                if halt_event.is_set():
+                    break
+                if i in excluded_boards:
+                    continue
+
+                try:
+                    client.send_message(
+                        "/setTargetPositionList", stage.board_values(i)
+                    )
+                    sent_boards = True
+                except Exception as e:
+                    logger.error(f"send error to {get_params_full()['HOSTS'][i]}: {e}")
     if get_params_full().get("SEND_CLIENT_GH", False):
         client_gh = get_client_gh()
         try:
-            client_gh.send_message("/setTargetPositionList", mapped_vals)
+            client_gh.send_message("/setTargetPositionList", mapped_vals.tolist())
             sent_gh = True
         except Exception as e:
             logger.error("send error to {}: {}".format(get_params_full()["HOST"], e))
@@ -102,56 +332,22 @@ def gh_reset():
 
 
 def filter_vals(raw_vals, alpha):
-    vals = raw_vals.copy()
-
     prev = get_prev_vals()
-    if prev is None:
-        vals = raw_vals
-    else:
-        vals = [int(p + alpha * (c - p)) for p, c in zip(prev, raw_vals)]
-
-    # Apply limits ==============================
-    # === Absolute limit ========================
-    limited_absolute = False
-    limit_absolute = get_params_full().get("LIMIT_ABSOLUTE")
-    for i in range(len(vals)):
-        if vals[i] > limit_absolute:
-            vals[i] = limit_absolute
-            limited_absolute = True
-        elif vals[i] < 0:
-            vals[i] = 0
-            limited_absolute = True
-
-    # === Relational limit ======================
-    limited_relational = False
-    limit_relational = get_params_full().get("LIMIT_RELATIONAL")
-    valsLPF = vals.copy()
-
-    def solve_relational_limit(a, c):
-        return 0.5 * (math.sqrt(4 * c * c - 3 * a * a) - a)
-
-    for i in range(1, len(vals) - 1):
-        b_1 = solve_relational_limit(valsLPF[i - 1], limit_relational)
-        b_2 = solve_relational_limit(valsLPF[i + 1], limit_relational)
-        if b_1 - valsLPF[i] < 0 or b_2 - valsLPF[i] < 0:
-            vals[i] = 0.5 * min(b_1 + valsLPF[i], b_2 + valsLPF[i])
-            limited_relational = True
-
-    # === Speed limit ===========================
-    limited_speed = False
-    limit_speed = get_params_full().get("LIMIT_SPEED") / float(
-        get_params_full().get("RATE_fps", 24)
+    params_full = get_params_full()
+    limit_speed = params_full.get("LIMIT_SPEED") / float(params_full.get("RATE_fps", 24))
+    vals, (limited_absolute, limited_relational, limited_speed), _ = apply_limits(
+        raw_vals,
+        prev,
+        alpha,
+        params_full.get("LIMIT_ABSOLUTE"),
+        params_full.get("LIMIT_RELATIONAL"),
+        limit_speed,
+        get_layout(),
     )
-    for i in range(len(vals)):
-        if vals[i] - prev[i] > limit_speed:
-            vals[i] = prev[i] + limit_speed
-            limited_speed = True
-        elif vals[i] - prev[i] < -limit_speed:
-            vals[i] = prev[i] - limit_speed
-            limited_speed = True
 
-    global current_speed
+    global current_speed, last_limit_flags
     current_speed = [vals[i] - prev[i] for i in range(len(vals))]
+    last_limit_flags = limit_flags(limited_absolute, limited_relational, limited_speed)
 
     if limited_relational or limited_absolute or limited_speed:
         logger.warning(
@@ -164,6 +360,29 @@ def filter_vals(raw_vals, alpha):
     return vals
 
 
+def send_replay_frame(vals, dt):
+    """Send a replayed frame through the output limits; dt is the time since
+    the previous one (the speed limit is per second of replay)."""
+    params_full = get_params_full()
+    vals, flags, _ = apply_limits(
+        vals,
+        get_prev_vals(),
+        1.0,
+        params_full.get("LIMIT_ABSOLUTE"),
+        params_full.get("LIMIT_RELATIONAL"),
+        params_full.get("LIMIT_SPEED") * dt,
+        get_layout(),
+    )
+    if any(flags):
+        logger.warning(
+            "Replay limited: %s%s%s",
+            "[ABS]" if flags[0] else "",
+            "[REL]" if flags[1] else "",
+            "[SPE]" if flags[2] else "",
+        )
+    return send_all_setTargetPositionList(vals)
+
+
 __repeat_mode = False
 
 
@@ -177,104 +396,186 @@ def get_repeat_mode():
     return __repeat_mode
 
 
+_frame_callbacks = []
+_next_transition = None  # (duration, curve, wipe) for the next switch only
+_next_mode_time = None  # mode time the next switch starts at
+_mode_clock = {"mode": None, "t": 0.0, "u": 0.0, "rate": None}
+
+
+def register_frame_callback(cb):
+    """cb(dt) runs in the sender thread at every frame boundary."""
+    _frame_callbacks.append(cb)
+
+
+def set_next_transition(duration, curve="linear", wipe=0.0):
+    # overrides the EASING_* params of the mode switched to next
+    global _next_transition
+    _next_transition = (duration, curve, wipe)
+
+
+def set_next_mode_time(t):
+    # start the next mode t seconds into its u(t) schedule (seeking)
+    global _next_mode_time
+    _next_mode_time = float(t)
+
+
+def get_mode_clock():
+    return dict(_mode_clock)
+
+
 def osc_sender(stop_event):
+    global _next_transition, _next_mode_time
 
-    # u[f+1] = u[f] + dudt * dt
+    # u = timebase.u_at(t_mode), t_mode: seconds since the mode started
     u = 0.0
-    u_t_rate = 1.0
-    u_t_rate_target = 1.0
-    u_t_rate_accel = 0.01  # absolute
-    u_t_keep = 0
+    t_mode = 0.0
+    timebase = None
 
     dt = 1.0 / float(get_params_full()["RATE_fps"])
     t_schedule = time.time() + dt
 
     frame = 0
+    tick = 0
     last_msg_len = 0
     mode = get_params_full().get("MODE")
 
-    easing_from = []
-    easing_to = []
+    transition = None
+    frame_params = None  # params of the last frame, kept by a fading-out mode
+    streaming = False
 
     starting_motion = True
     __repeat_mode = False
 
-    while not stop_event.is_set():
-        if (
-            mode != get_params_full().get("MODE")
-            or starting_motion
-            or get_repeat_mode()
-        ):
-            if get_repeat_mode():
-                set_repeat_mode(False)
-            starting_motion = False
-
-            mode = get_params_full().get("MODE")
-            logger.info("Switched to mode %s =====", mode)
-            easing_duration = get_params_mode().get("EASING_DURATION", 1.0)
-            if easing_duration > 0.0:
-                u = -easing_duration
-                easing_from = get_prev_vals()
-                easing_to = make_frame(0, get_params_full().get("NUM_SERVOS", 31))
-            else:
-                u = 0.0
-            u_t_keep = 0
-            frame = 0
-
-        u_t_keep += dt
-
-        raw_vals = get_prev_vals()
-        if u >= 0:
-            U_FREQUENTNESS = get_params_mode().get("U_FREQUENTNESS", 0.1)
-            U_WIDTH = get_params_mode().get("U_WIDTH", 1.0)
-            if U_FREQUENTNESS <= 0.0 or U_WIDTH <= 0.0:
-                u_t_rate_target = get_params_mode().get("U_AVERAGE", 1.0)
-            elif u_t_keep >= (1.0 / U_FREQUENTNESS):
-                u_t_rate_target = random.uniform(
-                    get_params_mode().get("U_AVERAGE", 1.0)
-                    - get_params_mode().get("U_WIDTH", 1.0) / 2,
-                    get_params_mode().get("U_AVERAGE", 1.0)
-                    + get_params_mode().get("U_WIDTH", 1.0) / 2,
+    while not stop_event.is_set() and not halt_event.is_set():
+        # Queued param updates land here and the frame below sees one
+        # consistent params snapshot, so a batch never straddles two frames.
+        for cb in _frame_callbacks:
+            try:
+                cb(dt)
+            except Exception as e:
+                logger.error("Frame callback error: %s", e)
+        apply_pending_params(tick)
+        apply_pending_modes()
+        tick += 1
+
+        with pinned_params():
+            if (
+                mode != get_params_full().get("MODE")
+                or starting_motion
+                or get_repeat_mode()
+            ):
+                if get_repeat_mode():
+                    set_repeat_mode(False)
+                # the outgoing mode keeps running during the crossfade; on
+                # the first start or a switch during a crossfade the last
+                # output is held instead
+                can_fade_out = not starting_motion and transition is None
+                starting_motion = False
+
+                params_full = get_params_full()
+                params_mode = get_params_mode()
+                if _next_transition is not None:
+                    easing_duration, curve, wipe = _next_transition
+                    _next_transition = None
+                else:
+                    easing_duration = params_mode.get("EASING_DURATION", 1.0)
+                    curve = params_mode.get(
+                        "EASING_CURVE", params_full.get("EASING_CURVE", "linear")
+                    )
+                    wipe = params_mode.get("EASING_WIPE", params_full.get("EASING_WIPE", 0.0))
+                transition = None
+                if easing_duration > 0.0:
+                    num_servos = params_full.get("NUM_SERVOS", 31)
+                    outgoing = None
+                    if can_fade_out and frame_params is not None:
+                        outgoing = OutgoingMode(
+                            modes_module, mode, timebase, t_mode, num_servos, frame_params
+                        )
+                    try:
+                        transition = Transition(
+                            num_servos,
+                            easing_duration,
+                            curve=curve,
+                            wipe=wipe,
+                            offset=params_full.get("STROKE_OFFSET", 0.0),
+                            outgoing=outgoing,
+                            frozen=None if outgoing else get_prev_vals(),
+                        )
+                    except ValueError as e:
+                        logger.warning("No crossfade: %s", e)
+
+                mode = params_full.get("MODE")
+                logger.info("Switched to mode %s =====", mode)
+                timebase = UTimebase.for_mode(mode, params_full, params_mode)
+                # impacts were spawned on the old mode's timeline
+                impacts.clear()
+                t_mode = 0.0
+                if _next_mode_time is not None:
+                    t_mode, _next_mode_time = _next_mode_time, None
+                frame = 0
+
+            params_full = get_params_full()
+            # U_* changes take effect from now on; a no-op while unchanged
+            timebase.configure(t_mode, u_settings(params_full, get_params_mode()))
+            t_mode += dt
+            u = timebase.u_at(t_mode)
+            timebase.forget(t_mode - TIMEBASE_RETENTION)
+            _mode_clock.update(mode=mode, t=t_mode, u=u, rate=timebase.rate_at(t_mode))
+            impacts.cull(u)
+
+            was_streaming = streaming
+            streaming = params_full.get("INPUT_SOURCE", "modes") == "stream"
+            if streaming:
+                # external frames; held while none are due
+                raw_vals = frame_stream.frame(
+                    time.time(), float(params_full.get("FRAME_STREAM_DELAY", 0.1))
                 )
-                u_t_keep = 0.0
-                logger.debug("New u_t_rate_target: {:.3f}".format(u_t_rate_target))
-
-            if u_t_rate - u_t_rate_target > u_t_rate_accel:
-                u_t_rate -= u_t_rate_accel
-            elif u_t_rate - u_t_rate_target < -u_t_rate_accel:
-                u_t_rate += u_t_rate_accel
+                if raw_vals is None:
+                    raw_vals = np.asarray(get_prev_vals(), dtype=np.float64)
             else:
-                u_t_rate = u_t_rate_target
-            u_t_rate = max(u_t_rate, 0.0)
-
-            u += u_t_rate * dt
-
-            raw_vals = make_frame(u, get_params_full().get("NUM_SERVOS", 31))
-        else:
-            for i in range(get_params_full().get("NUM_SERVOS", 31)):
-                raw_vals[i] = easing_from[i] * (
-                    1 - (u_t_keep / easing_duration)
-                ) + easing_to[i] * (u_t_keep / easing_duration)
-            u += dt
-
-        alpha = float(get_params_full().get("ALPHA", 0.2))
-        prev = get_prev_vals()
-        if prev is None:
-            set_prev_vals(raw_vals)
-        filt_vals = filter_vals(raw_vals, alpha)
-        set_prev_vals(filt_vals)
-        sent_boards, sent_gh = send_all_setTargetPositionList(filt_vals)
-        msg = (
-            f"\rOSC[{frame}] "
-            f"{'[boards]' if sent_boards else '[     ]'}"
-            f"{'[gh]' if sent_gh else '[  ]'} "
-            f"1st8: {filt_vals[:8]}  min:{min(filt_vals):6.1f}  max:{max(filt_vals):6.1f}"
-        )
-        pad = " " * max(0, last_msg_len - len(msg) + 1)
-        print(msg + pad, end="", flush=True)
-        last_msg_len = len(msg)
+                if was_streaming:
+                    # back to the modes: fade out of the last streamed frame
+                    params_mode = get_params_mode()
+                    try:
+                        transition = Transition(
+                            params_full.get("NUM_SERVOS", 31),
+                            params_mode.get("EASING_DURATION", 1.0),
+                            curve=params_mode.get(
+                                "EASING_CURVE", params_full.get("EASING_CURVE", "linear")
+                            ),
+                            offset=params_full.get("STROKE_OFFSET", 0.0),
+                            frozen=get_prev_vals(),
+                        )
+                    except ValueError as e:
+                        logger.warning("No crossfade: %s", e)
+                raw_vals = generate_frame(
+                    u, params_full.get("NUM_SERVOS", 31), params_full
+                )
+                frame_params = params_full
+                if transition is not None:
+                    raw_vals = transition.step(raw_vals, dt)
+                    if transition.done:
+                        transition = None
+
+            alpha = float(get_params_full().get("ALPHA", 0.2))
+            prev = get_prev_vals()
+            if prev is None:
+                set_prev_vals(raw_vals)
+            filt_vals = filter_vals(raw_vals, alpha)
+            set_prev_vals(filt_vals)
+            sent_boards, sent_gh = send_all_setTargetPositionList(filt_vals)
+            record_frame(filt_vals, last_limit_flags)
+            msg = (
+                f"\rOSC[{frame}] "
+                f"{'[boards]' if sent_boards else '[     ]'}"
+                f"{'[gh]' if sent_gh else '[  ]'} "
+                f"1st8: {filt_vals[:8]}  min:{min(filt_vals):6.1f}  max:{max(filt_vals):6.1f}"
+            )
+            pad = " " * max(0, last_msg_len - len(msg) + 1)
+            print(msg + pad, end="", flush=True)
+            last_msg_len = len(msg)
 
-        frame += 1
+            frame += 1
 
         t_schedule += dt
         sleep_time = t_schedule - time.time()
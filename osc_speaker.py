@@ -1,11 +1,19 @@
-from pythonosc.udp_client import SimpleUDPClient
 from logger_config import logger
 
 class OSCSpeaker:
     def __init__(self, host="127.0.0.1", port=10001):
         self.host = host
         self.port = port
-        self.client = SimpleUDPClient(self.host, self.port)
+        self._client = None
+
+    @property
+    def client(self):
+        # the socket is opened on the first message, not at import
+        if self._client is None:
+            from pythonosc.udp_client import SimpleUDPClient
+
+            self._client = SimpleUDPClient(self.host, self.port)
+        return self._client
 
     def send_message(self, address, *args):
         self.client.send_message(address, args)
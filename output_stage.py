@@ -0,0 +1,113 @@
+import json
+import numpy as np
+from logger_config import logger
+
+# Last step before the boards: spiral order -> physical motor order,
+# optional per-motor calibration, and the per-board /setTargetPositionList
+# layout (VALS_PER_HOST values each, padded with STROKE_OFFSET).
+#
+# Everything that does not change from frame to frame (permutation index,
+# calibration arrays, padding, board slices) is computed once in __init__;
+# a frame is one fancy-indexing take into a preallocated buffer.
+#
+# CALIBRATION in params.json, keyed by motorID (1-based, physical order),
+# every field optional:
+#   "CALIBRATION": {"5": {"gain": 1.02, "offset": -300, "min": 2000, "max": 95000}}
+# applied as clip(value * gain + offset, min, max). The result is always
+# clipped to [0, LIMIT_ABSOLUTE] as well, since calibration comes after the
+# limits of filter_vals.
+
+
+class OutputStage:
+    def __init__(
+        self,
+        num_servos,
+        num_boards,
+        vals_per_host,
+        mapping=None,
+        pad_value=0,
+        calibration=None,
+        limit_absolute=None,
+    ):
+        self.num_servos = int(num_servos)
+        self.num_boards = int(num_boards)
+        self.vals_per_host = int(vals_per_host)
+
+        if mapping:
+            self.index = np.asarray(mapping[: self.num_servos], dtype=np.intp)
+        else:
+            self.index = np.arange(self.num_servos, dtype=np.intp)
+
+        size = max(self.num_boards * self.vals_per_host, self.num_servos)
+        # padding stays in place, only [:num_servos] is written per frame
+        self.buffer = np.full(size, int(pad_value), dtype=np.int32)
+        self.mapped = self.buffer[: self.num_servos]
+        self.board_views = [
+            self.buffer[i * self.vals_per_host : (i + 1) * self.vals_per_host]
+            for i in range(self.num_boards)
+        ]
+        self._work = np.empty(self.num_servos, dtype=np.float64)
+
+        self.gain = None
+        self.offset = None
+        self.lower = None
+        self.upper = None
+        if calibration:
+            self._load_calibration(calibration, limit_absolute)
+
+    def _load_calibration(self, calibration, limit_absolute=None):
+        gain = np.ones(self.num_servos)
+        offset = np.zeros(self.num_servos)
+        lower = np.full(self.num_servos, -np.inf)
+        upper = np.full(self.num_servos, np.inf)
+        for motor_id, entry in calibration.items():
+            m = int(motor_id) - 1
+            if m < 0 or m >= self.num_servos:
+                logger.warning("CALIBRATION for unknown motorID %s ignored", motor_id)
+                continue
+            gain[m] = float(entry.get("gain", 1.0))
+            offset[m] = float(entry.get("offset", 0.0))
+            lower[m] = float(entry.get("min", -np.inf))
+            upper[m] = float(entry.get("max", np.inf))
+        if np.any(gain != 1.0):
+            self.gain = gain
+        if np.any(offset != 0.0):
+            self.offset = offset
+        if (self.gain is not None or self.offset is not None) and limit_absolute is not None:
+            np.maximum(lower, 0.0, out=lower)
+            np.minimum(upper, float(limit_absolute), out=upper)
+        if np.any(np.isfinite(lower)) or np.any(np.isfinite(upper)):
+            self.lower = lower
+            self.upper = upper
+
+    def map(self, vals):
+        """Map one frame (spiral order) into the buffer; returns the int32 view
+        of the NUM_SERVOS values in physical motor order."""
+        work = self._work
+        np.take(np.asarray(vals, dtype=np.float64), self.index, out=work)
+        if self.gain is not None:
+            work *= self.gain
+        if self.offset is not None:
+            work += self.offset
+        if self.lower is not None:
+            np.clip(work, self.lower, self.upper, out=work)
+        np.rint(work, out=work)
+        self.mapped[:] = work
+        return self.mapped
+
+    def board_values(self, board_idx):
+        return self.board_views[board_idx].tolist()
+
+
+def output_stage_key(params_full):
+    # the params an OutputStage is built from (the mapping is a constant)
+    return json.dumps(
+        [
+            params_full.get("NUM_SERVOS", 31),
+            len(params_full.get("HOSTS", [])),
+            params_full.get("STROKE_OFFSET", 50000),
+            params_full.get("CALIBRATION"),
+            params_full.get("LIMIT_ABSOLUTE"),
+        ],
+        sort_keys=True,
+    )
@@ -0,0 +1,102 @@
+import struct
+import numpy as np
+
+# Binary wire format of the "servo_positions_bin" SocketIO event
+# (little endian, decoded by static/main.js):
+#
+#   header  : uint8 kind, uint8 reserved, uint16 count, uint32 seq
+#   KEYFRAME: int32 offset, int32[count] positions relative to offset
+#   DELTA16 : int16[count] difference to the last keyframe
+#   DELTA32 : int32[count] difference to the last keyframe
+#
+# Deltas always refer to the last keyframe (not to the previous packet), so
+# a lost or late packet never accumulates error on the client.
+
+KEYFRAME = 0
+DELTA16 = 1
+DELTA32 = 2
+
+HEADER = struct.Struct("<BBHI")
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+class PositionStreamEncoder:
+    def __init__(self, keyframe_interval=30):
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.seq = 0
+        self.keyframe = None
+        self.keyframe_offset = None
+        self.since_keyframe = 0
+        self.last_sent = None
+        self.stats = {"keyframes": 0, "deltas": 0, "skipped": 0, "bytes": 0}
+
+    def reset(self):
+        """Force a keyframe on the next packet (e.g. a client just connected)."""
+        self.keyframe = None
+        self.last_sent = None
+
+    def encode(self, positions, offset):
+        """Return the packet for this tick, or None if nothing has moved."""
+        rel = np.rint(np.asarray(positions, dtype=float) - offset).astype(np.int32)
+        offset = int(offset)
+
+        if (
+            self.last_sent is not None
+            and self.keyframe_offset == offset
+            and np.array_equal(rel, self.last_sent)
+        ):
+            self.stats["skipped"] += 1
+            return None
+
+        need_keyframe = (
+            self.keyframe is None
+            or self.keyframe_offset != offset
+            or len(self.keyframe) != len(rel)
+            or self.since_keyframe >= self.keyframe_interval
+        )
+
+        if need_keyframe:
+            packet = (
+                HEADER.pack(KEYFRAME, 0, len(rel), self.seq)
+                + struct.pack("<i", offset)
+                + rel.astype("<i4").tobytes()
+            )
+            self.keyframe = rel
+            self.keyframe_offset = offset
+            self.since_keyframe = 0
+            self.stats["keyframes"] += 1
+        else:
+            delta = rel - self.keyframe
+            if delta.min() >= INT16_MIN and delta.max() <= INT16_MAX:
+                packet = HEADER.pack(DELTA16, 0, len(rel), self.seq) + delta.astype(
+                    "<i2"
+                ).tobytes()
+            else:
+                packet = HEADER.pack(DELTA32, 0, len(rel), self.seq) + delta.astype(
+                    "<i4"
+                ).tobytes()
+            self.since_keyframe += 1
+            self.stats["deltas"] += 1
+
+        self.last_sent = rel
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.stats["bytes"] += len(packet)
+        return packet
+
+
+def decode(packet, keyframe=None):
+    """Reference decoder (mirrors static/main.js). Returns (positions, offset, kind)."""
+    kind, _, count, _ = HEADER.unpack_from(packet, 0)
+    body = packet[HEADER.size :]
+    if kind == KEYFRAME:
+        offset = struct.unpack_from("<i", body, 0)[0]
+        positions = np.frombuffer(body, dtype="<i4", count=count, offset=4)
+        return positions.astype(np.int32), offset, kind
+    if keyframe is None:
+        raise ValueError("delta packet without keyframe")
+    positions, offset = keyframe
+    dtype = "<i2" if kind == DELTA16 else "<i4"
+    delta = np.frombuffer(body, dtype=dtype, count=count)
+    return positions + delta.astype(np.int32), offset, kind
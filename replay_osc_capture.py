@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+replay_osc_capture.py
+
+osc_capture.py で保存したPLAYERのOSCセッションを ritsudo_server の listener に
+そのまま送り直し、サーバ側の取り込み性能を測るストレステスト用スクリプト。
+
+使い方例:
+    python replay_osc_capture.py captures/20261019-190000.oscap              # 等速
+    python replay_osc_capture.py captures/20261019-190000.oscap --speed 4    # 4倍速
+    python replay_osc_capture.py captures/20261019-190000.oscap --speed 0    # 最速
+"""
+
+import argparse
+import json
+import socket
+import time
+import urllib.request
+
+from osc_capture import read_capture
+
+
+def fetch_stats(http_base, path):
+    try:
+        with urllib.request.urlopen(http_base + path, timeout=2.0) as res:
+            return json.loads(res.read().decode("utf-8"))
+    except Exception as e:
+        print(f"Could not fetch {path}: {e}")
+        return None
+
+
+def replay(path, host, port, speed):
+    packets = list(read_capture(path))
+    if not packets:
+        print("Capture has no packets.")
+        return 0, 0.0
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    t_cap0 = packets[0][0]
+    t_play0 = time.perf_counter()
+    for t_cap, data in packets:
+        if speed > 0:
+            sleep_time = t_play0 + (t_cap - t_cap0) / speed - time.perf_counter()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+        sock.sendto(data, (host, port))
+    elapsed = time.perf_counter() - t_play0
+    sock.close()
+    return len(packets), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured PLAYER OSC session")
+    parser.add_argument("capture", help="capture file written by osc_capture.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10000)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="1=realtime, N=N times faster, 0=max"
+    )
+    parser.add_argument("--http", default="http://127.0.0.1:5000")
+    parser.add_argument(
+        "--settle", type=float, default=1.0, help="seconds to wait before reading stats"
+    )
+    args = parser.parse_args()
+
+    before = fetch_stats(args.http, "/listener_stats")
+    queue_before = fetch_stats(args.http, "/param_queue_stats")
+    if before is not None:
+        reset_request = urllib.request.Request(
+            args.http + "/listener_stats/reset", method="POST"
+        )
+        try:
+            urllib.request.urlopen(reset_request, timeout=2.0).read()
+        except Exception as e:
+            print(f"Could not reset listener stats: {e}")
+
+    sent, elapsed = replay(args.capture, args.host, args.port, args.speed)
+    print(f"Sent {sent} packets in {elapsed:.3f}s ({sent / max(elapsed, 1e-9):.1f} pkt/s)")
+
+    time.sleep(args.settle)
+    after = fetch_stats(args.http, "/listener_stats")
+    queue_after = fetch_stats(args.http, "/param_queue_stats")
+    if after is None:
+        return
+
+    received = after["packets"]
+    lat = after["latency_ms"]
+    print(f"Server ingested {received}/{sent} packets ({received / max(elapsed, 1e-9):.1f} pkt/s)")
+    print(f"  dropped (never reached listener): {max(sent - received, 0)}")
+    print(f"  invalid packets : {after['invalid']}")
+    print(f"  callback errors : {after['callback_errors']}")
+    if lat["count"]:
+        print(
+            "  callback latency [ms]: "
+            f"mean {lat['mean']:.3f}  p50 {lat['p50']:.3f}  p90 {lat['p90']:.3f}  "
+            f"p99 {lat['p99']:.3f}  max {lat['max']:.3f}"
+        )
+    if queue_before is not None and queue_after is not None:
+        for key in ("received", "coalesced", "applied", "rejected"):
+            print(f"  param queue {key:9s}: {queue_after[key] - queue_before[key]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import sys, time, socket, os
 from flask_socketio import SocketIO
 from logger_config import logger
@@ -8,8 +8,13 @@ from osc_params import (
     get_params_full,
     get_params_mode,
     set_param_full,
-    set_param_mode,
-    set_params,
+    apply_param_batch,
+    validate_param_batch,
+    get_params_version,
+    get_params_hash,
+    ParamValidationError,
+    flush_params,
+    get_persistence_stats,
     MOTOR_POSITION_MAPPING,
     LOCKED_KEYS,
 )
@@ -17,6 +22,7 @@ from osc_params import (
 import osc_sender
 from osc_sender import (
     send_all_setTargetPositionList,
+    send_replay_frame,
     get_clients,
     osc_sender,
     filter_vals,
@@ -25,10 +31,21 @@ from osc_sender import (
     get_current_speed,
     gh_reset,
     set_repeat_mode,
+    set_board_excluded,
+    get_excluded_boards,
+    halt_all,
+    clear_halt,
+    swap_modes,
+    apply_pending_modes,
+    get_modes_module,
+    get_keyframe_stats,
+    register_frame_callback,
+    get_mode_clock,
 )
 from osc_receiver import (
     start_osc_receiver_thread,
     register_booted_callback,
+    register_position_callback,
     get_latest_position,
     get_latest_position_time,
     get_latest_homing_status,
@@ -40,8 +57,44 @@ from osc_listener import (
     register_bundle_callback,
     start_osc_listener_thread,
     register_message_callback,
+    get_listener_stats,
+    reset_listener_stats,
+)
+from osc_capture import start_capture, stop_capture
+from osc_param_queue import (
+    enqueue_param,
+    enqueue_batch,
+    reject_params,
+    register_apply_callback,
+    register_batch_callback,
+    start_param_ticker_thread,
+    get_param_queue_stats,
 )
 from osc_speaker import osc_speaker
+from position_stream import PositionStreamEncoder
+from board_health import HealthMonitor, HEALTHY, DEGRADED, DEAD
+from tracking import TrackingMonitor
+from mode_reload import load_modes_module, validate_modes
+from wavetable import wavetables
+from impacts import impacts
+from stateful import stateful_modes
+from frame_stream import frame_stream
+from sequencer import Sequencer, PlaylistError, load_playlist, parse_playlist
+from frame_recorder import (
+    start_recording,
+    stop_recording,
+    open_recording,
+    peak_step,
+    replay_recording,
+)
+from telemetry import (
+    init_telemetry,
+    record_reported,
+    query_telemetry,
+    get_telemetry_stats,
+)
+
+from bootstrap import prepare_runtime
 
 from pythonosc.udp_client import SimpleUDPClient
 
@@ -52,6 +105,16 @@ osc_thread = None
 stop_event = Event()
 position_broadcast_thread = None
 position_broadcast_stop = Event()
+replay_thread = None
+replay_stop = Event()
+health_monitor = None
+health_thread = None
+health_stop = Event()
+tracking_monitor = None
+tracking_thread = None
+tracking_stop = Event()
+init_in_progress = Event()
+modes_reload_lock = Lock()
 
 
 # --- Helpers ---
@@ -113,45 +176,48 @@ def wait_for_homing_complete(motor_id, timeout=12.0, poll_interval=0.05):
     return None
 
 
-def wait_for_booted(booted_ports, expected_ports, wait_time=10.0, steps=50):
+# --- Position Broadcasting ---
+position_subscribers = set()  # SocketIO sids
+position_encoder = PositionStreamEncoder()
 
-    elapsed = 0
-    for _ in range(steps + 1):
-        if len(booted_ports) >= expected_ports:
-            logger.debug(
-                f">>Boot detected on port(s): {sorted(booted_ports)}, proceeding."
-            )
-            return True
-        time.sleep(wait_time / steps)
-        elapsed += wait_time / steps
-        sys.stdout.write(f"\rWaiting for boot... {elapsed:.1f}s ")
-    logger.warning(
-        f"\nERROR: /booted was not received from all {expected_ports} devices. Received from: {sorted(booted_ports)}"
-    )
-    return False
+
+def get_position_stream_rate(params_full):
+    # POSITION_STREAM_RATE [Hz], never faster than the frames we generate
+    rate = float(params_full.get("POSITION_STREAM_RATE", 30))
+    return max(min(rate, float(params_full.get("RATE_fps", 24))), 1.0)
 
 
-# --- Position Broadcasting ---
 def position_broadcast_worker(stop_event):
-    """Broadcast current servo positions via WebSocket"""
+    """Stream servo positions to connected WebSocket clients as binary deltas"""
+    params_version = None
+    stroke_offset = 0
+    interval = 0.1
+    t_schedule = time.time()
     while not stop_event.is_set():
         try:
-            positions = get_prev_vals()
-            if positions is not None:
+            if get_params_version() != params_version:
+                params_version = get_params_version()
                 params_full = get_params_full()
                 stroke_offset = params_full.get("STROKE_OFFSET", 50000)
-                # Calculate relative positions from offset
-                relative_positions = [int(pos - stroke_offset) for pos in positions]
+                interval = 1.0 / get_position_stream_rate(params_full)
+                position_encoder.keyframe_interval = max(int(1.0 / interval), 1)
 
-                socketio.emit(
-                    "servo_positions",
-                    {"positions": relative_positions, "offset": stroke_offset},
-                )
-
-            time.sleep(0.1)  # 10Hz update rate
+            positions = get_prev_vals()
+            if position_subscribers and positions is not None:
+                packet = position_encoder.encode(positions, stroke_offset)
+                if packet is not None:
+                    socketio.emit("servo_positions_bin", packet)
+
+            t_schedule += interval
+            sleep_time = t_schedule - time.time()
+            if sleep_time > 0:
+                stop_event.wait(sleep_time)
+            else:
+                t_schedule = time.time()
         except Exception as e:
             logger.error(f"Position broadcast error: {e}")
             time.sleep(0.5)
+            t_schedule = time.time()
 
 
 def start_position_broadcast():
@@ -179,6 +245,8 @@ def stop_position_broadcast():
 # --- HTML Endpoints ---
 def start():
     global osc_thread, stop_event
+    stop_replay()
+    clear_halt()
     if osc_thread is None or not osc_thread.is_alive():
         stop_event.clear()
         osc_thread = Thread(target=osc_sender, args=(stop_event,), daemon=True)
@@ -232,18 +300,111 @@ def stop_endpoint():
 
 
 def halt():
-    clients = get_clients()
-    for client in clients:
-        client.send_message("/hardHiZ", [255])
+    # /hardHiZ first, joining the sender/replay threads can wait afterwards
+    params_full = get_params_full()
+    stats = halt_all(
+        int(params_full.get("HALT_REPEAT", 3)),
+        float(params_full.get("HALT_REPEAT_INTERVAL", 0.005)),
+    )
+    logger.info(
+        f">>Emergency Stop<<< last /hardHiZ {stats['last_send_ms']:.2f} ms after the request"
+    )
+    stop_replay()
     stop()
-    logger.info(">>Emergency Stop<<<")
-    return
+    return stats
+
+
+def start_replay(path, speed=1.0, loop=False):
+    global replay_thread
+    if speed <= 0:
+        raise ValueError(f"speed must be > 0, got {speed}")
+    header, frames = open_recording(path)  # raises if the file is not a recording
+    params_full = get_params_full()
+    if header["num_servos"] != params_full.get("NUM_SERVOS", 31):
+        raise ValueError(
+            f"recorded for {header['num_servos']} servos, NUM_SERVOS is {params_full.get('NUM_SERVOS', 31)}"
+        )
+    if speed > 1 and params_full.get("SEND_CLIENTS", True):
+        # the recording was within LIMIT_SPEED at x1 only
+        peak_speed = peak_step(frames) * header["rate_fps"] * speed
+        if peak_speed > params_full.get("LIMIT_SPEED"):
+            raise ValueError(
+                f"x{speed:g} would move up to {peak_speed:.0f} steps/s (LIMIT_SPEED {params_full.get('LIMIT_SPEED')})"
+            )
+    stop()
+    stop_replay()
+    clear_halt()
+    replay_stop.clear()
+    replay_thread = Thread(
+        target=replay_recording,
+        args=(path, replay_stop, send_replay_frame, speed, loop),
+        kwargs={
+            "start_vals": get_prev_vals(),
+            "easing": float(get_params_mode().get("EASING_DURATION", 1.0)),
+            "max_speed": params_full.get("LIMIT_SPEED"),
+        },
+        daemon=True,
+    )
+    replay_thread.start()
+    start_position_broadcast()
+
+
+def stop_replay():
+    global replay_thread
+    replay_stop.set()
+    if replay_thread is not None:
+        replay_thread.join(timeout=2)
+        replay_thread = None
+
+
+@app.route("/record/start", methods=["POST"])
+def record_start_endpoint():
+    params_full = get_params_full()
+    try:
+        path = start_recording(
+            params_full["NUM_SERVOS"],
+            params_full["RATE_fps"],
+            get_params_hash(params_full),
+            request.form.get("name") or request.form.get("path") or None,
+        )
+    except ValueError as e:
+        return jsonify(result="NG", error=str(e)), 400
+    except Exception as e:
+        return jsonify(result="NG", error=str(e)), 500
+    return jsonify(result="OK", path=path)
+
+
+@app.route("/record/stop", methods=["POST"])
+def record_stop_endpoint():
+    info = stop_recording()
+    if info is None:
+        return jsonify(result="NG", error="Not recording"), 400
+    return jsonify(result="OK", **info)
+
+
+@app.route("/replay/start", methods=["POST"])
+def replay_start_endpoint():
+    path = request.form.get("path")
+    if not path:
+        return jsonify(result="NG", error="No path"), 400
+    try:
+        speed = float(request.form.get("speed", 1.0))
+        loop = request.form.get("loop", "false").lower() == "true"
+        start_replay(path, speed, loop)
+    except Exception as e:
+        return jsonify(result="NG", error=str(e)), 400
+    return jsonify(result="OK", path=path, speed=speed)
+
+
+@app.route("/replay/stop", methods=["POST"])
+def replay_stop_endpoint():
+    stop_replay()
+    return jsonify(result="OK")
 
 
 @app.route("/halt", methods=["POST", "GET"])
 def halt_endpoint():
-    halt()
-    return jsonify(result="OK")
+    return jsonify(result="OK", **halt())
 
 
 def setNeutral():
@@ -425,30 +586,48 @@ def home_all_endpoint():
     return jsonify(result)
 
 
+def _apply_param_batch_response(updates):
+    try:
+        version = apply_param_batch(updates)
+    except ParamValidationError as e:
+        return jsonify(result="NG", error=str(e), errors=e.errors), 400
+    if any(key in updates for key in ("Kp", "Ki", "Kd")):
+        set_PID()
+    return jsonify(result="OK", version=version)
+
+
 @app.route("/set_param", methods=["POST"])
 def set_param():
-    updated_pid = False
     params_full = get_params_full()
-    mode_id = str(params_full.get("MODE", "1"))
-    for key in request.form:
-        val = request.form[key]
-        if key in ("SEND_CLIENTS", "SEND_CLIENT_GH"):
-            set_param_full(key, val.lower() == "true")
-        elif key in params_full["MODES"][mode_id]:
-            try:
-                set_param_mode(key, type(params_full["MODES"][mode_id][key])(val))
-            except Exception as e:
-                return jsonify(result="NG", error=str(e)), 400
-        elif key in params_full:
-            try:
-                set_param_full(key, type(params_full[key])(val))
-                if key in ("Kp", "Ki", "Kd"):
-                    updated_pid = True
-            except Exception as e:
-                return jsonify(result="NG", error=str(e)), 400
-    if updated_pid:
-        set_PID()
-    return jsonify(result="OK")
+    params_mode = get_params_mode()
+    # form posts from the webUI may carry sliders the current mode does not have
+    updates = {
+        key: request.form[key]
+        for key in request.form
+        if key in params_full or key in params_mode
+    }
+    return _apply_param_batch_response(updates)
+
+
+@app.route("/params", methods=["PATCH"])
+def patch_params():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(result="NG", error="JSON object expected"), 400
+    updates = body.get("updates", body)
+    if not isinstance(updates, dict) or not updates:
+        return jsonify(result="NG", error="No updates"), 400
+    return _apply_param_batch_response(updates)
+
+
+@app.route("/params", methods=["GET"])
+def get_params_endpoint():
+    return jsonify(
+        result="OK",
+        version=get_params_version(),
+        params=get_params_full(),
+        mode_params=get_params_mode(),
+    )
 
 
 @app.route("/set_mode", methods=["POST"])
@@ -472,60 +651,139 @@ def set_PID():
     logger.debug(f"Set servo PID: Kp={kp}, Ki={ki}, Kd={kd}")
 
 
-def init(enable=True):
-    clients = get_clients()
-    booted_ports = set()
+boot_events = {}  # OSC receive port: Event, set when that board sent /booted
+boot_callback_registered = False
 
-    def on_booted(port, *args):
-        booted_ports.add(port)
 
-    if enable:
-        register_booted_callback(on_booted)
+def on_board_booted(port, *args):
+    event = boot_events.get(port)
+    if event is not None:
+        event.set()
 
-        expected_ports = 1
 
-        params_full = get_params_full()
+def configure_board(client, params_full):
+    client.send_message("/setDestIp", [])
+    client.send_message(
+        # "/setKval", [255, 60, 119, 119, 119] #SM42BYG011
+        # "/setKval", [255, 60, 85, 85, 85] #42HSC1409
+        "/setKval",
+        # [255, 25, 75, 75, 75],  # SS2421 12V
+        # [255, 10, 25, 25, 25],  # SS2421 24V-Low
+        [255, 8, 18, 18, 18],  # SS2421 24V-Low-75%
+    )  # (int)motorID (int)holdKVAL (int)runKVAL (int)accKVAL (int)setDecKVAL
+    client.send_message("/setGoUntilTimeout", [255, 20000])
+    # client.send_message("/setHomingDirection", [255, 0])
+    client.send_message("/setHomingSpeed", [255, 100])
+    client.send_message(
+        "/setPosition", [255, int(params_full.get("STROKE_OFFSET", 50000))]
+    )
 
-        for client in clients:
-            client.send_message("/resetDevice", [])
-            time.sleep(0.1)
-        if not wait_for_booted(booted_ports, expected_ports):
-            logger.error(
-                f"/booted not received from all devices. Only from: {sorted(booted_ports)}"
+
+def init_board(board_idx, client, params_full, timeout):
+    """Reset one board, wait for its /booted and configure it right away"""
+    hosts = params_full["HOSTS"]
+    recv_ports = params_full.get("OSC_RECV_PORTS", [])
+    report = {
+        "board": board_idx,
+        "host": hosts[board_idx],
+        "port": recv_ports[board_idx] if board_idx < len(recv_ports) else None,
+        "booted": False,
+    }
+    event = boot_events.get(report["port"])
+    if event is None:
+        report["error"] = "no OSC receive port for this board"
+        return report
+
+    t0 = time.time()
+    event.clear()
+    try:
+        client.send_message("/resetDevice", [])
+        if not event.wait(timeout):
+            report["error"] = f"/booted not received within {timeout:.1f}s"
+            return report
+        report["booted"] = True
+        report["boot_s"] = round(time.time() - t0, 3)
+        configure_board(client, params_full)
+        client.send_message("/enableServoMode", [255, 1])
+    except Exception as e:
+        report["error"] = str(e)
+        report["booted"] = False
+    report["total_s"] = round(time.time() - t0, 3)
+    return report
+
+
+def ensure_boot_tracking(params_full):
+    global boot_callback_registered
+    if not boot_callback_registered:
+        register_booted_callback(on_board_booted)
+        boot_callback_registered = True
+    for port in params_full.get("OSC_RECV_PORTS", []):
+        boot_events.setdefault(port, Event())
+
+
+def init_boards(params_full):
+    """Init all boards in parallel; boards that fail are excluded from sending"""
+    ensure_boot_tracking(params_full)
+    clients = get_clients()
+    timeout = float(params_full.get("BOOT_TIMEOUT", 10.0))
+
+    reports = [None] * len(clients)
+
+    def _run(idx, client):
+        reports[idx] = init_board(idx, client, params_full, timeout)
+
+    threads = [
+        Thread(target=_run, args=(idx, client), daemon=True)
+        for idx, client in enumerate(clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for report in reports:
+        ok = report["booted"] and "error" not in report
+        set_board_excluded(report["board"], not ok)
+        if ok:
+            logger.info(
+                f"Board {report['board']} ({report['host']}) up in {report['boot_s']}s"
             )
-        for client in clients:
-            client.send_message("/setDestIp", [])
-            client.send_message(
-                # "/setKval", [255, 60, 119, 119, 119] #SM42BYG011
-                # "/setKval", [255, 60, 85, 85, 85] #42HSC1409
-                "/setKval",
-                # [255, 25, 75, 75, 75],  # SS2421 12V
-                # [255, 10, 25, 25, 25],  # SS2421 24V-Low
-                [255, 8, 18, 18, 18],  # SS2421 24V-Low-75%
-            )  # (int)motorID (int)holdKVAL (int)runKVAL (int)accKVAL (int)setDecKVAL
-            client.send_message("/setGoUntilTimeout", [255, 20000])
-            # client.send_message("/setHomingDirection", [255, 0])
-            client.send_message("/setHomingSpeed", [255, 100])
-            client.send_message(
-                "/setPosition", [255, int(params_full.get("STROKE_OFFSET", 50000))]
+        else:
+            logger.error(
+                f"Board {report['board']} ({report['host']}) excluded: {report.get('error')}"
             )
+    return reports
 
+
+def init(enable=True):
+    reports = None
+    if enable:
+        params_full = get_params_full()
+        clear_halt()
+        # resetting boards stops their replies; keep the health monitor out of it
+        init_in_progress.set()
+        try:
+            reports = init_boards(params_full)
+        finally:
+            if health_monitor is not None:
+                health_monitor.reset()
+            init_in_progress.clear()
         set_prev_vals(
             [int(params_full.get("STROKE_OFFSET", 50000))] * params_full["NUM_SERVOS"]
         )
     else:
         stop()
-
-    for client in clients:
-        client.send_message("/enableServoMode", [255, enable])
-        if not enable:
+        for client in get_clients():
+            client.send_message("/enableServoMode", [255, enable])
             client.send_message("/softHiZ", 255)
 
     set_PID()
 
     if enable:
-        osc_speaker.send_message("/Initialized", 1)
-        logger.info("Initialized and enabled servos.")
+        ok = [r for r in reports if r["booted"] and "error" not in r]
+        osc_speaker.send_message("/Initialized", 1 if ok else -1)
+        logger.info(f"Initialized and enabled servos on {len(ok)}/{len(reports)} boards.")
+    return reports
 
 
 @app.route("/init", methods=["POST"])
@@ -537,12 +795,357 @@ def init_endpoint():
         return jsonify(result="OK", info="SEND_CLIENTS is False, skipping boards init.")
     try:
         start_osc_receiver_thread()
-        init()
-        return jsonify(result="OK")
+        reports = init()
+        ok = [r for r in reports if r["booted"] and "error" not in r]
+        if not ok:
+            return jsonify(result="NG", error="No board booted", boards=reports), 504
+        info = None
+        if len(ok) < len(reports):
+            info = f"{len(reports) - len(ok)} board(s) excluded"
+        return jsonify(result="OK", boards=reports, info=info)
     except Exception as e:
         return jsonify(result="NG", error=str(e)), 500
 
 
+# --- Hot-reload of osc_modes ---
+def reload_modes():
+    """Load osc_modes.py again, validate all modes and swap it into the sender"""
+    if not modes_reload_lock.acquire(blocking=False):
+        return {"ok": False, "error": "Reload already in progress"}
+    try:
+        params_full = get_params_full()
+        try:
+            module = load_modes_module()
+        except Exception as e:
+            report = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        else:
+            report = validate_modes(
+                module,
+                params_full,
+                seconds=float(params_full.get("MODE_RELOAD_TEST_SECONDS", 60.0)),
+                frames=int(params_full.get("MODE_RELOAD_TEST_FRAMES", 120)),
+                baseline=get_modes_module(),
+            )
+        if report["ok"]:
+            swap_modes(module)
+            if osc_thread is None or not osc_thread.is_alive():
+                apply_pending_modes()
+                report["swapped"] = "now"
+            else:
+                report["swapped"] = "next frame"
+            logger.info(f"osc_modes reloaded, {len(report['modes'])} modes validated.")
+        else:
+            failed = [
+                m
+                for m, r in report.get("modes", {}).items()
+                if not r["ok"] and not r.get("preexisting")
+            ]
+            report.setdefault("error", f"Modes failed validation: {failed}")
+            logger.error(f"osc_modes reload rejected, keeping the running version: {report['error']}")
+    finally:
+        modes_reload_lock.release()
+    osc_speaker.send_message("/ModesReloaded", 1 if report["ok"] else -1)
+    return report
+
+
+@app.route("/modes/reload", methods=["POST"])
+def modes_reload_endpoint():
+    report = reload_modes()
+    if not report["ok"]:
+        return jsonify(result="NG", **report), 422
+    return jsonify(result="OK", **report)
+
+
+# --- Playlist ---
+def on_playlist_switch(index, entry, version):
+    socket_update_params(dict(entry["params"], MODE=entry["mode"]))
+    osc_speaker.send_message("/PlaylistEntry", index, entry["mode"])
+
+
+sequencer = Sequencer(on_switch=on_playlist_switch)
+
+
+def play_playlist():
+    """Play the loaded playlist; starts the sender since the show runs on its frames"""
+    sequencer.play()
+    if replay_thread is None or not replay_thread.is_alive():
+        start()
+
+
+def load_playlist_file(path):
+    sequencer.load(load_playlist(path), path)
+
+
+@app.route("/playlist", methods=["GET"])
+def playlist_endpoint():
+    return jsonify(result="OK", **sequencer.status())
+
+
+@app.route("/playlist/load", methods=["POST"])
+def playlist_load_endpoint():
+    body = request.get_json(silent=True)
+    try:
+        if body is not None:
+            sequencer.load(parse_playlist(body))
+        else:
+            path = request.form.get("path")
+            if not path:
+                return jsonify(result="NG", error="No path"), 400
+            load_playlist_file(path)
+    except (OSError, ValueError) as e:
+        return jsonify(result="NG", error=str(e)), 400
+    return jsonify(result="OK", **sequencer.status())
+
+
+@app.route("/playlist/play", methods=["POST"])
+def playlist_play_endpoint():
+    try:
+        play_playlist()
+    except PlaylistError as e:
+        return jsonify(result="NG", error=str(e)), 400
+    return jsonify(result="OK", **sequencer.status())
+
+
+@app.route("/playlist/pause", methods=["POST"])
+def playlist_pause_endpoint():
+    sequencer.pause()
+    return jsonify(result="OK", **sequencer.status())
+
+
+@app.route("/playlist/stop", methods=["POST"])
+def playlist_stop_endpoint():
+    sequencer.stop()
+    return jsonify(result="OK", **sequencer.status())
+
+
+@app.route("/playlist/seek", methods=["POST"])
+def playlist_seek_endpoint():
+    try:
+        if request.form.get("entry") is not None:
+            sequencer.seek(entry=request.form["entry"])
+        elif request.form.get("position") is not None:
+            sequencer.seek(position=request.form["position"])
+        else:
+            return jsonify(result="NG", error="position or entry expected"), 400
+    except ValueError as e:
+        return jsonify(result="NG", error=str(e)), 400
+    return jsonify(result="OK", **sequencer.status())
+
+
+# --- Impacts ---
+def trigger_impact(degree=None, height=None, gain=1.0):
+    """Spawn an impact now, on the clock of the running mode"""
+    u = get_mode_clock()["u"]
+    return get_modes_module().spawn_impact(u, degree, height, gain)
+
+
+@app.route("/impact", methods=["POST"])
+def impact_endpoint():
+    try:
+        active = trigger_impact(
+            request.form.get("degree", type=float),
+            request.form.get("height", type=float),
+            request.form.get("gain", 1.0, type=float),
+        )
+    except ValueError as e:
+        return jsonify(result="NG", error=str(e)), 400
+    return jsonify(result="OK", active=active)
+
+
+@app.route("/impact_stats", methods=["GET"])
+def impact_stats_endpoint():
+    return jsonify(result="OK", **impacts.get_stats())
+
+
+# --- Board Health ---
+def board_idx_from_port(port):
+    try:
+        return get_params_full().get("OSC_RECV_PORTS", []).index(port)
+    except ValueError:
+        return -1
+
+
+def recover_board(board_idx):
+    """Re-run the init sequence of a board that came back after being dead"""
+    params_full = get_params_full()
+    clients = get_clients()
+    if board_idx >= len(clients):
+        return
+    ensure_boot_tracking(params_full)
+    init_in_progress.set()
+    try:
+        report = init_board(
+            board_idx,
+            clients[board_idx],
+            params_full,
+            float(params_full.get("BOOT_TIMEOUT", 10.0)),
+        )
+    finally:
+        init_in_progress.clear()
+    ok = report["booted"] and "error" not in report
+    if ok:
+        kp = float(params_full.get("Kp", 0.06))
+        ki = float(params_full.get("Ki", 0.0))
+        kd = float(params_full.get("Kd", 0.0))
+        clients[board_idx].send_message("/setServoParam", [255, kp, ki, kd])
+        set_board_excluded(board_idx, False)
+        logger.info(f"Board {board_idx} recovered and re-initialized.")
+    else:
+        logger.error(f"Board {board_idx} came back but re-init failed: {report.get('error')}")
+    osc_speaker.send_message("/BoardRecovered", board_idx, 1 if ok else -1)
+
+
+def on_board_health_change(board_idx, old, new, info):
+    if new == HEALTHY:
+        logger.info(f"Board {board_idx} health: {old} -> {new}")
+    else:
+        logger.warning(f"Board {board_idx} health: {old} -> {new} ({info})")
+    socketio.emit("board_health", {"boards": health_monitor.snapshot()})
+    osc_speaker.send_message("/BoardHealth", board_idx, new)
+
+    if not get_params_full().get("HEALTH_AUTO_EXCLUDE", False):
+        return
+    if new == DEAD:
+        set_board_excluded(board_idx, True)
+        logger.warning(f"Board {board_idx} excluded from sending (dead).")
+    elif old == DEAD and new in (HEALTHY, DEGRADED):
+        Thread(target=recover_board, args=(board_idx,), daemon=True).start()
+
+
+def health_monitoring_enabled():
+    params_full = get_params_full()
+    return (
+        params_full.get("SEND_CLIENTS", True)
+        and params_full.get("HEALTH_MONITOR", True)
+        and not init_in_progress.is_set()
+    )
+
+
+def start_health_monitor():
+    global health_monitor, health_thread
+    if health_thread is not None and health_thread.is_alive():
+        return
+    params_full = get_params_full()
+    # pre-opened sockets, probing must stay cheap
+    clients = get_clients()
+
+    def send_probe(board_idx):
+        clients[board_idx].send_message("/getPosition", [1])
+
+    health_monitor = HealthMonitor(
+        len(clients),
+        send_probe,
+        on_board_health_change,
+        interval=float(params_full.get("HEALTH_INTERVAL", 1.0)),
+        timeout=float(params_full.get("HEALTH_TIMEOUT", 0.5)),
+    )
+    health_stop.clear()
+    health_thread = Thread(
+        target=health_monitor.run,
+        args=(health_stop, health_monitoring_enabled),
+        daemon=True,
+    )
+    health_thread.start()
+    logger.info("Board health monitor started.")
+
+
+@app.route("/health", methods=["GET"])
+def health_endpoint():
+    if health_monitor is None:
+        return jsonify(result="NG", error="Health monitor not running"), 503
+    excluded = get_excluded_boards()
+    boards = health_monitor.snapshot()
+    for board in boards:
+        board["excluded"] = board["board"] in excluded
+    return jsonify(result="OK", boards=boards)
+
+
+# --- Tracking (commanded vs. reported) ---
+def on_tracking_alert(motor_id, active, info):
+    if active:
+        logger.warning(f"Motor {motor_id} lags behind its command: {info}")
+    else:
+        logger.info(f"Motor {motor_id} tracks its command again.")
+    socketio.emit("tracking_alert", info)
+    latency_ms = info.get("latency_ms")
+    osc_speaker.send_message(
+        "/TrackingAlert",
+        motor_id,
+        1 if active else 0,
+        -1.0 if latency_ms is None else latency_ms,
+    )
+
+
+def tracking_enabled():
+    params_full = get_params_full()
+    sending = (osc_thread is not None and osc_thread.is_alive()) or (
+        replay_thread is not None and replay_thread.is_alive()
+    )
+    return (
+        sending
+        and params_full.get("SEND_CLIENTS", True)
+        and params_full.get("TRACKING", True)
+        and not init_in_progress.is_set()
+    )
+
+
+def start_tracking_monitor():
+    global tracking_monitor, tracking_thread
+    if tracking_thread is not None and tracking_thread.is_alive():
+        return
+    params_full = get_params_full()
+    clients = get_clients()
+
+    def send_poll():
+        excluded = get_excluded_boards()
+        for i, client in enumerate(clients):
+            if i not in excluded:
+                client.send_message("/getPosition", [255])
+
+    rms_alert = params_full.get("TRACKING_RMS_ALERT")
+    tracking_monitor = TrackingMonitor(
+        send_poll,
+        on_tracking_alert,
+        poll_interval=1.0 / float(params_full.get("TRACKING_POLL_HZ", 20)),
+        interval=float(params_full.get("TRACKING_INTERVAL", 1.0)),
+        window=float(params_full.get("TRACKING_WINDOW", 5.0)),
+        max_lag=float(params_full.get("TRACKING_MAX_LAG", 0.5)),
+        lag_alert_ms=float(params_full.get("TRACKING_LAG_ALERT_MS", 200.0)),
+        rms_alert=None if rms_alert is None else float(rms_alert),
+    )
+    tracking_stop.clear()
+    tracking_thread = Thread(
+        target=tracking_monitor.run,
+        args=(tracking_stop, tracking_enabled),
+        daemon=True,
+    )
+    tracking_thread.start()
+    logger.info("Tracking monitor started.")
+
+
+@app.route("/tracking", methods=["GET"])
+def tracking_endpoint():
+    """Per motor command-to-motion latency and tracking error"""
+    if tracking_monitor is None:
+        return jsonify(result="NG", error="Tracking monitor not running"), 503
+    if request.args.get("refresh"):
+        tracking_monitor.update()
+    return jsonify(result="OK", **tracking_monitor.snapshot())
+
+
+@app.route("/boards", methods=["GET"])
+def boards_endpoint():
+    hosts = get_params_full()["HOSTS"]
+    excluded = get_excluded_boards()
+    return jsonify(
+        result="OK",
+        boards=[
+            {"board": i, "host": host, "excluded": i in excluded}
+            for i, host in enumerate(hosts)
+        ],
+    )
+
+
 @app.route("/release", methods=["POST"])
 def release_endpoint():
     try:
@@ -631,26 +1234,211 @@ def get_target_position():
     return jsonify(result="OK", motorID=motor_id, position=position)
 
 
+@app.route("/param_queue_stats", methods=["GET"])
+def param_queue_stats_endpoint():
+    return jsonify(result="OK", **get_param_queue_stats())
+
+
+@app.route("/listener_stats", methods=["GET"])
+def listener_stats_endpoint():
+    return jsonify(result="OK", **get_listener_stats())
+
+
+@app.route("/listener_stats/reset", methods=["POST"])
+def listener_stats_reset_endpoint():
+    reset_listener_stats()
+    return jsonify(result="OK")
+
+
+@app.route("/capture/start", methods=["POST"])
+def capture_start_endpoint():
+    try:
+        path = start_capture(request.form.get("name") or request.form.get("path") or None)
+    except ValueError as e:
+        return jsonify(result="NG", error=str(e)), 400
+    except Exception as e:
+        return jsonify(result="NG", error=str(e)), 500
+    return jsonify(result="OK", path=path)
+
+
+@app.route("/capture/stop", methods=["POST"])
+def capture_stop_endpoint():
+    info = stop_capture()
+    if info is None:
+        return jsonify(result="NG", error="Not capturing"), 400
+    return jsonify(result="OK", **info)
+
+
+@app.route("/keyframe_stats", methods=["GET"])
+def keyframe_stats_endpoint():
+    return jsonify(result="OK", **get_keyframe_stats())
+
+
+@app.route("/wavetable_stats", methods=["GET"])
+def wavetable_stats_endpoint():
+    return jsonify(result="OK", **wavetables.get_stats())
+
+
+@app.route("/frame_stream_stats", methods=["GET"])
+def frame_stream_stats_endpoint():
+    return jsonify(result="OK", **frame_stream.get_stats(time.time()))
+
+
+@app.route("/frame_stream/clear", methods=["POST"])
+def frame_stream_clear_endpoint():
+    frame_stream.clear()
+    return jsonify(result="OK")
+
+
+@app.route("/stateful_stats", methods=["GET"])
+def stateful_stats_endpoint():
+    return jsonify(result="OK", **stateful_modes.get_stats())
+
+
+@app.route("/mode_clock", methods=["GET"])
+def mode_clock_endpoint():
+    return jsonify(result="OK", **get_mode_clock())
+
+
+@app.route("/persistence_stats", methods=["GET"])
+def persistence_stats_endpoint():
+    return jsonify(result="OK", **get_persistence_stats())
+
+
+def _nan_to_none(arr):
+    return [[None if v != v else v for v in row] for row in arr.tolist()]
+
+
+@app.route("/telemetry", methods=["GET"])
+def telemetry_endpoint():
+    """Commanded/reported history, downsampled to `points` buckets per motor"""
+    try:
+        kind = request.args.get("kind", "commanded")
+        now = time.time()
+        t1 = float(request.args.get("end", now))
+        t0 = float(request.args.get("start", t1 - float(request.args.get("seconds", 60))))
+        points = min(int(request.args.get("points", 200)), 5000)
+        result = query_telemetry(kind, t0, t1, points)
+    except Exception as e:
+        return jsonify(result="NG", error=str(e)), 400
+    if result is None:
+        return jsonify(result="NG", error="Telemetry not initialized"), 503
+    times, mins, maxs, means = result
+    return jsonify(
+        result="OK",
+        kind=kind,
+        start=t0,
+        end=t1,
+        t=times.tolist(),
+        min=_nan_to_none(mins),
+        max=_nan_to_none(maxs),
+        mean=_nan_to_none(means),
+        **get_telemetry_stats(),
+    )
+
+
+def on_position_report(port, motor_id, position):
+    if health_monitor is not None:
+        health_monitor.on_reply(board_idx_from_port(port))
+    # homing status is reported through the same callback as a tuple
+    if isinstance(position, int):
+        record_reported(motor_id, position)
+
+
 # --- OSC Endpoints ---
 def socket_update_param(key, value):
     if key not in LOCKED_KEYS:
         socketio.emit("param_update", {"key": key, "value": value})
 
 
+def socket_update_params(updates):
+    updates = {k: v for k, v in updates.items() if k not in LOCKED_KEYS}
+    if updates:
+        socketio.emit("param_update_batch", {"updates": updates})
+
+
+def apply_param_updates(updates):
+    # Called by osc_param_queue once per tick with the coalesced updates.
+    updates = {k: v for k, v in updates.items() if k not in LOCKED_KEYS}
+    if not updates:
+        return
+    # single messages of the same tick may have become invalid, e.g. by a
+    # MODE switch; apply what is still valid instead of dropping the tick.
+    # Dropping a bad MODE resolves the mode keys against another mode, so
+    # this can take more than one round.
+    while True:
+        try:
+            version = apply_param_batch(updates)
+            break
+        except ParamValidationError as e:
+            logger.warning(f"Dropped queued param(s): {e}")
+            remaining = {k: v for k, v in updates.items() if k not in e.errors}
+            if len(remaining) == len(updates):
+                remaining = {}
+            reject_params(len(updates) - len(remaining))
+            updates = remaining
+            if not updates:
+                return
+    if "MODE" in updates:
+        set_repeat_mode()
+    logger.debug(f"Applied {len(updates)} queued param(s) as v{version}: {list(updates)}")
+    socket_update_params(updates)
+
+
+def apply_param_bundle(batch):
+    # Called by osc_param_queue for every queued bundle, after the singles.
+    batch = {k: v for k, v in batch.items() if k not in LOCKED_KEYS}
+    if not batch:
+        return
+    try:
+        version = apply_param_batch(batch)
+    except ParamValidationError as e:
+        # valid when it arrived, but not on top of this tick's updates
+        logger.warning(f"Dropped bundle: {e}")
+        reject_params(len(batch))
+        return
+    if "MODE" in batch:
+        set_repeat_mode()
+    logger.debug(f"Applied bundle of {len(batch)} param(s) as v{version}: {list(batch)}")
+    socket_update_params(batch)
+
+
 # --- SocketIO Events ---
 @socketio.on("connect")
 def handle_connect():
     """Handle client connection - notify if server just started"""
+    position_subscribers.add(request.sid)
+    # the new client needs a keyframe before it can apply deltas
+    position_encoder.reset()
     logger.debug("Client connected to WebSocket")
 
 
+@socketio.on("halt")
+def handle_halt():
+    """Halt over the already open socket; the stats go back as the ack"""
+    return dict(result="OK", **halt())
+
+
 @socketio.on("disconnect")
 def handle_disconnect():
     """Handle client disconnection"""
+    position_subscribers.discard(request.sid)
     logger.debug("Client disconnected from WebSocket")
 
 
+def push_stream_frame(args):
+    # /frame seq timestamp v0 ... v(N-1)
+    try:
+        seq, timestamp, vals = int(args[0]), float(args[1]), [float(v) for v in args[2:]]
+    except (IndexError, TypeError, ValueError):
+        return frame_stream.reject()
+    frame_stream.push(seq, timestamp, vals, time.time(), int(get_params_full().get("NUM_SERVOS", 31)))
+
+
 def listener_message_callback(address, *args):
+    if address == "/frame":
+        # at stream rate; keep it ahead of the param handling
+        return push_stream_frame(args)
     params_full = get_params_full()
     params_mode = get_params_mode()
 
@@ -671,6 +1459,19 @@ def listener_message_callback(address, *args):
             return init(enable=False)
         elif candidate == "Halt":
             return halt()
+        elif candidate == "RecordStart":
+            params_full = get_params_full()
+            return start_recording(
+                params_full["NUM_SERVOS"],
+                params_full["RATE_fps"],
+                get_params_hash(params_full),
+            )
+        elif candidate == "RecordStop":
+            return stop_recording()
+        elif candidate == "CaptureStart":
+            return start_capture()
+        elif candidate == "CaptureStop":
+            return stop_capture()
         elif candidate == "GetAverageSpeed":
             current_speed = get_current_speed()
             abs_avg_speed = sum(abs(s) for s in current_speed) / len(current_speed)
@@ -679,56 +1480,114 @@ def listener_message_callback(address, *args):
             return osc_speaker.send_message("/Speed", get_current_speed())
         elif candidate == "GetPosition":
             return osc_speaker.send_message("/Position", get_prev_vals())
+        elif candidate == "GetParamQueueStats":
+            stats = get_param_queue_stats()
+            return osc_speaker.send_message(
+                "/ParamQueueStats",
+                stats["received"],
+                stats["coalesced"],
+                stats["applied"],
+                stats["batches"],
+            )
+        elif candidate == "ReloadModes":
+            # validation evaluates every mode; keep it off the listener thread
+            return Thread(target=reload_modes, daemon=True).start()
+        elif candidate == "GetTracking":
+            if tracking_monitor is None:
+                return
+            motors = tracking_monitor.snapshot()["motors"]
+            return osc_speaker.send_message(
+                "/TrackingLatency",
+                [-1.0 if m["latency_ms"] is None else m["latency_ms"] for m in motors],
+            )
+        elif candidate == "PlaylistPlay":
+            return play_playlist()
+        elif candidate == "PlaylistPause":
+            return sequencer.pause()
+        elif candidate == "PlaylistStop":
+            return sequencer.stop()
+        elif candidate == "GetPlaylist":
+            status = sequencer.status()
+            return osc_speaker.send_message(
+                "/PlaylistStatus",
+                -1 if status["index"] is None else status["index"],
+                -1.0 if status["position"] is None else status["position"],
+                1 if status["playing"] else 0,
+            )
+        elif candidate == "Impact":
+            try:
+                return trigger_impact()
+            except ValueError as e:
+                logger.warning(f"/Impact failed: {e}")
+                return
         elif candidate == "RaiseError":
             return 1 / 0
         logger.warning(f"not matching no-arg command for candidate '/{candidate}'")
         return
 
-    if candidate in params_mode:
+    if candidate in ("PlaylistLoad", "PlaylistSeek", "PlaylistEntry"):
+        try:
+            if candidate == "PlaylistLoad":
+                load_playlist_file(str(args[0]))
+            elif candidate == "PlaylistSeek":
+                sequencer.seek(position=float(args[0]))
+            else:
+                sequencer.seek(entry=int(args[0]))
+        except (OSError, ValueError) as e:
+            logger.warning(f"/{candidate} failed: {e}")
+    elif candidate == "Impact":
+        # /Impact degree height [gain]
+        try:
+            trigger_impact(*(float(a) for a in args[:3]))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"/Impact failed: {e}")
+    elif candidate in params_mode:
         key = candidate
         val = args[0]
         try:
-            set_param_mode(key, type(params_mode[key])(val))
+            enqueue_param(key, type(params_mode[key])(val))
         except Exception as e:
+            reject_params(1)
             logger.warning(f"Failed to update param_mode '{key}': {e}")
-        logger.debug(f"Param '{key}' updated to: {val}")
-        socket_update_param(key, val)
     elif candidate in params_full:
-        for key in ["MODE", "PORT", "NUM_SERVOS", "RATE_fps", "ALPHA"]:
+        for key in ["MODE", "PORT", "NUM_SERVOS", "RATE_fps", "ALPHA", "INPUT_SOURCE"]:
             if candidate == key:
                 val = args[0]
-                if key == "MODE":
-                    set_repeat_mode()
                 try:
-                    set_param_full(key, type(params_full[key])(val))
+                    enqueue_param(key, type(params_full[key])(val))
                 except Exception as e:
+                    reject_params(1)
                     logger.warning(f"Failed to update param_full '{key}': {e}")
-                logger.debug(f"Param '{key}' updated to: {val}")
-                socket_update_param(key, val)
     else:
+        reject_params(1)
         logger.warning(f"No matching param key for candidate '{candidate}'")
 
 
 def handle_bundle(bundle_contents):
+    updates = {}
     for addr, args in bundle_contents:
-        if addr.startswith("/"):
+        if addr == "/frame":
+            push_stream_frame(args)
+        elif addr.startswith("/"):
             key = addr.lstrip("/")
             if len(args) > 0:
-                value = args[0]
-                try:
-                    if key in get_params_full():
-                        if key == "MODE":
-                            set_repeat_mode()
-                        set_param_full(key, value)
-                    elif key in get_params_mode():
-                        set_param_mode(key, value)
-                    logger.debug(f"Updated param '{key}' to: {value}")
-                    socket_update_param(key, value)
-                except Exception as e:
-                    logger.warning(f"Failed to update param '{key}': {e}")
+                updates[key] = args[0]
+    if not updates:
+        return
+    # A bundle is validated as a whole and applied on one tick as one
+    # batch of its own, all or nothing.
+    try:
+        updates = validate_param_batch(updates)
+    except ParamValidationError as e:
+        logger.warning(f"Rejected bundle: {e}")
+        reject_params(len(updates))
+        return
+    enqueue_batch(updates)
 
 
 def main():
+    # no-op when started through bootstrap.py, which already did it
+    prepare_runtime()
 
     try:
         print("Starting Ritsudo Server...")
@@ -736,9 +1595,31 @@ def main():
 
         register_message_callback(listener_message_callback)
         register_bundle_callback(handle_bundle)
+        register_apply_callback(apply_param_updates)
+        register_batch_callback(apply_param_bundle)
+
+        params_full = get_params_full()
+        init_telemetry(
+            int(params_full["NUM_SERVOS"]),
+            params_full.get("TELEMETRY_COMMANDED_CAPACITY"),
+            params_full.get("TELEMETRY_REPORTED_CAPACITY"),
+        )
+        register_position_callback(on_position_report)
+        register_frame_callback(sequencer.on_frame)
+        if params_full.get("PLAYLIST"):
+            # armed for unattended runs: the show starts with the sender
+            try:
+                load_playlist_file(params_full["PLAYLIST"])
+                sequencer.play()
+            except (OSError, ValueError) as e:
+                logger.error(f"PLAYLIST {params_full['PLAYLIST']} not loaded: {e}")
+
+        start_param_ticker_thread()
         start_osc_listener_thread()
 
         start_osc_receiver_thread()
+        start_health_monitor()
+        start_tracking_monitor()
 
         web_host = os.getenv("WEB_HOST", "0.0.0.0")
         web_port = int(os.getenv("WEB_PORT", "5000"))
@@ -761,6 +1642,8 @@ def main():
 
     except Exception:
         logger.info("Ritsudo Server is shutting down.")
+    finally:
+        flush_params()
 
 
 # --- MAIN ---
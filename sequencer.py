@@ -0,0 +1,261 @@
+import bisect
+import json
+import threading
+from logger_config import logger
+from osc_params import (
+    get_params_full,
+    get_params_version,
+    validate_param_batch,
+    commit_param_batch,
+)
+from osc_sender import set_next_mode_time, set_next_transition, set_repeat_mode
+from crossfade import CURVES
+
+# Server-side show playlist.
+#
+#   {"loop": true, "entries": [
+#     {"mode": "111", "duration": 120, "params": {"BASE_FREQ": 0.2},
+#      "transition": {"duration": 3.0, "curve": "smoothstep", "wipe": 2.0}},
+#     ...]}
+#
+# Time is advanced by on_frame(), which the sender calls at every frame
+# boundary, so the show runs on the frame clock: it does not move while
+# the sender is stopped or halted. While an entry plays, the next one is
+# prepared (param batch validated, transition checked); the switch itself
+# commits that batch in the sender thread just before the frame that shows
+# the new mode. "params" are applied like a PATCH /params batch, i.e. they
+# are written to params.json as well; a key overridden by some entry is set
+# back to its value at load time by the entries of the same mode that do
+# not override it, so every loop plays the same. A missing "transition"
+# uses the EASING_* params of the mode.
+
+
+class PlaylistError(ValueError):
+    pass
+
+
+def _parse_transition(spec):
+    if spec is None:
+        return None
+    if not isinstance(spec, dict):
+        raise PlaylistError("transition must be an object")
+    duration = float(spec.get("duration", 1.0))
+    curve = str(spec.get("curve", "linear"))
+    wipe = float(spec.get("wipe", 0.0))
+    if duration < 0:
+        raise PlaylistError("transition duration must be >= 0")
+    if curve not in CURVES:
+        raise PlaylistError(f"unknown transition curve '{curve}'")
+    return (duration, curve, wipe)
+
+
+def parse_playlist(data):
+    """Check a playlist (dict as in the file) and return it normalized."""
+    if isinstance(data, list):
+        data = {"entries": data}
+    entries = data.get("entries") if isinstance(data, dict) else None
+    if not entries:
+        raise PlaylistError("playlist has no entries")
+    parsed = []
+    for i, entry in enumerate(entries):
+        try:
+            duration = float(entry["duration"])
+            if duration <= 0:
+                raise PlaylistError("duration must be > 0")
+            params = entry.get("params") or {}
+            if not isinstance(params, dict) or "MODE" in params:
+                raise PlaylistError("params must be an object without MODE")
+            parsed.append(
+                {
+                    "mode": str(entry["mode"]),
+                    "duration": duration,
+                    "params": params,
+                    "transition": _parse_transition(entry.get("transition")),
+                }
+            )
+        except KeyError as e:
+            raise PlaylistError(f"entry {i}: missing {e}") from e
+        except (TypeError, ValueError) as e:
+            raise PlaylistError(f"entry {i}: {e}") from e
+    return {"loop": bool(data.get("loop", True)), "entries": parsed}
+
+
+def load_playlist(path):
+    with open(path, encoding="utf-8") as f:
+        return parse_playlist(json.load(f))
+
+
+class Sequencer:
+    def __init__(self, on_switch=None):
+        self.on_switch = on_switch  # on_switch(index, entry, version)
+        self.lock = threading.Lock()
+        self.playlist = None
+        self.path = None
+        self.starts = []  # start time of each entry in the playlist
+        self.total = 0.0
+        self.base = {}  # mode: {key: value at load time} of overridden keys
+        self.playing = False
+        self.index = None  # entry on air
+        self.elapsed = 0.0  # seconds into that entry
+        self.pending = None  # index to switch to on the next frame
+        self.prepared = None  # (index, params version, validated batch)
+        self.switches = 0
+        self.last_error = None
+
+    def load(self, playlist, path=None):
+        with self.lock:
+            self.playlist = playlist
+            self.path = path
+            self.starts = []
+            t = 0.0
+            for entry in playlist["entries"]:
+                self.starts.append(t)
+                t += entry["duration"]
+            self.total = t
+            params_full = get_params_full()
+            modes = params_full.get("MODES", {})
+            self.base = {}
+            for entry in playlist["entries"]:
+                base = self.base.setdefault(entry["mode"], {})
+                for key in entry["params"]:
+                    current = params_full.get(key, modes.get(entry["mode"], {}).get(key))
+                    if current is not None:
+                        base.setdefault(key, current)
+            self.playing = False
+            self.index = None
+            self.elapsed = 0.0
+            self.pending = None
+            self.prepared = None
+        logger.info(
+            "Playlist loaded: %d entries, %.1f s%s",
+            len(playlist["entries"]),
+            self.total,
+            " (loop)" if playlist["loop"] else "",
+        )
+
+    def _prepare(self, index):
+        # validation is the only real work of a switch; done ahead of time
+        entry = self.playlist["entries"][index]
+        updates = dict(self.base.get(entry["mode"], {}), **entry["params"])
+        updates["MODE"] = entry["mode"]
+        self.prepared = (index, get_params_version(), validate_param_batch(updates))
+
+    def _next_index(self, index):
+        if index + 1 < len(self.playlist["entries"]):
+            return index + 1
+        return 0 if self.playlist["loop"] else None
+
+    def play(self):
+        with self.lock:
+            if self.playlist is None:
+                raise PlaylistError("no playlist loaded")
+            if self.index is None and self.pending is None:
+                self._seek(0, 0.0)
+            self.playing = True
+
+    def pause(self):
+        with self.lock:
+            self.playing = False
+
+    def stop(self):
+        with self.lock:
+            self.playing = False
+            self.index = None
+            self.elapsed = 0.0
+            self.pending = None
+            self.prepared = None
+
+    def _seek(self, index, offset):
+        self.pending = index
+        self.elapsed = offset
+        self._prepare(index)
+
+    def seek(self, position=None, entry=None):
+        """Jump to `position` seconds into the playlist or to entry `entry`."""
+        with self.lock:
+            if self.playlist is None:
+                raise PlaylistError("no playlist loaded")
+            if entry is not None:
+                index = int(entry)
+                if not 0 <= index < len(self.starts):
+                    raise PlaylistError(f"no entry {index}")
+                self._seek(index, 0.0)
+                return
+            position = float(position)
+            if self.playlist["loop"]:
+                position %= self.total
+            position = min(max(position, 0.0), self.total)
+            index = max(bisect.bisect_right(self.starts, position) - 1, 0)
+            self._seek(index, position - self.starts[index])
+
+    def _switch(self, index):
+        prepared_index, version, validated = self.prepared or (None, None, None)
+        if prepared_index != index or version != get_params_version():
+            # params changed since; make sure the batch is still valid
+            self._prepare(index)
+            validated = self.prepared[2]
+        entry = self.playlist["entries"][index]
+        if entry["transition"] is not None:
+            set_next_transition(*entry["transition"])
+        set_repeat_mode()  # same MODE twice in a row still crossfades
+        # after a seek the mode starts where it would be at that position
+        set_next_mode_time(self.elapsed)
+        version = commit_param_batch(validated)
+        self.index = index
+        self.switches += 1
+        logger.info("Playlist entry %d: mode %s", index, entry["mode"])
+        if self.on_switch is not None:
+            self.on_switch(index, entry, version)
+
+        next_index = self._next_index(index)
+        self.prepared = None
+        if next_index is not None:
+            self._prepare(next_index)
+
+    def on_frame(self, dt):
+        with self.lock:
+            if not self.playing or self.playlist is None:
+                return
+            try:
+                if self.pending is not None:
+                    index, self.pending = self.pending, None
+                    self._switch(index)
+                    return
+                self.elapsed += dt
+                duration = self.playlist["entries"][self.index]["duration"]
+                if self.elapsed < duration:
+                    return
+                next_index = self._next_index(self.index)
+                if next_index is None:
+                    self.playing = False
+                    logger.info("Playlist finished.")
+                    return
+                self.elapsed -= duration
+                self._switch(next_index)
+            except Exception as e:
+                # e.g. a mode of the playlist was removed from params.json
+                self.playing = False
+                self.last_error = str(e)
+                logger.error("Playlist stopped: %s", e)
+
+    def status(self):
+        with self.lock:
+            status = {
+                "loaded": self.playlist is not None,
+                "path": self.path,
+                "playing": self.playing,
+                "index": self.index,
+                "pending": self.pending,
+                "elapsed": self.elapsed,
+                "position": None,
+                "total": self.total,
+                "switches": self.switches,
+                "last_error": self.last_error,
+            }
+            if self.index is not None:
+                status["position"] = self.starts[self.index] + self.elapsed
+                status["mode"] = self.playlist["entries"][self.index]["mode"]
+                status["remaining"] = (
+                    self.playlist["entries"][self.index]["duration"] - self.elapsed
+                )
+        return status
@@ -0,0 +1,154 @@
+import contextlib
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from logger_config import logger
+from osc_params import get_params_full
+
+# Modes that carry state from frame to frame.
+#
+# A stateful mode is a class with
+#   init(num_servos)  allocate the state (all buffers, once)
+#   step(dt)          advance by dt and return the (num_servos,) frame
+#   max_step()        largest stable dt (optional)
+# registered in osc_modes.STATEFUL_FUNCS and selected with FUNC like a
+# function mode. make_frame(t) still gets the mode time t; the runner steps
+# the mode on a fixed grid of max_step() from 0 and interpolates between the
+# two grid states around t, so a frame does not depend on how often it was
+# asked for. Going back (the mode restarted) means init() and stepping from 0
+# again. A forward jump longer than STATEFUL_MAX_CATCHUP seconds (a seek)
+# skips ahead and only simulates the last STATEFUL_MAX_CATCHUP seconds.
+#
+# The returned frame is a buffer of the runner, valid until the next call.
+#
+# Instances are per mode class, MODE, num_servos, thread and evaluation
+# context, so evaluating a mode elsewhere (validation, a reloaded osc_modes)
+# does not disturb the one the sender runs. The outgoing mode of a crossfade
+# is a context of its own (stateful_context) and takes over the runners the
+# sender used so far (detach), so a crossfade into the same mode does not
+# share one runner between two times. The sender evaluates stateful modes
+# every frame, not through keyframes.
+
+MAX_STEP = 0.01
+MAX_INSTANCES = 8
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def stateful_context(token):
+    """Stateful modes evaluated in this block use the runners of `token`."""
+    prev = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield
+    finally:
+        _local.token = prev
+
+
+class StatefulMode:
+    t = 0.0  # simulated time, kept by the runner
+
+    def init(self, num_servos):
+        raise NotImplementedError
+
+    def step(self, dt):
+        raise NotImplementedError
+
+    def max_step(self):
+        return MAX_STEP
+
+
+class StatefulRunner:
+    def __init__(self, mode, num_servos, stats):
+        self.mode = mode
+        self.num_servos = num_servos
+        self.stats = stats
+        self.t = None  # grid time of `cur`; `prev` is one step earlier
+        self.h = MAX_STEP
+
+    def _reset(self):
+        self.mode.init(self.num_servos)
+        self.mode.t = self.t = 0.0
+        self.cur = np.array(self.mode.step(0.0), dtype=np.float64)
+        self.prev = self.cur.copy()
+        self.out = self.cur.copy()
+        self.stats["resets"] += 1
+
+    def frame(self, t, max_catchup):
+        mode = self.mode
+        if self.t is None or t < self.t - self.h:
+            self._reset()
+        h = mode.max_step()
+        if t - self.t > max_catchup:
+            skip = math.floor((t - max_catchup - self.t) / h) * h
+            self.stats["skipped_s"] += skip
+            mode.t = self.t = self.t + skip
+        while self.t < t:
+            np.copyto(self.prev, self.cur)
+            np.copyto(self.cur, mode.step(h))
+            self.t += h
+            mode.t = self.t
+            self.h = h
+            self.stats["steps"] += 1
+        # t lies in (self.t - h, self.t]
+        np.subtract(self.cur, self.prev, out=self.out)
+        self.out *= 1.0 - (self.t - t) / self.h
+        self.out += self.prev
+        return self.out
+
+
+class StatefulRegistry:
+    def __init__(self):
+        self.runners = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"instances": 0, "resets": 0, "steps": 0, "skipped_s": 0.0}
+
+    def frame(self, cls, t, num_servos):
+        """Frame of stateful mode `cls` at mode time t."""
+        params_full = get_params_full()
+        key = (
+            cls,
+            str(params_full.get("MODE")),
+            num_servos,
+            threading.get_ident(),
+            getattr(_local, "token", None),
+        )
+        with self.lock:
+            runner = self.runners.get(key)
+            if runner is None:
+                runner = StatefulRunner(cls(), num_servos, self.stats)
+                self.runners[key] = runner
+                self.stats["instances"] += 1
+                while len(self.runners) > MAX_INSTANCES:
+                    self.runners.popitem(last=False)
+                logger.debug("Stateful mode %s started for mode %s", cls.__name__, key[1])
+            else:
+                self.runners.move_to_end(key)
+        # only the thread in the key steps this runner
+        return runner.frame(float(t), float(params_full.get("STATEFUL_MAX_CATCHUP", 10.0)))
+
+    def detach(self, token):
+        """Hand the runners of this thread's default context over to `token`."""
+        ident = threading.get_ident()
+        with self.lock:
+            for key in list(self.runners):
+                if key[3] == ident and key[4] is None:
+                    self.runners[key[:4] + (token,)] = self.runners.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.runners.clear()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["running"] = [
+                {"func": key[0].__name__, "mode": key[1], "t": runner.t}
+                for key, runner in self.runners.items()
+            ]
+        return stats
+
+
+stateful_modes = StatefulRegistry()
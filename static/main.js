@@ -243,18 +243,26 @@ function changeMode(select) {
         });
 }
 
+function onHaltResult(data) {
+    setFormEnabled(true);
+    if (data.result === "OK") {
+        console.log("Halt: last /hardHiZ " + data.last_send_ms + " ms after the request");
+        alert(">>>Emergency Stop Activated<<<");
+    } else {
+        alert("Halt command failed: " + (data.error || ""));
+    }
+    setFormEnabled(false);
+}
+
 function sendHalt() {
+    // the open socket skips a new HTTP connection; fall back if it is down
+    if (socket.connected) {
+        socket.emit('halt', onHaltResult);
+        return;
+    }
     fetch("/halt", { method: "POST" })
         .then(res => res.json())
-        .then(data => {
-            setFormEnabled(true);
-            if (data.result === "OK") {
-                alert(">>>Emergency Stop Activated<<<");
-            } else {
-                alert("Halt command failed: " + (data.error || ""));
-            }
-            setFormEnabled(false);
-        });
+        .then(onHaltResult);
 }
 
 function applyAdvancedVisibility(enabled) {
@@ -333,10 +341,7 @@ function updateServoVisualization(positions, offset) {
     });
 }
 
-socket.on('param_update', function (data) {
-    const { key, value } = data;
-    console.log(`Param updated: ${key} = ${value}`);
-
+function applyParamUpdate(key, value) {
     const outputElement = document.querySelector(`[data-param="${key}"]`);
     const displayElement = document.getElementById(`${key}_out`);
     if (outputElement) {
@@ -350,10 +355,75 @@ socket.on('param_update', function (data) {
         displayElement.classList.add('updated');
         setTimeout(() => displayElement.classList.remove('updated'), 100);
     }
+}
+
+socket.on('param_update', function (data) {
+    const { key, value } = data;
+    console.log(`Param updated: ${key} = ${value}`);
+    applyParamUpdate(key, value);
 });
 
-socket.on('servo_positions', function (data) {
-    updateServoVisualization(data.positions, data.offset);
+// One event per server tick carrying all coalesced updates
+socket.on('param_update_batch', function (data) {
+    const updates = data.updates || {};
+    console.log(`Params updated: ${Object.keys(updates).join(', ')}`);
+    Object.entries(updates).forEach(([key, value]) => applyParamUpdate(key, value));
+});
+
+// Binary position stream (see position_stream.py for the format):
+// header uint8 kind, uint8 reserved, uint16 count, uint32 seq,
+// then a keyframe (int32 offset + int32[count]) or int16/int32 deltas
+// against the last keyframe.
+const POS_KEYFRAME = 0;
+const POS_DELTA16 = 1;
+const POS_DELTA32 = 2;
+let positionKeyframe = null;
+let positionOffset = 0;
+
+function decodeServoPositions(data) {
+    const view = data instanceof ArrayBuffer
+        ? new DataView(data)
+        : new DataView(data.buffer, data.byteOffset, data.byteLength);
+    const kind = view.getUint8(0);
+    const count = view.getUint16(2, true);
+    const HEADER_SIZE = 8;
+
+    if (kind === POS_KEYFRAME) {
+        positionOffset = view.getInt32(HEADER_SIZE, true);
+        positionKeyframe = new Int32Array(count);
+        for (let i = 0; i < count; i++) {
+            positionKeyframe[i] = view.getInt32(HEADER_SIZE + 4 + i * 4, true);
+        }
+        return positionKeyframe;
+    }
+    if (!positionKeyframe || positionKeyframe.length !== count) return null;
+
+    const positions = new Int32Array(count);
+    for (let i = 0; i < count; i++) {
+        const delta = kind === POS_DELTA16
+            ? view.getInt16(HEADER_SIZE + i * 2, true)
+            : view.getInt32(HEADER_SIZE + i * 4, true);
+        positions[i] = positionKeyframe[i] + delta;
+    }
+    return positions;
+}
+
+socket.on('servo_positions_bin', function (data) {
+    const positions = decodeServoPositions(data);
+    if (positions) {
+        updateServoVisualization(Array.from(positions), positionOffset);
+    }
+});
+
+socket.on('board_health', function (data) {
+    (data.boards || []).forEach(board => {
+        const msg = `Board ${board.board}: ${board.state} (latency ${board.latency_ms} ms, loss ${board.loss})`;
+        if (board.state === 'healthy') {
+            console.log(msg);
+        } else {
+            console.warn(msg);
+        }
+    });
 });
 
 // Handle server reconnection - reload page when server restarts
@@ -379,7 +449,7 @@ socket.on('disconnect', function() {
 window.addEventListener('DOMContentLoaded', function () {
 
     window.addEventListener('keydown', function (event) {
-        if (event.key === 'Escape') {
+        if (event.key === 'Escape' && !event.repeat) {
             sendHalt();
         }
     });
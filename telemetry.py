@@ -0,0 +1,219 @@
+import threading
+import time
+import numpy as np
+from logger_config import logger
+
+# Fixed-memory history of what we commanded and what the boards reported.
+# Both rings are indexed by physical motor (motorID - 1), i.e. AFTER
+# MOTOR_POSITION_MAPPING, so commanded and reported values line up.
+
+DEFAULT_COMMANDED_CAPACITY = 60000  # ~10 min at 100 fps
+DEFAULT_REPORTED_CAPACITY = 60000
+
+
+def _ordered_index(head, count, capacity):
+    # ring positions of the stored rows, oldest first
+    start = (head - count) % capacity
+    return (start + np.arange(count)) % capacity
+
+
+class FrameRing:
+    """Ring of full frames: one timestamp and int32[width] per row."""
+
+    def __init__(self, capacity, width):
+        self.capacity = int(capacity)
+        self.width = int(width)
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.values = np.zeros((self.capacity, self.width), dtype=np.int32)
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, t, vals):
+        with self.lock:
+            self.times[self.head] = t
+            self.values[self.head, :] = vals
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def window(self, t0, t1):
+        with self.lock:
+            idx = _ordered_index(self.head, self.count, self.capacity)
+            times = self.times[idx]
+            lo, hi = np.searchsorted(times, [t0, t1], side="left")
+            sel = idx[lo:hi]
+            return self.times[sel].copy(), self.values[sel].copy()
+
+
+class SampleRing:
+    """Ring of single-motor samples: (timestamp, motor index, int32 value)."""
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.motors = np.zeros(self.capacity, dtype=np.int16)
+        self.values = np.zeros(self.capacity, dtype=np.int32)
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, t, motor_idx, value):
+        with self.lock:
+            self.times[self.head] = t
+            self.motors[self.head] = motor_idx
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def window(self, t0, t1):
+        with self.lock:
+            idx = _ordered_index(self.head, self.count, self.capacity)
+            times = self.times[idx]
+            lo, hi = np.searchsorted(times, [t0, t1], side="left")
+            sel = idx[lo:hi]
+            return (
+                self.times[sel].copy(),
+                self.motors[sel].copy(),
+                self.values[sel].copy(),
+            )
+
+
+def _buckets(t0, t1, points):
+    points = max(int(points), 1)
+    edges_dt = (t1 - t0) / points
+    centres = t0 + (np.arange(points) + 0.5) * edges_dt
+    return points, edges_dt, centres
+
+
+def downsample_frames(times, values, t0, t1, points):
+    """Like downsample() for full frames; uses reduceat on the sorted rows."""
+    points, edges_dt, centres = _buckets(t0, t1, points)
+    shape = (points, values.shape[1])
+    mins = np.full(shape, np.nan)
+    maxs = np.full(shape, np.nan)
+    means = np.full(shape, np.nan)
+    if len(times) > 0 and edges_dt > 0:
+        bucket = np.clip(((times - t0) / edges_dt).astype(np.int64), 0, points - 1)
+        used, starts = np.unique(bucket, return_index=True)
+        counts = np.diff(np.append(starts, len(bucket)))
+        mins[used] = np.minimum.reduceat(values, starts, axis=0)
+        maxs[used] = np.maximum.reduceat(values, starts, axis=0)
+        means[used] = (
+            np.add.reduceat(values.astype(np.float64), starts, axis=0)
+            / counts[:, None]
+        )
+    return centres, mins, maxs, means
+
+
+def downsample(times, motors, values, t0, t1, points, width):
+    """Bucket samples into `points` time buckets per motor.
+
+    Returns bucket centre times and (points, width) arrays of min/max/mean,
+    NaN where a bucket got no sample.
+    """
+    points, edges_dt, centres = _buckets(t0, t1, points)
+
+    mins = np.full(points * width, np.inf)
+    maxs = np.full(points * width, -np.inf)
+    sums = np.zeros(points * width)
+    counts = np.zeros(points * width, dtype=np.int64)
+    if len(times) > 0 and edges_dt > 0:
+        bucket = np.clip(((times - t0) / edges_dt).astype(np.int64), 0, points - 1)
+        flat = bucket * width + motors
+        vals = values.astype(np.float64)
+        np.minimum.at(mins, flat, vals)
+        np.maximum.at(maxs, flat, vals)
+        np.add.at(sums, flat, vals)
+        np.add.at(counts, flat, 1)
+
+    empty = counts == 0
+    mins[empty] = np.nan
+    maxs[empty] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(empty, np.nan, sums / np.maximum(counts, 1))
+    shape = (points, width)
+    return centres, mins.reshape(shape), maxs.reshape(shape), means.reshape(shape)
+
+
+commanded = None
+reported = None
+_init_lock = threading.Lock()
+
+
+def init_telemetry(num_servos, commanded_capacity=None, reported_capacity=None):
+    global commanded, reported
+    with _init_lock:
+        commanded = FrameRing(
+            commanded_capacity or DEFAULT_COMMANDED_CAPACITY, num_servos
+        )
+        reported = SampleRing(reported_capacity or DEFAULT_REPORTED_CAPACITY)
+    logger.info(
+        "Telemetry initialized: %d commanded frames, %d reported samples.",
+        commanded.capacity,
+        reported.capacity,
+    )
+
+
+def record_commanded(mapped_vals, t=None):
+    ring = commanded
+    if ring is None or len(mapped_vals) != ring.width:
+        return
+    ring.append(time.time() if t is None else t, mapped_vals)
+
+
+def record_reported(motor_id, position, t=None):
+    ring = reported
+    if ring is None or commanded is None:
+        return
+    if motor_id < 1 or motor_id > commanded.width:
+        return
+    ring.append(time.time() if t is None else t, motor_id - 1, position)
+
+
+def get_commanded_window(t0, t1):
+    """Raw (times, values) of the commanded frames in [t0, t1)."""
+    ring = commanded
+    if ring is None:
+        return None
+    return ring.window(t0, t1)
+
+
+def get_reported_window(t0, t1):
+    """Raw (times, motor indices, values) of the reported samples in [t0, t1)."""
+    ring = reported
+    if ring is None:
+        return None
+    return ring.window(t0, t1)
+
+
+def query_commanded(t0, t1, points):
+    ring = commanded
+    if ring is None:
+        return None
+    times, values = ring.window(t0, t1)
+    return downsample_frames(times, values, t0, t1, points)
+
+
+def query_reported(t0, t1, points):
+    ring = reported
+    if ring is None or commanded is None:
+        return None
+    times, motors, values = ring.window(t0, t1)
+    return downsample(times, motors, values, t0, t1, points, commanded.width)
+
+
+def query_telemetry(kind, t0, t1, points):
+    if kind == "commanded":
+        return query_commanded(t0, t1, points)
+    if kind == "reported":
+        return query_reported(t0, t1, points)
+    raise ValueError(f"unknown telemetry kind '{kind}'")
+
+
+def get_telemetry_stats() -> dict:
+    return {
+        "commanded_frames": 0 if commanded is None else commanded.count,
+        "commanded_capacity": 0 if commanded is None else commanded.capacity,
+        "reported_samples": 0 if reported is None else reported.count,
+        "reported_capacity": 0 if reported is None else reported.capacity,
+    }
@@ -0,0 +1,171 @@
+import bisect
+import math
+import zlib
+import numpy as np
+
+# Deterministic u(t) for the u-rate modulation.
+#
+# The rate du/dt ramps (at `accel` per second) towards a target that is
+# redrawn every 1 / U_FREQUENTNESS seconds from
+# U_AVERAGE +- U_WIDTH / 2. Target k comes from a generator seeded with
+# (seed, k // DRAW_BLOCK), so the schedule depends only on the seed and the params, not
+# on the run history. The schedule is stored as knots (t_j, u_j, r_j, a_j)
+# with a constant rate slope a_j between knots; u(t) is quadratic in each
+# piece and found by bisecting t_j. Knots are generated lazily as t grows.
+#
+# A change of the U_* params takes effect at the time it is applied: the
+# knots after that time are dropped and the schedule continues from the
+# u and rate there, so it stays reproducible for the same param history.
+# The current target is redrawn with the new params right away.
+#
+# The sender calls forget(t_mode - RETENTION) every frame, so a mode running
+# for days keeps a bounded number of knots; u before the first kept knot is
+# no longer exact.
+
+# the sender used to ramp the rate by 0.01 per frame
+DEFAULT_ACCEL_PER_FRAME = 0.01
+DRAW_BLOCK = 1024
+RETENTION = 60.0  # seconds of knots the sender keeps behind t_mode
+FORGET_BATCH = 64  # knots dropped at once at the least
+
+
+def mode_seed(mode_id, params_mode):
+    seed = params_mode.get("U_SEED")
+    if seed is not None:
+        return int(seed)
+    return zlib.crc32(str(mode_id).encode("utf-8"))
+
+
+def u_settings(params_full, params_mode):
+    """(U_AVERAGE, U_WIDTH, U_FREQUENTNESS, accel per second) of a mode."""
+    accel = params_mode.get("U_ACCEL", params_full.get("U_ACCEL"))
+    if accel is None:
+        accel = DEFAULT_ACCEL_PER_FRAME * float(params_full.get("RATE_fps", 24))
+    return (
+        float(params_mode.get("U_AVERAGE", 1.0)),
+        float(params_mode.get("U_WIDTH", 1.0)),
+        float(params_mode.get("U_FREQUENTNESS", 0.1)),
+        float(accel),
+    )
+
+
+class UTimebase:
+    def __init__(self, seed, settings=(1.0, 1.0, 0.1, 1.0)):
+        self.seed = seed
+        average = settings[0]
+        self.t = [0.0]
+        self.u = [0.0]
+        self.rate = [max(average, 0.0)]
+        self.slope = [0.0]
+        self.settings = None
+        self.k = -1  # draw of the current target; -1: U_AVERAGE at the start
+        self.target = max(average, 0.0)
+        self.ramp_end = math.inf
+        self.next_draw = math.inf
+        self._block = (None, None)  # (index, uniform draws)
+        self._arrays = None  # knots as numpy arrays for u_at(array), until they change
+        self.configure(0.0, settings)
+
+    @classmethod
+    def for_mode(cls, mode_id, params_full, params_mode):
+        return cls(mode_seed(mode_id, params_mode), u_settings(params_full, params_mode))
+
+    def _unit(self, k):
+        block, draws = self._block
+        if block != k // DRAW_BLOCK:
+            block = k // DRAW_BLOCK
+            draws = np.random.default_rng([self.seed & 0xFFFFFFFF, block]).random(DRAW_BLOCK)
+            self._block = (block, draws)
+        return float(draws[k % DRAW_BLOCK])
+
+    def _target(self, k):
+        average, width, frequentness, _ = self.settings
+        if k < 0 or width <= 0.0 or frequentness <= 0.0:
+            return max(average, 0.0)
+        return max(average + (self._unit(k) - 0.5) * width, 0.0)
+
+    def _eval(self, j, t):
+        dt = t - self.t[j]
+        return (
+            self.u[j] + self.rate[j] * dt + 0.5 * self.slope[j] * dt * dt,
+            self.rate[j] + self.slope[j] * dt,
+        )
+
+    def _push(self, t, u, rate):
+        # new knot at t heading for self.target
+        accel = self.settings[3]
+        if rate == self.target or accel <= 0.0:
+            slope, self.ramp_end = 0.0, math.inf
+            if accel <= 0.0:
+                rate = self.target
+        else:
+            slope = math.copysign(accel, self.target - rate)
+            self.ramp_end = t + abs(self.target - rate) / accel
+        self._arrays = None
+        if self.t[-1] == t:
+            self.u[-1], self.rate[-1], self.slope[-1] = u, rate, slope
+        else:
+            self.t.append(t)
+            self.u.append(u)
+            self.rate.append(rate)
+            self.slope.append(slope)
+
+    def _extend(self, t_until):
+        while True:
+            t_event = min(self.ramp_end, self.next_draw)
+            if t_event > t_until:
+                return
+            u, rate = self._eval(len(self.t) - 1, t_event)
+            if t_event == self.ramp_end:
+                rate = self.target
+            if t_event == self.next_draw:
+                self.k += 1
+                self.target = self._target(self.k)
+                self.next_draw += 1.0 / self.settings[2]
+            self._push(t_event, u, rate)
+
+    def configure(self, t, settings):
+        """Apply (U_AVERAGE, U_WIDTH, U_FREQUENTNESS, accel) from time t on."""
+        settings = tuple(float(s) for s in settings)
+        if settings == self.settings:
+            return
+        old = self.settings
+        self._extend(t)
+        j = bisect.bisect_right(self.t, t) - 1
+        u, rate = self._eval(j, t)
+        del self.t[j + 1 :], self.u[j + 1 :], self.rate[j + 1 :], self.slope[j + 1 :]
+        self._arrays = None
+        self.settings = settings
+        frequentness = settings[2]
+        if frequentness <= 0.0 or settings[1] <= 0.0:
+            self.next_draw = math.inf
+        elif old is None or old[2] != frequentness or self.next_draw == math.inf:
+            self.next_draw = t + 1.0 / frequentness
+        self.target = self._target(self.k)
+        self._push(t, u, rate)
+
+    def u_at(self, t):
+        """u at mode time t (seconds since the mode started); t may be an array."""
+        if np.ndim(t) == 0:
+            self._extend(t)
+            return self._eval(bisect.bisect_right(self.t, t) - 1, t)[0]
+        t = np.asarray(t, dtype=np.float64)
+        self._extend(float(np.max(t)))
+        if self._arrays is None:
+            self._arrays = tuple(np.asarray(v) for v in (self.t, self.u, self.rate, self.slope))
+        knots, us, rates, slopes = self._arrays
+        j = np.maximum(np.searchsorted(knots, t, side="right") - 1, 0)
+        dt = t - knots[j]
+        return us[j] + rates[j] * dt + 0.5 * slopes[j] * dt * dt
+
+    def forget(self, t):
+        """Drop the knots only needed for times before t."""
+        j = bisect.bisect_right(self.t, t) - 1
+        if j < FORGET_BATCH:
+            return
+        del self.t[:j], self.u[:j], self.rate[:j], self.slope[:j]
+        self._arrays = None
+
+    def rate_at(self, t):
+        self._extend(t)
+        return self._eval(bisect.bisect_right(self.t, t) - 1, t)[1]
@@ -0,0 +1,241 @@
+import threading
+import time
+import numpy as np
+from logger_config import logger
+import telemetry
+
+# Closed-loop comparison of what we commanded with what the boards report.
+#
+# The commanded history is the telemetry ring (every frame that was sent,
+# physical motor order), the reported one comes from /position replies to
+# a periodic /getPosition 255. Both are resampled onto a common grid:
+#   latency  : lag that maximizes the cross-correlation of the commanded
+#              and reported velocities (0 .. max_lag)
+#   rms error: reported - commanded, raw and shifted by that latency
+# Reported samples are timestamped on receipt, so the latency includes
+# the way back over the network (usually well below one frame).
+
+
+def resample_commanded(times, values, grid):
+    """Hold each commanded frame until the next one; (len(grid), width)"""
+    idx = np.searchsorted(times, grid, side="right") - 1
+    valid = idx >= 0
+    return values[np.maximum(idx, 0)].astype(np.float64), valid
+
+
+def resample_reported(times, motors, values, grid, width, min_samples):
+    """Linear interpolation per motor, NaN outside its first/last sample"""
+    rep = np.full((len(grid), width), np.nan)
+    for m in range(width):
+        sel = motors == m
+        if np.count_nonzero(sel) < min_samples:
+            continue
+        t = times[sel]
+        inside = (grid >= t[0]) & (grid <= t[-1])
+        rep[inside, m] = np.interp(grid[inside], t, values[sel])
+    return rep
+
+
+def estimate_tracking(
+    cmd_times,
+    cmd_values,
+    rep_times,
+    rep_motors,
+    rep_values,
+    t0,
+    t1,
+    dt=0.01,
+    max_lag=0.5,
+    min_samples=5,
+    min_correlation=0.3,
+):
+    """Per motor latency [s], peak correlation and tracking errors.
+
+    Returns a dict of float arrays of length width (NaN = not enough data,
+    or the motor did not move in the window).
+    """
+    width = cmd_values.shape[1]
+    nan = np.full(width, np.nan)
+    result = {
+        "latency_s": nan.copy(),
+        "correlation": nan.copy(),
+        "rms_error": nan.copy(),
+        "rms_error_aligned": nan.copy(),
+        "max_error": nan.copy(),
+        "samples": np.bincount(
+            rep_motors.astype(np.int64), minlength=width
+        )[:width],
+    }
+    grid = np.arange(t0, t1, dt)
+    n_lags = max(int(round(max_lag / dt)), 0)
+    if len(cmd_times) == 0 or len(grid) < n_lags + 3:
+        return result
+
+    cmd, cmd_valid = resample_commanded(cmd_times, cmd_values, grid)
+    rep = resample_reported(rep_times, rep_motors, rep_values, grid, width, min_samples)
+    valid = cmd_valid[:, None] & ~np.isnan(rep)
+    rep = np.where(valid, rep, 0.0)
+    n_valid = valid.sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        err = np.where(valid, rep - cmd, 0.0)
+        result["rms_error"] = np.where(
+            n_valid > 0, np.sqrt((err * err).sum(axis=0) / n_valid), np.nan
+        )
+        result["max_error"] = np.where(n_valid > 0, np.abs(err).max(axis=0), np.nan)
+
+        # velocities, only between two valid grid points
+        dvalid = valid[1:] & valid[:-1]
+        dc = np.where(dvalid, np.diff(cmd, axis=0), 0.0)
+        dr = np.where(dvalid, np.diff(rep, axis=0), 0.0)
+        corr = np.full((n_lags + 1, width), -np.inf)
+        for k in range(n_lags + 1):
+            c = dc[: len(dc) - k]
+            r = dr[k:]
+            den = np.sqrt((c * c).sum(axis=0) * (r * r).sum(axis=0))
+            corr[k] = np.where(den > 0, (c * r).sum(axis=0) / den, -np.inf)
+
+    best = np.argmax(corr, axis=0)
+    peak = corr[best, np.arange(width)]
+    ok = peak >= min_correlation
+    result["correlation"] = np.where(np.isfinite(peak), peak, np.nan)
+    result["latency_s"] = np.where(ok, best * dt, np.nan)
+
+    # error against the command `best` grid steps earlier
+    src = np.arange(len(grid))[:, None] - best[None, :]
+    shifted_ok = valid & (src >= 0) & cmd_valid[np.maximum(src, 0)]
+    cmd_shifted = cmd[np.maximum(src, 0), np.arange(width)[None, :]]
+    err = np.where(shifted_ok, rep - cmd_shifted, 0.0)
+    n_shifted = shifted_ok.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["rms_error_aligned"] = np.where(
+            ok & (n_shifted > 0), np.sqrt((err * err).sum(axis=0) / n_shifted), np.nan
+        )
+    return result
+
+
+def _round_or_none(v, digits):
+    return None if v != v else round(float(v), digits)
+
+
+class TrackingMonitor:
+    def __init__(
+        self,
+        send_poll,
+        on_alert=None,
+        poll_interval=0.05,
+        interval=1.0,
+        window=5.0,
+        max_lag=0.5,
+        resolution=0.01,
+        lag_alert_ms=200.0,
+        rms_alert=None,
+    ):
+        self.send_poll = send_poll
+        self.on_alert = on_alert
+        self.poll_interval = poll_interval
+        self.interval = interval
+        self.window = window
+        self.max_lag = max_lag
+        self.resolution = resolution
+        self.lag_alert_ms = lag_alert_ms
+        self.rms_alert = rms_alert
+        self.lock = threading.Lock()
+        self.estimate = None
+        self.updated = None
+        self.alerts = set()  # motor indices currently in alert
+
+    def _lagging(self, latency_ms, rms, scale=1.0):
+        if latency_ms == latency_ms and latency_ms > self.lag_alert_ms * scale:
+            return True
+        return bool(self.rms_alert) and rms == rms and rms > self.rms_alert * scale
+
+    def update(self, now=None):
+        now = time.time() if now is None else now
+        t0 = now - self.window
+        # the commanded frame in effect at t0 - max_lag is needed as well
+        cmd = telemetry.get_commanded_window(t0 - self.max_lag - 1.0, now)
+        rep = telemetry.get_reported_window(t0, now)
+        if cmd is None or rep is None:
+            return None
+        est = estimate_tracking(
+            *cmd, *rep, t0, now, dt=self.resolution, max_lag=self.max_lag
+        )
+
+        changes = []
+        with self.lock:
+            for m in range(len(est["latency_s"])):
+                latency_ms = est["latency_s"][m] * 1000
+                rms = est["rms_error_aligned"][m]
+                if m not in self.alerts and self._lagging(latency_ms, rms):
+                    self.alerts.add(m)
+                    changes.append((m, True))
+                elif m in self.alerts and (
+                    latency_ms == latency_ms and not self._lagging(latency_ms, rms, 0.8)
+                ):
+                    # hysteresis; an idle motor (no latency) keeps its state
+                    self.alerts.discard(m)
+                    changes.append((m, False))
+            self.estimate = est
+            self.updated = now
+        if self.on_alert is not None:
+            for m, active in changes:
+                try:
+                    self.on_alert(m + 1, active, self.motor_info(m))
+                except Exception as e:
+                    logger.error("Tracking alert callback error: %s", e)
+        return est
+
+    def motor_info(self, m):
+        with self.lock:
+            est = self.estimate
+            alert = m in self.alerts
+        if est is None:
+            return {"motor": m + 1, "alert": alert}
+        return {
+            "motor": m + 1,
+            "latency_ms": _round_or_none(est["latency_s"][m] * 1000, 1),
+            "correlation": _round_or_none(est["correlation"][m], 3),
+            "rms_error": _round_or_none(est["rms_error"][m], 1),
+            "rms_error_aligned": _round_or_none(est["rms_error_aligned"][m], 1),
+            "max_error": _round_or_none(est["max_error"][m], 1),
+            "samples": int(est["samples"][m]),
+            "alert": alert,
+        }
+
+    def snapshot(self):
+        with self.lock:
+            est = self.estimate
+            updated = self.updated
+        motors = [] if est is None else [self.motor_info(m) for m in range(len(est["latency_s"]))]
+        latencies = [] if est is None else est["latency_s"][~np.isnan(est["latency_s"])]
+        return {
+            "updated": updated,
+            "window_s": self.window,
+            "lag_alert_ms": self.lag_alert_ms,
+            "rms_alert": self.rms_alert,
+            "median_latency_ms": (
+                None if len(latencies) == 0 else round(float(np.median(latencies)) * 1000, 1)
+            ),
+            "alerts": sorted(m + 1 for m in self.alerts),
+            "motors": motors,
+        }
+
+    def run(self, stop_event, enabled=lambda: True):
+        next_update = time.time() + self.interval
+        while not stop_event.is_set():
+            if not enabled():
+                stop_event.wait(self.interval)
+                next_update = time.time() + self.interval
+                continue
+            try:
+                self.send_poll()
+            except Exception as e:
+                logger.debug("Tracking poll failed: %s", e)
+            if time.time() >= next_update:
+                try:
+                    self.update()
+                except Exception as e:
+                    logger.error("Tracking estimate error: %s", e)
+                next_update = time.time() + self.interval
+            stop_event.wait(self.poll_interval)
@@ -5,6 +5,7 @@ import os
 import importlib
 from mpl_toolkits.mplot3d import Axes3D  # 3Dプロット用
 from osc_params import get_params_full, NUM_SERVOS
+from timebase import UTimebase
 import osc_modes
 
 plt.style.use("dark_background")
@@ -30,17 +31,20 @@ def plot_make_frame(fig=None, ax=None):
         group_indices[i % 3].append(i)
     group_sizes = [len(g) for g in group_indices]
 
+    mode_id = str(get_params_full().get("MODE", "1"))
+    mode_info = get_params_full()["MODES"][mode_id]
+
+    # same u(t) as the sender, including the seeded u-rate modulation
+    timebase = UTimebase.for_mode(mode_id, get_params_full(), mode_info)
     all_vals = []
     times = np.linspace(0, duration, num_frames)
-    for t in times:
-        vals = osc_modes.make_frame(t, num_servos) - get_params_full().get(
+    for u in timebase.u_at(times):
+        vals = osc_modes.make_frame(u, num_servos) - get_params_full().get(
             "STROKE_OFFSET", 0
         )
         all_vals.append(vals)
     all_vals = np.array(all_vals)  # shape: (num_frames, num_servos)
 
-    mode_id = str(get_params_full().get("MODE", "1"))
-    mode_info = get_params_full()["MODES"][mode_id]
     mode_name = mode_info.get("NAME", f"Mode {mode_id}")
     main_params = f"BASE_FREQ={mode_info.get('BASE_FREQ')}, PHASE_RATE={mode_info.get('PHASE_RATE')}, STROKE_LENGTH={mode_info.get('STROKE_LENGTH')}"
 
@@ -0,0 +1,221 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from logger_config import logger
+from osc_params import get_params_full, use_mode_params
+from layout import get_layout
+
+# Wavetables for the periodic FUNCs of osc_modes.
+#
+# A FUNC listed in osc_modes.PERIODIC_FUNCS is exactly periodic in t with
+# cycle_from_params(). With WAVETABLE_SAMPLES > 0 one cycle of it is
+# rendered into a (samples + 1, num_servos) table (the last row repeats the
+# first) and frames are linearly interpolated from that, so a frame costs
+# the same whatever the FUNC computes.
+#
+# Tables are keyed by FUNC (the function object, so a reloaded osc_modes
+# gets new ones), num_servos, samples, the params of the mode and the layout
+# (azimuths etc. depend on LAYOUT_FILE, also after clear_layout_cache()), and are
+# rendered in a background thread once those have been requested for
+# WAVETABLE_SETTLE seconds (a fader being moved does not render a table per
+# frame). Until then the FUNC is evaluated directly. Rendering also measures
+# the interpolation error at interval midpoints; a table whose error times
+# STROKE_LENGTH exceeds WAVETABLE_MAX_ERROR steps is not used. Tables are
+# kept in LRU order within WAVETABLE_BUDGET_MB.
+
+ERROR_CHECKS = 64  # midpoints compared per table
+MAX_WANTED = 64  # settling keys remembered
+
+
+class Wavetable:
+    def __init__(self, func, layout, mode_id, period, table, max_error):
+        self.func = func  # keeps id(func) in the key unique
+        self.layout = layout  # same for id(layout)
+        self.mode_id = mode_id
+        self.period = period
+        self.table = table
+        self.samples = len(table) - 1
+        self.max_error = max_error
+
+    def lookup(self, t):
+        x = (t / self.period) % 1.0 * self.samples
+        i = min(int(x), self.samples - 1)
+        f = x - i
+        row = self.table[i]
+        return row + (self.table[i + 1] - row) * f
+
+
+def stack_tables(tables):
+    """(stacked tables, periods) for stack_lookup; tables of equal samples."""
+    return np.stack([w.table for w in tables]), np.array([w.period for w in tables])
+
+
+def stack_lookup(stack, periods, ts):
+    """tables[l].lookup(ts[l]) for all l at once, on stack_tables(tables)."""
+    samples = stack.shape[1] - 1
+    x = (np.asarray(ts, dtype=np.float64) / periods) % 1.0 * samples
+    i = np.minimum(x.astype(int), samples - 1)
+    f = (x - i)[:, None]
+    rows = np.arange(len(stack))
+    lo = stack[rows, i]
+    return lo + (stack[rows, i + 1] - lo) * f
+
+
+def render_table(func, period, samples, num_servos):
+    """One cycle of func; returns (table, max interpolation error)."""
+    step = period / samples
+    table = np.empty((samples + 1, num_servos))
+    for j in range(samples):
+        table[j] = func(j * step, num_servos)
+    table[samples] = table[0]
+
+    checks = np.unique(np.linspace(0, samples - 1, min(ERROR_CHECKS, samples)).astype(int))
+    err = 0.0
+    for j in checks:
+        exact = np.asarray(func((j + 0.5) * step, num_servos), dtype=float)
+        err = max(err, float(np.max(np.abs(exact - 0.5 * (table[j] + table[j + 1])))))
+    # a FUNC that is not periodic with `period` shows up here
+    wrap = np.asarray(func(period, num_servos), dtype=float)
+    err = max(err, float(np.max(np.abs(wrap - table[0]))))
+    return table, err
+
+
+class WavetableCache:
+    def __init__(self):
+        self.tables = OrderedDict()  # key: Wavetable
+        self.rejected = {}  # key: error of a table that was not good enough
+        self.lock = threading.Lock()
+        self.wanted = {}  # key: first request time
+        self.rendering = None  # key
+        self._mode_hashes = {}  # id(mode params dict): (dict, its hash)
+        self.bytes = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "renders": 0,
+            "rejected": 0,
+            "evictions": 0,
+            "last_render_ms": None,
+        }
+
+    def _params_hash(self, params_full):
+        # params are copy-on-write, so an unchanged mode keeps its dict object
+        mode = params_full.get("MODES", {}).get(str(params_full.get("MODE")), {})
+        memo = self._mode_hashes.get(id(mode))
+        if memo is None or memo[0] is not mode:
+            if len(self._mode_hashes) >= MAX_WANTED:
+                self._mode_hashes = {}
+            memo = (mode, json.dumps(mode, sort_keys=True))
+            self._mode_hashes[id(mode)] = memo
+        return memo[1]
+
+    def lookup(self, func, period, t, num_servos):
+        """Interpolated func(t), or None while there is no usable table."""
+        table = self.table(func, period, num_servos)
+        return None if table is None else table.lookup(t)
+
+    def table(self, func, period, num_servos):
+        """The Wavetable of func for the current params, or None (yet)."""
+        params_full = get_params_full()
+        samples = int(params_full.get("WAVETABLE_SAMPLES", 0))
+        if samples <= 0:
+            return None
+        layout = get_layout(params_full)
+        key = (id(func), num_servos, samples, self._params_hash(params_full), id(layout))
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None:
+                self.tables.move_to_end(key)
+                self.stats["hits"] += 1
+                return table
+            self.stats["misses"] += 1
+            if key in self.rejected or self.rendering is not None:
+                return None
+            now = time.time()
+            since = self.wanted.get(key)
+            if since is None:
+                # several layers of a mode settle at the same time
+                self.wanted[key] = now
+                while len(self.wanted) > MAX_WANTED:
+                    del self.wanted[next(iter(self.wanted))]
+                return None
+            if now - since < float(params_full.get("WAVETABLE_SETTLE", 0.5)):
+                return None
+            del self.wanted[key]
+            self.rendering = key
+        threading.Thread(
+            target=self._render,
+            args=(key, func, layout, period, samples, num_servos, params_full),
+            daemon=True,
+        ).start()
+        return None
+
+    def _render(self, key, func, layout, period, samples, num_servos, params_full):
+        mode_id = params_full.get("MODE")
+        t0 = time.perf_counter()
+        try:
+            with use_mode_params(mode_id, params_full), np.errstate(all="ignore"):
+                table, err = render_table(func, period, samples, num_servos)
+        except Exception as e:
+            logger.warning("Wavetable for mode %s not rendered: %s", mode_id, e)
+            table, err = None, float("inf")
+        render_ms = (time.perf_counter() - t0) * 1000
+
+        mode = params_full.get("MODES", {}).get(str(mode_id), {})
+        err_steps = err * float(mode.get("STROKE_LENGTH", 20000))
+        max_error = float(params_full.get("WAVETABLE_MAX_ERROR", 10.0))
+        budget = float(params_full.get("WAVETABLE_BUDGET_MB", 16.0)) * 1024 * 1024
+        with self.lock:
+            self.rendering = None
+            self.stats["last_render_ms"] = render_ms
+            if table is None or not err_steps <= max_error:
+                self.rejected[key] = err_steps
+                self.stats["rejected"] += 1
+                logger.info(
+                    "Wavetable for mode %s rejected: error %.1f > %.1f steps",
+                    mode_id, err_steps, max_error,
+                )
+                return
+            self.stats["renders"] += 1
+            self.tables[key] = Wavetable(func, layout, str(mode_id), period, table, err_steps)
+            self.bytes += table.nbytes
+            while self.bytes > budget and len(self.tables) > 1:
+                _, old = self.tables.popitem(last=False)
+                self.bytes -= old.table.nbytes
+                self.stats["evictions"] += 1
+        logger.info(
+            "Wavetable for mode %s: %d samples in %.0f ms, error %.2f steps",
+            mode_id, samples, render_ms, err_steps,
+        )
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.rejected.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["bytes"] = self.bytes
+            stats["rendering"] = self.rendering is not None
+            stats["tables"] = [
+                {
+                    "mode": w.mode_id,
+                    "func": w.func.__name__,
+                    "samples": w.samples,
+                    "period": w.period,
+                    "max_error_steps": w.max_error,
+                    "bytes": w.table.nbytes,
+                }
+                for w in self.tables.values()
+            ]
+            stats["rejected_errors"] = list(self.rejected.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        return stats
+
+
+wavetables = WavetableCache()